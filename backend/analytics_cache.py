@@ -0,0 +1,404 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func
+
+from models import db, CacheInvalidation, Expense, Revenue
+from archive import load_columns
+from replicas import use_primary
+
+# date.toordinal() of 1970-01-01, for converting ordinals to datetime64
+EPOCH_ORDINAL = 719163
+
+CACHE_SOURCES = {
+    'expenses': {'model': Expense, 'label': 'category'},
+    'revenues': {'model': Revenue, 'label': 'source'},
+}
+
+GROUP_BY = ('category', 'month', 'year', 'category_month')
+
+# Builds raced by a write are retried this many times before one is built under the lock
+BUILD_ATTEMPTS = 3
+
+# Published invalidations are kept this long; a process that has not polled since clears everything
+INVALIDATION_RETENTION = timedelta(days=1)
+
+
+def to_ordinal(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.toordinal()
+
+
+def ordinals_to_months(ordinals):
+    """Months since 1970-01 for an array of date ordinals"""
+    days = (np.asarray(ordinals, dtype=np.int64) - EPOCH_ORDINAL).astype('datetime64[D]')
+    return days.astype('datetime64[M]').astype(np.int64)
+
+
+def month_label(month_index):
+    return f'{1970 + month_index // 12:04d}-{month_index % 12 + 1:02d}'
+
+
+class Columns:
+    """Growable column arrays for one user's expenses or revenues"""
+
+    def __init__(self, ids, ordinals, amounts, labels):
+        self._lock = threading.Lock()
+        self.labels = []
+        self.label_codes = {}
+        n = len(ids)
+        capacity = max(16, n * 2)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.ordinals = np.zeros(capacity, dtype=np.int32)
+        self.months = np.zeros(capacity, dtype=np.int32)
+        self.amounts = np.zeros(capacity, dtype=np.float64)
+        self.codes = np.zeros(capacity, dtype=np.int32)
+        self.size = n
+        self.ids[:n] = ids
+        self.ordinals[:n] = ordinals
+        self.months[:n] = ordinals_to_months(ordinals)
+        self.amounts[:n] = amounts
+        self.codes[:n] = [self._code(label) for label in labels]
+        # Archived rows carry id -1: they are immutable and their ids may be reused
+        self.index = {int(row_id): i for i, row_id in enumerate(self.ids[:n]) if row_id >= 0}
+
+    def _code(self, label):
+        code = self.label_codes.get(label)
+        if code is None:
+            code = self.label_codes[label] = len(self.labels)
+            self.labels.append(label)
+        return code
+
+    def _grow(self):
+        capacity = len(self.ids) * 2
+        for name in ('ids', 'ordinals', 'months', 'amounts', 'codes'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def upsert(self, row_id, ordinal, amount, label):
+        with self._lock:
+            i = self.index.get(row_id)
+            if i is None:
+                if self.size == len(self.ids):
+                    self._grow()
+                i = self.index[row_id] = self.size
+                self.size += 1
+            self.ids[i] = row_id
+            self.ordinals[i] = ordinal
+            self.months[i] = ordinals_to_months([ordinal])[0]
+            self.amounts[i] = amount
+            self.codes[i] = self._code(label)
+
+    def remove(self, row_id):
+        with self._lock:
+            i = self.index.pop(row_id, None)
+            if i is None:
+                return
+            last = self.size - 1
+            if i != last:
+                # Move the last row into the hole so the arrays stay dense
+                for column in (self.ids, self.ordinals, self.months, self.amounts, self.codes):
+                    column[i] = column[last]
+                if self.ids[i] >= 0:
+                    self.index[int(self.ids[i])] = i
+            self.size = last
+
+    def view(self):
+        """Copies of the live rows, so concurrent upserts and removes cannot tear a query"""
+        with self._lock:
+            n = self.size
+            return (self.ids[:n].copy(), self.ordinals[:n].copy(), self.months[:n].copy(),
+                    self.amounts[:n].copy(), self.codes[:n].copy())
+
+    @property
+    def nbytes(self):
+        arrays = sum(column.nbytes for column in (self.ids, self.ordinals, self.months, self.amounts, self.codes))
+        # Rough cost of the id index and label table
+        return arrays + len(self.index) * 100 + len(self.labels) * 80
+
+
+def build_columns(user_id, kind):
+    """Load a user's full history (hot rows plus archived years) into columns
+
+    Always read from the primary: the cache is kept current by applying
+    committed writes, so it must not start from a lagging replica.
+    """
+    source = CACHE_SOURCES[kind]
+    model = source['model']
+    with use_primary():
+        rows = db.session.query(
+            model.id, model.date, model.amount, getattr(model, source['label'])
+        ).filter(model.user_id == user_id).all()
+
+    archived = load_columns(user_id, kind)
+    ids = np.concatenate([np.full(len(archived['id']), -1, dtype=np.int64),
+                          np.array([r[0] for r in rows], dtype=np.int64)])
+    ordinals = np.concatenate([archived['date'], np.array([to_ordinal(r[1]) for r in rows], dtype=np.int32)])
+    amounts = np.concatenate([archived['amount'], np.array([r[2] for r in rows], dtype=np.float64)])
+    labels = [str(label) for label in archived['label']] + [r[3] for r in rows]
+    return Columns(ids, ordinals, amounts, labels)
+
+
+class AnalyticsCache:
+    """Per-user column cache, evicted least-recently-used under a byte cap"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        # (user_id, kind) -> (builds in flight, writes seen since they started)
+        self._builds = {}
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._synced_at = 0.0
+        self._seen = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @property
+    def nbytes(self):
+        return sum(c.nbytes for entry in self._entries.values() for c in entry.values())
+
+    def columns(self, user_id, kind):
+        """Columns for a user's expenses or revenues, building them on a miss
+
+        Builds run outside the lock; a build that a record, forget or
+        invalidate raced is thrown away and retried, since it may predate
+        the write that was applied to nothing.
+        """
+        if not self.enabled:
+            return build_columns(user_id, kind)
+
+        for attempt in range(BUILD_ATTEMPTS):
+            with self._lock:
+                cached = self._cached(user_id, kind)
+                if cached is not None:
+                    return cached
+                if attempt == 0:
+                    self.misses += 1
+                if attempt == BUILD_ATTEMPTS - 1:
+                    return self._store(user_id, kind, build_columns(user_id, kind))
+                generation = self._start_build(user_id, kind)
+            try:
+                built = build_columns(user_id, kind)
+            except BaseException:
+                with self._lock:
+                    self._finish_build(user_id, kind)
+                raise
+            with self._lock:
+                if self._finish_build(user_id, kind) == generation:
+                    return self._store(user_id, kind, built)
+
+    def _cached(self, user_id, kind):
+        entry = self._entries.get(user_id)
+        if entry is None or kind not in entry:
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[kind]
+
+    def _store(self, user_id, kind, built):
+        columns = self._entries.setdefault(user_id, {}).setdefault(kind, built)
+        self._entries.move_to_end(user_id)
+        self._evict()
+        return columns
+
+    def _start_build(self, user_id, kind):
+        builders, generation = self._builds.get((user_id, kind), (0, 0))
+        self._builds[(user_id, kind)] = (builders + 1, generation)
+        return generation
+
+    def _finish_build(self, user_id, kind):
+        """Release a build slot and return the key's current generation"""
+        builders, generation = self._builds.pop((user_id, kind))
+        if builders > 1:
+            self._builds[(user_id, kind)] = (builders - 1, generation)
+        return generation
+
+    def _touch(self, user_id=None, kind=None):
+        """Mark builds in flight for a user (or everyone) as stale"""
+        for key, (builders, generation) in list(self._builds.items()):
+            if (user_id is None or key[0] == user_id) and (kind is None or key[1] == kind):
+                self._builds[key] = (builders, generation + 1)
+
+    def _evict(self):
+        while len(self._entries) > 1 and self.nbytes > self.max_bytes:
+            self._entries.popitem(last=False)
+
+    def record(self, user_id, kind, row_id, row_date, amount, label):
+        """Apply a committed create or update to a cached user"""
+        with self._lock:
+            self._touch(user_id, kind)
+            columns = self._entries.get(user_id, {}).get(kind)
+            if columns is not None:
+                columns.upsert(row_id, to_ordinal(row_date), amount, label)
+
+    def forget(self, user_id, kind, row_id):
+        """Apply a committed delete to a cached user"""
+        with self._lock:
+            self._touch(user_id, kind)
+            columns = self._entries.get(user_id, {}).get(kind)
+            if columns is not None:
+                columns.remove(row_id)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            self._touch(user_id)
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def sync_invalidations(self, interval=1.0):
+        """Drop users invalidated by other processes (see publish_invalidation); polls at most once per interval"""
+        now = time.monotonic()
+        if not self.enabled or now - self._synced_at < interval or not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            self._synced_at = now
+            with use_primary():
+                rows = db.session.query(CacheInvalidation.id, CacheInvalidation.user_id).filter(
+                    CacheInvalidation.id > self._seen
+                ).order_by(CacheInvalidation.id).all()
+                oldest = db.session.query(func.min(CacheInvalidation.id)).scalar() if rows else None
+            if not rows:
+                return
+            if oldest > self._seen + 1:
+                # Entries this process never saw were pruned already
+                self.invalidate()
+            else:
+                for user_id in {row.user_id for row in rows}:
+                    self.invalidate(user_id)
+            self._seen = rows[-1].id
+        finally:
+            self._sync_lock.release()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'users': len(self._entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else None,
+            }
+
+
+def publish_invalidation(user_ids):
+    """Tell every server process to rebuild these users' cached columns. Does not commit.
+
+    For jobs such as CLI commands that change user data outside the server,
+    whose own cache is not the one serving requests.
+    """
+    now = datetime.utcnow()
+    CacheInvalidation.query.filter(CacheInvalidation.created_at < now - INVALIDATION_RETENTION).delete()
+    db.session.add_all(CacheInvalidation(user_id=user_id, created_at=now) for user_id in user_ids)
+
+
+def date_mask(ordinals, start=None, end=None):
+    mask = np.ones(len(ordinals), dtype=bool)
+    if start is not None:
+        mask &= ordinals >= to_ordinal(start)
+    if end is not None:
+        mask &= ordinals < to_ordinal(end)
+    return mask
+
+
+def _group(keys, amounts):
+    """Sum and count amounts per distinct key, returning (keys, totals, counts)"""
+    low, high = int(keys.min()), int(keys.max())
+    if high - low <= 4 * len(keys) + 1024:
+        # Dense key range: bincount directly without sorting
+        offsets = keys - low
+        totals = np.bincount(offsets, weights=amounts, minlength=high - low + 1)
+        counts = np.bincount(offsets, minlength=high - low + 1)
+        present = np.flatnonzero(counts)
+        return present + low, totals[present], counts[present]
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return (unique,
+            np.bincount(inverse, weights=amounts, minlength=len(unique)),
+            np.bincount(inverse, minlength=len(unique)))
+
+
+def group_totals(columns, by='category', start=None, end=None):
+    """Sum and count amounts grouped by category, month, year or category and month"""
+    if by not in GROUP_BY:
+        raise ValueError(f"Unknown grouping '{by}'")
+
+    _, ordinals, months, amounts, codes = columns.view()
+    if start is not None or end is not None:
+        mask = date_mask(ordinals, start, end)
+        months, amounts, codes = months[mask], amounts[mask], codes[mask]
+    if not len(amounts):
+        return []
+
+    if by == 'category':
+        keys = codes.astype(np.int64)
+        names = lambda k: columns.labels[k]
+    elif by == 'month':
+        keys = months.astype(np.int64)
+        names = month_label
+    elif by == 'year':
+        keys = months.astype(np.int64) // 12
+        names = lambda k: str(1970 + k)
+    else:
+        first = int(months.min())
+        span = int(months.max()) - first + 1
+        keys = codes.astype(np.int64) * span + (months - first)
+        names = lambda k: f'{columns.labels[k // span]}/{month_label(first + k % span)}'
+
+    keys, totals, counts = _group(keys, amounts)
+
+    groups = [
+        {'key': names(int(key)), 'total': round(float(total), 2), 'count': int(count)}
+        for key, total, count in zip(keys, totals, counts)
+    ]
+    if by == 'category':
+        groups.sort(key=lambda g: g['total'], reverse=True)
+    return groups
+
+
+def monthly_margins(expense_columns, revenue_columns, start=None, end=None):
+    """Revenue, expense, margin and month-over-month change for every month in range"""
+    _, e_ordinals, e_months, e_amounts, _ = expense_columns.view()
+    _, r_ordinals, r_months, r_amounts, _ = revenue_columns.view()
+    e_mask = date_mask(e_ordinals, start, end)
+    r_mask = date_mask(r_ordinals, start, end)
+    e_months = e_months[e_mask].astype(np.int64)
+    r_months = r_months[r_mask].astype(np.int64)
+
+    if not len(e_months) and not len(r_months):
+        return []
+
+    first = int(min(e_months.min(initial=2 ** 40), r_months.min(initial=2 ** 40)))
+    last = int(max(e_months.max(initial=-1), r_months.max(initial=-1)))
+    span = last - first + 1
+
+    expenses = np.bincount(e_months - first, weights=e_amounts[e_mask], minlength=span)
+    revenues = np.bincount(r_months - first, weights=r_amounts[r_mask], minlength=span)
+    margin = revenues - expenses
+    previous = np.concatenate([[np.nan], margin[:-1]])
+    change = margin - previous
+
+    return [
+        {
+            'month': month_label(first + i),
+            'revenue': round(float(revenues[i]), 2),
+            'expenses': round(float(expenses[i]), 2),
+            'margin': round(float(margin[i]), 2),
+            'margin_pct': round(float(margin[i] / revenues[i] * 100), 2) if revenues[i] else None,
+            'margin_change': None if np.isnan(change[i]) else round(float(change[i]), 2),
+        }
+        for i in range(span)
+    ]
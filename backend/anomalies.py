@@ -0,0 +1,152 @@
+import os
+
+from sqlalchemy import text
+
+from models import db, Expense, ExpenseStat, ExpenseAnomaly
+
+# |z| at or above this flags an expense once its category has enough history
+Z_THRESHOLD = float(os.getenv('ANOMALY_Z_THRESHOLD', 3.0))
+MIN_SAMPLES = int(os.getenv('ANOMALY_MIN_SAMPLES', 5))
+
+# Floor on the standard deviation as a fraction of the mean, so a category with
+# identical past bills still gives a finite score
+MIN_STD_FRACTION = 0.05
+
+STATS_TABLE = ExpenseStat.__tablename__
+
+
+def _score(amount, count, mean, m2):
+    """z-score of amount against a category's prior count/mean/m2, or None"""
+    if count < MIN_SAMPLES:
+        return None
+    std = (m2 / (count - 1)) ** 0.5 if count > 1 else 0.0
+    std = max(std, abs(mean) * MIN_STD_FRACTION, 0.01)
+    return (amount - mean) / std
+
+
+def observe(user_id, category, amount):
+    """Add an amount to the category's running stats in one upsert. Does not commit.
+
+    Returns (score, prior_mean) measured against the stats before this amount.
+    """
+    count, mean, m2 = db.session.execute(text(f'''
+        INSERT INTO {STATS_TABLE} (user_id, category, count, mean, m2)
+        VALUES (:user_id, :category, 1, :x, 0)
+        ON CONFLICT (user_id, category) DO UPDATE SET
+            count = count + 1,
+            mean = mean + (:x - mean) / (count + 1),
+            m2 = m2 + (:x - mean) * (:x - mean) * count / (count + 1)
+        RETURNING count, mean, m2
+    '''), {'user_id': user_id, 'category': category, 'x': amount}).one()
+
+    if count == 1:
+        return None, None
+
+    # Recover the prior state from the updated one
+    prior_count = count - 1
+    prior_mean = (count * mean - amount) / prior_count
+    prior_m2 = max(m2 - (amount - prior_mean) ** 2 * prior_count / count, 0.0)
+    return _score(amount, prior_count, prior_mean, prior_m2), prior_mean
+
+
+def forget(user_id, category, amount):
+    """Remove an amount from the category's running stats. Does not commit."""
+    db.session.execute(text(f'''
+        UPDATE {STATS_TABLE} SET
+            count = count - 1,
+            mean = CASE WHEN count > 1 THEN (count * mean - :x) / (count - 1) ELSE 0 END,
+            m2 = CASE WHEN count > 1
+                      THEN MAX(m2 - count * (:x - mean) * (:x - mean) / (count - 1), 0)
+                      ELSE 0 END
+        WHERE user_id = :user_id AND category = :category AND count > 0
+    '''), {'user_id': user_id, 'category': category, 'x': amount})
+
+
+def record_expense(expense, old=None):
+    """Update stats for a created or edited expense and flag it if anomalous
+
+    old is the (amount, category) pair before an edit. Does not commit.
+    Returns the anomaly summary for the API response.
+    """
+    if old is not None:
+        forget(expense.user_id, old[1], old[0])
+        ExpenseAnomaly.query.filter_by(expense_id=expense.id).delete()
+
+    score, expected = observe(expense.user_id, expense.category, expense.amount)
+    flagged = score is not None and abs(score) >= Z_THRESHOLD
+
+    if flagged:
+        db.session.add(ExpenseAnomaly(
+            expense_id=expense.id,
+            score=score,
+            expected=expected,
+            user_id=expense.user_id
+        ))
+
+    return {
+        'score': round(score, 2) if score is not None else None,
+        'flagged': flagged
+    }
+
+
+def _welford(count, mean, m2, x):
+    """Stats after adding x, the same update observe() does in SQL"""
+    return count + 1, mean + (x - mean) / (count + 1), m2 + (x - mean) ** 2 * count / (count + 1)
+
+
+def record_new_expenses(expenses):
+    """record_expense for a batch of new expenses, with one stats read and one merge per category
+
+    Each expense is scored against its category's stats including the batch's
+    earlier expenses, as calling record_expense in order would. The batch is
+    merged into the stored stats with the parallel Welford update, so
+    concurrent observe() calls are not lost. Does not commit.
+    """
+    user_ids = sorted({expense.user_id for expense in expenses})
+    current = {}
+    for start in range(0, len(user_ids), 500):
+        for row in ExpenseStat.query.filter(ExpenseStat.user_id.in_(user_ids[start:start + 500])):
+            current[(row.user_id, row.category)] = (row.count, row.mean, row.m2)
+
+    added = {}
+    for expense in expenses:
+        key = (expense.user_id, expense.category)
+        count, mean, m2 = current.get(key, (0, 0.0, 0.0))
+        score = _score(expense.amount, count, mean, m2) if count else None
+        if score is not None and abs(score) >= Z_THRESHOLD:
+            db.session.add(ExpenseAnomaly(expense_id=expense.id, score=score, expected=mean,
+                                          user_id=expense.user_id))
+        current[key] = _welford(count, mean, m2, expense.amount)
+        added[key] = _welford(*added.get(key, (0, 0.0, 0.0)), expense.amount)
+
+    if added:
+        db.session.execute(text(f'''
+            INSERT INTO {STATS_TABLE} (user_id, category, count, mean, m2)
+            VALUES (:user_id, :category, :n, :batch_mean, :batch_m2)
+            ON CONFLICT (user_id, category) DO UPDATE SET
+                count = count + :n,
+                mean = mean + (:batch_mean - mean) * :n / (count + :n),
+                m2 = m2 + :batch_m2 + (:batch_mean - mean) * (:batch_mean - mean) * count * :n / (count + :n)
+        '''), [
+            {'user_id': user_id, 'category': category, 'n': n, 'batch_mean': mean, 'batch_m2': m2}
+            for (user_id, category), (n, mean, m2) in added.items()
+        ])
+
+
+def discard_expense(expense):
+    """Remove a deleted expense from stats and flags. Does not commit."""
+    forget(expense.user_id, expense.category, expense.amount)
+    ExpenseAnomaly.query.filter_by(expense_id=expense.id).delete()
+
+
+def rebuild_stats():
+    """Recompute every user's category stats from the expenses table in one GROUP BY"""
+    db.session.query(ExpenseStat).delete()
+    db.session.execute(text(f'''
+        INSERT INTO {STATS_TABLE} (user_id, category, count, mean, m2)
+        SELECT user_id, category, COUNT(*), AVG(amount),
+               MAX(SUM(amount * amount) - COUNT(*) * AVG(amount) * AVG(amount), 0)
+        FROM {Expense.__tablename__}
+        GROUP BY user_id, category
+    '''))
+    db.session.commit()
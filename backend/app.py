@@ -1,11 +1,39 @@
-from flask import Flask, jsonify, request, session
+from flask import Flask, jsonify, request, session, g
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_cors import CORS
-from models import db, User, Expense, Revenue, Livestock, Budget
+from models import db, User, Expense, Revenue, Livestock, LivestockPurchase, Budget, ExpenseAnomaly, ExpenseStat, RecurringExpense, RecurringOccurrence
+from valuation import load_price_table, value_herd
+from herd import HerdError, head_count, sell_head, remove_head, parse_weight_csv, bulk_update_weights, record_purchase, delete_lots
+from budget import apply_expense_change, notify_budget_alerts, on_budget_alert, reconcile_budgets, spent_in_period
+from search import SEARCH_SOURCES, SearchUnavailable, init_search_index, search_records
+from archive import configure_archive, archive_before, archived_records
+from analytics_cache import AnalyticsCache, GROUP_BY, group_totals, monthly_margins, publish_invalidation
+from reports import PERIODS, profit_and_loss, cash_flow, livestock_purchases
+from anomalies import record_expense, record_new_expenses, discard_expense, rebuild_stats
+from recurring import (RecurringError, RecurringGenerator, parse_rule, schedule_bounds, first_occurrence,
+                       materialize_due)
+from training import RetrainScheduler, archived_history, database_history, build_training_frame, retrain
+from model_store import ModelStore, train_user_models
+from webhooks import WebhookDispatcher
+from writebehind import EditError, WriteBehindBuffer, apply_updates, parse_changes
+from diagnostics import database_check, pool_status, prime_pool, model_check, emergency_backlog
+from ratelimit import RateLimiter, retry_after_header
+from failover import mirror_to_emergency, replay_emergency
+from telemetry import (TelemetryBuffer, TelemetryError, METRICS, parse_binary, parse_ndjson,
+                       owned_lots, filter_batch, store_readings, series, prune_readings)
+from scenarios import (GRID_PARAMETERS, HERD_CATEGORIES, category_share, history_volatility, monthly_series,
+                       next_month_features, simulate)
+from replicas import (configure_replica, recently_wrote, route_reads, stop_routing,
+                      sync_replica, use_primary, replica_enabled, replica_engine)
+from sharding import (configure_sharding, sharding_enabled, activate_shard, deactivate_shard,
+                      existing_shards, use_shard, shard_key, split_database)
 from datetime import datetime, timedelta
 import os
-import requests
+import threading
+import time
+import click
+import atexit
 from dotenv import load_dotenv
 import joblib
 import numpy as np
@@ -38,23 +66,450 @@ CORS(app, resources={
 # N8N webhook URL
 N8N_WEBHOOK_URL = os.getenv('N8N_WEBHOOK_URL', 'https://tube.app.n8n.cloud/webhook/expense-intake')
 
+# Webhook posts run on background threads; queued payloads are delivered on shutdown
+webhooks = WebhookDispatcher(N8N_WEBHOOK_URL, workers=int(os.getenv('WEBHOOK_WORKERS', 2)))
+atexit.register(webhooks.close)
+
+# Livestock valuation tables (override with LIVESTOCK_PRICE_TABLE=path/to/table.json)
+PRICE_PER_KG, MONTHLY_RATE = load_price_table()
+
+# Tenancy mode - route each user's data to its own SQLite shard ('hash' or 'per_user')
+TENANCY_MODE = os.getenv('TENANCY_MODE', '')
+configure_sharding(
+    mode=TENANCY_MODE,
+    count=os.getenv('SHARD_COUNT', 8),
+    directory=os.getenv('SHARD_DIR', os.path.join(app.instance_path, 'shards'))
+)
+
+# Closed years moved out of the hot tables by 'flask archive-years'
+configure_archive(os.getenv('ARCHIVE_DIR', os.path.join(app.instance_path, 'archive')))
+
+# Per-user columnar analytics cache (ANALYTICS_CACHE_MB=0 disables it)
+analytics_cache = AnalyticsCache(max_bytes=int(os.getenv('ANALYTICS_CACHE_MB', 64)) * 1024 * 1024)
+
 # Initialize extensions
 db.init_app(app)
 migrate = Migrate(app, db)
 
+# Read replica for GET requests: a database URL, or 'readonly' for a read-only
+# WAL connection to the primary SQLite file. Reads stay on the primary for
+# READ_STICKY_SECONDS after the same user writes.
+READ_REPLICA_URL = os.getenv('READ_REPLICA_URL', '')
+with app.app_context():
+    configure_replica(db.engine, READ_REPLICA_URL, os.getenv('READ_STICKY_SECONDS', 5))
+
+READ_METHODS = ('GET', 'HEAD')
+
+# Token buckets per user (or client address) and route, as (requests per second, burst),
+# plus caps on concurrent requests for the expensive routes. RATE_LIMITS=0 disables both.
+RATE_LIMITS_ENABLED = os.getenv('RATE_LIMITS', '1') != '0'
+rate_limiter = RateLimiter(
+    default=(float(os.getenv('RATE_LIMIT_PER_SECOND', 10)), int(os.getenv('RATE_LIMIT_BURST', 20))),
+    limits={
+        'login': (0.2, 5),
+        'register': (0.2, 5),
+        'predict_expenses': (2, 5),
+        'predict_scenarios': (0.2, 2),
+        'get_profit_loss_report': (2, 5),
+        'get_cash_flow_report': (2, 5),
+        'get_livestock_valuation': (2, 5),
+        'search_records_route': (5, 10),
+        'bulk_update_livestock_weights': (0.5, 2),
+        'ingest_telemetry': (20, 50),
+    },
+    concurrency={
+        'predict_expenses': int(os.getenv('PREDICT_CONCURRENCY', 4)),
+        'predict_scenarios': int(os.getenv('SCENARIO_CONCURRENCY', 1)),
+        'get_profit_loss_report': 4,
+        'get_cash_flow_report': 4,
+        'bulk_update_livestock_weights': 2,
+    }
+)
+
+# Health and readiness probes are never rate limited
+PROBE_ENDPOINTS = ('health', 'readiness')
+
+def too_many_requests(message, retry_after):
+    response = jsonify({'success': False, 'error': message})
+    response.status_code = 429
+    response.headers['Retry-After'] = retry_after_header(retry_after)
+    return response
+
+@app.before_request
+def admit_request():
+    """Reject over-limit requests up front with 429 and Retry-After"""
+    endpoint = request.endpoint
+    if not RATE_LIMITS_ENABLED or endpoint is None or request.method == 'OPTIONS' or endpoint in PROBE_ENDPOINTS:
+        return None
+    client = session.get('user_id') or request.remote_addr
+    wait = rate_limiter.acquire(client, endpoint)
+    if wait:
+        return too_many_requests('Rate limit exceeded', wait)
+    if not rate_limiter.enter(endpoint):
+        return too_many_requests('Server busy, try again shortly', 1)
+    g.admitted_endpoint = endpoint
+
+@app.teardown_request
+def release_admission(exc):
+    endpoint = g.pop('admitted_endpoint', None)
+    if endpoint is not None:
+        rate_limiter.exit(endpoint)
+
+@app.before_request
+def bind_user_shard():
+    g.shard_token = activate_shard(session.get('user_id'))
+    if request.method in READ_METHODS and not recently_wrote(session.get('last_write_at')):
+        g.replica_token = route_reads()
+
+@app.after_request
+def remember_write(response):
+    if request.method not in READ_METHODS and request.method != 'OPTIONS' and response.status_code < 400:
+        session['last_write_at'] = time.time()
+    return response
+
+@app.before_request
+def settle_coalesced_writes():
+    """Read-your-writes: anything but another coalesced edit waits for the user's pending edits"""
+    user_id = session.get('user_id')
+    if write_behind.enabled and request.endpoint not in COALESCED_ENDPOINTS and write_behind.has_pending(user_id):
+        try:
+            write_behind.flush()
+        except Exception as e:
+            # The edits stay queued for the background retry; this request goes ahead
+            print(f"Write-behind flush failed: {e}")
+
+@app.before_request
+def sync_cache_invalidations():
+    """Drop cached analytics for users that CLI jobs changed"""
+    try:
+        analytics_cache.sync_invalidations()
+    except Exception as e:
+        print(f"Analytics cache invalidation check failed: {e}")
+
+@app.before_request
+def pick_up_retrained_model():
+    """Swap in a model that retrain-model promoted from another process"""
+    try:
+        reload_changed_model()
+    except Exception as e:
+        print(f"Model reload check failed: {e}")
+
+@app.teardown_request
+def release_user_shard(exc):
+    stop_routing(g.pop('replica_token', None))
+    deactivate_shard(g.pop('shard_token', None))
+
+def for_each_database():
+    """Yield once per database holding user data: every shard, or just the main DB"""
+    if not sharding_enabled():
+        yield None
+        return
+    for key in existing_shards():
+        with use_shard(key):
+            yield key
+            db.session.remove()
+
+def write_telemetry(batches):
+    """Group-commit buffered telemetry: one transaction per database"""
+    # May run inside a GET request that flushes early, so pin writes to the primary
+    with app.app_context(), use_primary():
+        if not sharding_enabled():
+            store_readings(batches)
+            return
+        by_shard = {}
+        for user_id, batch in batches.items():
+            by_shard.setdefault(shard_key(user_id), {})[user_id] = batch
+        for key, shard_batches in by_shard.items():
+            with use_shard(key):
+                store_readings(shard_batches)
+                db.session.remove()
+
+def write_coalesced(updates):
+    """Apply coalesced expense/revenue edits: one transaction per database; returns dropped keys"""
+    by_database = {}
+    for key, edit in updates.items():
+        by_database.setdefault(key[0], {})[key] = edit
+
+    alerts, written, failed = [], [], []
+    with app.app_context(), use_primary():
+        for shard, group in by_database.items():
+            if shard is None:
+                group_alerts, group_written, group_failed = apply_updates(group)
+            else:
+                with use_shard(shard):
+                    group_alerts, group_written, group_failed = apply_updates(group)
+                    db.session.remove()
+            alerts += group_alerts
+            written += group_written
+            failed += group_failed
+
+    notify_budget_alerts(alerts)
+    for kind, user_id, row_id, row_date, amount, label in written:
+        analytics_cache.record(user_id, kind, row_id, row_date, amount, label)
+    return failed
+
+# Optional write-behind for PUT /api/expenses/<id> and /api/revenues/<id>: edits to the
+# same row within WRITE_BEHIND_MS are merged and group-committed (0 keeps writes synchronous)
+write_behind = WriteBehindBuffer(write_coalesced, window=float(os.getenv('WRITE_BEHIND_MS', 0)) / 1000)
+atexit.register(write_behind.close)
+COALESCED_ENDPOINTS = ('update_expense', 'update_revenue')
+
+# Livestock sensor readings are buffered in memory and written in one transaction
+# every TELEMETRY_FLUSH_SECONDS, or sooner once TELEMETRY_FLUSH_ROWS are waiting
+telemetry_buffer = TelemetryBuffer(
+    write_telemetry,
+    flush_rows=int(os.getenv('TELEMETRY_FLUSH_ROWS', 50000)),
+    flush_interval=float(os.getenv('TELEMETRY_FLUSH_SECONDS', 1.0)),
+    max_rows=int(os.getenv('TELEMETRY_MAX_BUFFERED', 2000000))
+)
+atexit.register(telemetry_buffer.close)
+
 # Load ML model
 MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
-try:
-    model = joblib.load(os.path.join(MODEL_DIR, "expense_model.pkl"))
-    features = joblib.load(os.path.join(MODEL_DIR, "feature_names.pkl"))
-    metadata = joblib.load(os.path.join(MODEL_DIR, "model_metadata.pkl"))
-    print(f" Model loaded: {metadata['best_model']}")
-    print(f" Test MAE: ${metadata['test_mae']:.2f}")
-except Exception as e:
-    print(f" ML models not loaded: {e}")
-    print(" Prediction endpoint will not be available")
-    model = None
-    metadata = None
+
+def model_version():
+    """mtime of the live metadata file, which retraining promotes last"""
+    try:
+        return os.stat(os.path.join(MODEL_DIR, "model_metadata.pkl")).st_mtime_ns
+    except OSError:
+        return None
+
+def load_model():
+    """Load (or reload) the expense model artifacts into the module globals"""
+    global model, features, metadata, loaded_model_version
+    loaded_model_version = model_version()
+    try:
+        model = joblib.load(os.path.join(MODEL_DIR, "expense_model.pkl"))
+        features = joblib.load(os.path.join(MODEL_DIR, "feature_names.pkl"))
+        metadata = joblib.load(os.path.join(MODEL_DIR, "model_metadata.pkl"))
+        print(f" Model loaded: {metadata['best_model']}")
+        print(f" Test MAE: ${metadata['test_mae']:.2f}")
+    except Exception as e:
+        print(f" ML models not loaded: {e}")
+        print(" Prediction endpoint will not be available")
+        model = None
+        metadata = None
+
+model = features = metadata = loaded_model_version = None
+load_model()
+
+# retrain-model runs in its own process; servers pick up a promoted model within this many seconds
+MODEL_CHECK_SECONDS = float(os.getenv('MODEL_CHECK_SECONDS', 5))
+model_reload_lock = threading.Lock()
+model_checked_at = time.monotonic()
+
+def reload_changed_model():
+    """Reload the global model when another process has promoted a new one"""
+    global model_checked_at
+    now = time.monotonic()
+    if now - model_checked_at < MODEL_CHECK_SECONDS or not model_reload_lock.acquire(blocking=False):
+        return
+    try:
+        model_checked_at = now
+        if model_version() != loaded_model_version:
+            load_model()
+    finally:
+        model_reload_lock.release()
+
+# Per-user models, trained by retrain-model when PER_USER_MODELS=1 or --per-user is given
+PER_USER_MODELS = os.getenv('PER_USER_MODELS', '0') == '1'
+model_store = ModelStore(
+    os.path.join(MODEL_DIR, 'users'),
+    max_bytes=int(os.getenv('USER_MODEL_CACHE_MB', 256)) * 1024 * 1024,
+    check_interval=MODEL_CHECK_SECONDS
+)
+
+# Process pool size for very large what-if grids (0 keeps prediction in-process)
+SCENARIO_WORKERS = int(os.getenv('SCENARIO_WORKERS', 0))
+
+@on_budget_alert
+def send_budget_alert_to_n8n(alert):
+    """Forward budget threshold crossings to the N8N webhook"""
+    webhooks.send({**alert, 'timestamp': datetime.now().isoformat()})
+
+@app.cli.command('reconcile-budgets')
+def reconcile_budgets_command():
+    """Check remaining budgets against expense totals and fix drift"""
+    total = 0
+    for _ in for_each_database():
+        drifted = reconcile_budgets(fix=True)
+        for item in drifted:
+            print(f"  budget {item['budget_id']}: {item['remaining_budget']:.2f} -> {item['expected']:.2f}")
+        total += len(drifted)
+    print(f"Reconciled {total} budgets")
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Drop and rebuild the full-text search index"""
+    for key in for_each_database():
+        if init_search_index(rebuild=True):
+            print(f"Search index rebuilt{f' on {key}' if key else ''}")
+        else:
+            print("Search index requires SQLite")
+
+@app.cli.command('rebuild-expense-stats')
+def rebuild_expense_stats_command():
+    """Recompute per-category running stats used for anomaly scoring"""
+    for key in for_each_database():
+        rebuild_stats()
+        print(f"Expense stats rebuilt{f' on {key}' if key else ''}")
+
+def run_retraining(force=False, workers=None, per_user=None):
+    """Retrain the expense model from every database and reload it if promoted"""
+    with app.app_context():
+        history = pd.concat([database_history() for _ in for_each_database()] + [archived_history()],
+                            ignore_index=True)
+    frame = build_training_frame(history)
+    version, trained_metadata, promoted = retrain(frame, MODEL_DIR, workers=workers, force=force)
+    if promoted:
+        load_model()
+    if PER_USER_MODELS if per_user is None else per_user:
+        trained_metadata['user_models'] = train_user_models(
+            frame, model_store, trained_metadata['params'], workers=workers
+        )
+    return version, trained_metadata, promoted
+
+@app.cli.command('retrain-model')
+@click.option('--force', is_flag=True, help='Promote the new model even if it does not beat the mean baseline')
+@click.option('--workers', type=int, default=None, help='Processes used for cross-validation')
+@click.option('--per-user/--no-per-user', default=None, help='Also fit per-user models (default: PER_USER_MODELS)')
+def retrain_model_command(force, workers, per_user):
+    """Rebuild the training frame from the database and refit the expense model"""
+    version, trained_metadata, promoted = run_retraining(force=force, workers=workers, per_user=per_user)
+    print(f"Model {version}: test MAE ${trained_metadata['test_mae']:.2f} "
+          f"(mean baseline ${trained_metadata['baseline_mean_mae']:.2f}), params {trained_metadata['params']}")
+    print("Promoted to live model" if promoted else "Kept previous live model")
+    if 'user_models' in trained_metadata:
+        print(f"Trained {trained_metadata['user_models']} per-user models")
+
+@app.cli.command('archive-years')
+@click.option('--before', type=int, default=None, help='Archive years before this one (default: current year)')
+def archive_years_command(before):
+    """Move closed years of expenses and revenues into columnar archive files"""
+    before = before or datetime.now().year
+    for key in for_each_database():
+        moved = archive_before(before)
+        print(f"Archived{f' {key}' if key else ''}: "
+              + ", ".join(f"{count} {kind}" for kind, count in moved.items()))
+
+@app.cli.command('prune-telemetry')
+@click.option('--days', type=int, default=90, help='Keep raw readings from the last N days')
+def prune_telemetry_command(days):
+    """Delete raw telemetry readings older than N days; hourly and daily rollups are kept"""
+    before = time.time() - days * 86400
+    for key in for_each_database():
+        deleted = prune_readings(before)
+        print(f"Pruned{f' {key}' if key else ''}: {deleted} readings")
+
+@app.cli.command('sync-replica')
+def sync_replica_command():
+    """Copy the primary SQLite database onto the READ_REPLICA_URL file"""
+    path = sync_replica(db.engine)
+    print(f"Replica synced to {path}")
+
+# Degraded-mode database served by emergency_app.py
+EMERGENCY_DB = os.getenv('EMERGENCY_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emergency.db'))
+
+@app.cli.command('mirror-emergency')
+@click.option('--interval', type=float, default=0, help='Keep mirroring every N seconds (warm standby)')
+def mirror_emergency_command(interval):
+    """Copy changed users, expenses, revenues and livestock into the emergency database"""
+    while True:
+        started = time.time()
+        counts = mirror_to_emergency(EMERGENCY_DB, for_each_database)
+        changed = {table: c for table, c in counts.items() if c['copied'] or c['deleted']}
+        if changed or not interval:
+            print(f"Mirrored in {time.time() - started:.2f}s: "
+                  + ", ".join(f"{table} +{c['copied']} -{c['deleted']}" for table, c in counts.items()))
+        if not interval:
+            break
+        time.sleep(interval)
+
+@app.cli.command('replay-emergency')
+def replay_emergency_command():
+    """Apply changes made in emergency mode to the main database, then re-sync the mirror"""
+    result = replay_emergency(EMERGENCY_DB)
+    print("Replayed: " + ", ".join(f"{count} {table}" for table, count in result['applied'].items()))
+    if result['conflicts']:
+        print(f"{result['conflicts']} conflicts recorded in replay_conflicts in {EMERGENCY_DB}")
+
+    # Replayed rows bypassed the per-request budget, anomaly and cache updates
+    if result['user_ids']:
+        publish_invalidation(result['user_ids'])
+        db.session.commit()
+        for _ in for_each_database():
+            reconcile_budgets(fix=True)
+            rebuild_stats()
+    mirror_to_emergency(EMERGENCY_DB, for_each_database)
+
+@app.cli.command('split-shards')
+@click.option('--delete-source', is_flag=True, help='Remove copied rows from the main database')
+def split_shards_command(delete_source):
+    """Copy each user's data from the main database into their shard"""
+    if not sharding_enabled():
+        print("Set TENANCY_MODE to 'hash' or 'per_user' first")
+        return
+    copied = split_database(db.engine.url.database, delete_source=delete_source)
+    for key in copied:
+        with use_shard(key):
+            init_search_index()
+            db.session.remove()
+        print(f"  {key}: {copied[key]} rows")
+    print(f"Split into {len(copied)} shards")
+
+def book_expenses(expenses):
+    """Stats, anomaly flags and budget debits for new expenses, as POST /api/expenses does. Does not commit.
+
+    Returns the budget alerts to send once the transaction commits.
+    """
+    if not expenses:
+        return []
+    record_new_expenses(expenses)
+    # Users without a budget have nothing to debit
+    budgeted = set(db.session.scalars(db.select(Budget.user_id).distinct()))
+    alerts = []
+    for expense in expenses:
+        if expense.user_id in budgeted:
+            alerts += apply_expense_change(expense.user_id, new=(expense.amount, expense.date))
+    return alerts
+
+def run_recurring(through=None, since=None):
+    """Materialize due recurring expenses in every database; returns how many were created
+
+    Runs on the background generator or from the CLI, so other processes'
+    analytics caches are told through publish_invalidation.
+    """
+    created = 0
+    with app.app_context():
+        for _ in for_each_database():
+            expenses = materialize_due(through, since=since)
+            alerts = book_expenses(expenses)
+            if expenses:
+                publish_invalidation({expense.user_id for expense in expenses})
+            db.session.commit()
+            notify_budget_alerts(alerts)
+            created += len(expenses)
+    return created
+
+@app.cli.command('materialize-recurring')
+@click.option('--through', default=None, help='Create occurrences up to this date (default: today)')
+@click.option('--since', default=None, help='Backfill: re-scan every active schedule from this date')
+def materialize_recurring_command(through, since):
+    """Create the expenses due from recurring schedules for all users"""
+    started = time.time()
+    created = run_recurring(
+        through=datetime.fromisoformat(through).date() if through else None,
+        since=datetime.fromisoformat(since).date() if since else None
+    )
+    print(f"Created {created} recurring expenses in {time.time() - started:.2f}s")
+
+# Recurring expenses are materialized in the background (RECURRING_INTERVAL_MINUTES=0 disables it)
+recurring_generator = RecurringGenerator(float(os.getenv('RECURRING_INTERVAL_MINUTES', 60)) * 60, run_recurring)
+recurring_generator.start()
+
+# Scheduled retraining off the request path (RETRAIN_INTERVAL_HOURS=0 disables it)
+retrain_scheduler = RetrainScheduler(float(os.getenv('RETRAIN_INTERVAL_HOURS', 0)) * 3600, run_retraining)
+retrain_scheduler.start()
 
 # Authentication decorator
 def login_required(f):
@@ -154,9 +609,14 @@ def get_current_user():
 def get_expenses():
     """Get all expenses for current user"""
     expenses = Expense.query.filter_by(user_id=session['user_id']).order_by(Expense.date.desc()).all()
+    expenses = [expense.to_dict() for expense in expenses]
+    if request.args.get('include_archived') != '0':
+        archived = archived_records(session['user_id'], 'expenses')
+        if archived:
+            expenses = sorted(expenses + archived, key=lambda record: record['date'], reverse=True)
     return jsonify({
         'success': True,
-        'expenses': [expense.to_dict() for expense in expenses]
+        'expenses': expenses
     }), 200
 
 @app.route('/api/expenses', methods=['POST'])
@@ -179,33 +639,54 @@ def create_expense():
         )
 
         db.session.add(expense)
+        db.session.flush()
+        anomaly = record_expense(expense)
+        alerts = apply_expense_change(session['user_id'], new=(expense.amount, expense.date))
         db.session.commit()
-
-        # Send data to N8N webhook (async, don't fail if it errors)
-        try:
-            n8n_payload = {
-                'type': 'expense',
-                'user_id': session['user_id'],
-                'amount': expense.amount,
-                'category': expense.category,
-                'description': expense.description,
-                'date': expense.date.isoformat(),
-                'timestamp': datetime.now().isoformat()
-            }
-            requests.post(N8N_WEBHOOK_URL, json=n8n_payload, timeout=5)
-        except Exception as e:
-            print(f"N8N webhook failed: {e}")  # Log but don't fail the expense creation
+        notify_budget_alerts(alerts)
+        analytics_cache.record(expense.user_id, 'expenses', expense.id, expense.date, expense.amount, expense.category)
+
+        # Send data to N8N webhook (queued, never blocks or fails the expense creation)
+        webhooks.send({
+            'type': 'expense',
+            'user_id': session['user_id'],
+            'amount': expense.amount,
+            'category': expense.category,
+            'description': expense.description,
+            'date': expense.date.isoformat(),
+            'timestamp': datetime.now().isoformat()
+        })
 
         return jsonify({
             'success': True,
             'message': 'Expense created successfully',
-            'expense': expense.to_dict()
+            'expense': expense.to_dict(),
+            'anomaly': anomaly,
+            'budget_alerts': alerts
         }), 201
 
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def queue_update(kind, row, changes):
+    """Hand a validated edit to the write-behind buffer and answer with the row as it will be stored"""
+    if row.user_id != session['user_id']:
+        return jsonify({'success': False, 'error': f'{kind[:-1].capitalize()} not found'}), 404
+
+    shard = shard_key(row.user_id) if sharding_enabled() else None
+    pending = write_behind.put(shard, row.user_id, kind, row.id, changes)
+    if 'date' in pending:
+        pending['date'] = pending['date'].isoformat()
+
+    name = kind[:-1]
+    return jsonify({
+        'success': True,
+        'message': f'{name.capitalize()} update queued',
+        name: {**row.to_dict(), **pending},
+        'queued': True
+    }), 202
+
 @app.route('/api/expenses/<int:expense_id>', methods=['PUT'])
 @login_required
 def update_expense(expense_id):
@@ -215,25 +696,33 @@ def update_expense(expense_id):
         if not expense:
             return jsonify({'success': False, 'error': 'Expense not found'}), 404
 
-        data = request.get_json()
+        changes = parse_changes(request.get_json(), 'category')
+        if write_behind.enabled:
+            return queue_update('expenses', expense, changes)
 
-        if 'amount' in data:
-            expense.amount = float(data['amount'])
-        if 'category' in data:
-            expense.category = data['category']
-        if 'description' in data:
-            expense.description = data['description']
-        if 'date' in data:
-            expense.date = datetime.fromisoformat(data['date'])
+        old = (expense.amount, expense.date)
+        old_category = expense.category
+
+        for field, value in changes.items():
+            setattr(expense, field, value)
 
+        anomaly = record_expense(expense, old=(old[0], old_category))
+        alerts = apply_expense_change(session['user_id'], old=old, new=(expense.amount, expense.date))
         db.session.commit()
+        notify_budget_alerts(alerts)
+        analytics_cache.record(expense.user_id, 'expenses', expense.id, expense.date, expense.amount, expense.category)
 
         return jsonify({
             'success': True,
             'message': 'Expense updated successfully',
-            'expense': expense.to_dict()
+            'expense': expense.to_dict(),
+            'anomaly': anomaly,
+            'budget_alerts': alerts
         }), 200
 
+    except EditError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -247,8 +736,11 @@ def delete_expense(expense_id):
         if not expense:
             return jsonify({'success': False, 'error': 'Expense not found'}), 404
 
+        apply_expense_change(session['user_id'], old=(expense.amount, expense.date))
+        discard_expense(expense)
         db.session.delete(expense)
         db.session.commit()
+        analytics_cache.forget(session['user_id'], 'expenses', expense_id)
 
         return jsonify({
             'success': True,
@@ -259,15 +751,167 @@ def delete_expense(expense_id):
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/expenses/anomalies', methods=['GET'])
+@login_required
+def get_expense_anomalies():
+    """Get flagged expenses with their anomaly scores and category stats"""
+    anomalies = ExpenseAnomaly.query.filter_by(user_id=session['user_id']).order_by(ExpenseAnomaly.created_at.desc()).all()
+    stats = ExpenseStat.query.filter_by(user_id=session['user_id']).all()
+    return jsonify({
+        'success': True,
+        'anomalies': [anomaly.to_dict() for anomaly in anomalies],
+        'category_stats': [stat.to_dict() for stat in stats]
+    }), 200
+
+# Recurring expense routes
+@app.route('/api/recurring-expenses', methods=['GET'])
+@login_required
+def get_recurring_expenses():
+    """Get all recurring expense schedules for current user"""
+    schedules = RecurringExpense.query.filter_by(user_id=session['user_id']).order_by(RecurringExpense.next_date).all()
+    return jsonify({
+        'success': True,
+        'recurring_expenses': [schedule.to_dict() for schedule in schedules]
+    }), 200
+
+@app.route('/api/recurring-expenses', methods=['POST'])
+@login_required
+def create_recurring_expense():
+    """Create a recurring expense from an RRULE or a frequency; past occurrences are backfilled"""
+    try:
+        data = request.get_json()
+
+        required_fields = ['amount', 'category', 'start_date']
+        if not all(k in data for k in required_fields) or not (data.get('rule') or data.get('frequency')):
+            return jsonify({'success': False, 'error': 'Missing required fields'}), 400
+
+        body, count, until = parse_rule(data.get('rule'), data.get('frequency'), data.get('interval', 1))
+        start_date = datetime.fromisoformat(data['start_date']).date()
+        end_date = datetime.fromisoformat(data['end_date']).date() if data.get('end_date') else None
+        next_date, end_date = schedule_bounds(body, start_date, count, until, end_date)
+
+        schedule = RecurringExpense(
+            amount=float(data['amount']),
+            category=data['category'],
+            description=data.get('description', ''),
+            rule=body,
+            start_date=start_date,
+            end_date=end_date,
+            next_date=next_date,
+            user_id=session['user_id']
+        )
+        db.session.add(schedule)
+        db.session.flush()
+
+        created = materialize_due(schedule_ids=[schedule.id])
+        alerts = book_expenses(created)
+        db.session.commit()
+        notify_budget_alerts(alerts)
+        for expense in created:
+            analytics_cache.record(expense.user_id, 'expenses', expense.id, expense.date, expense.amount,
+                                   expense.category)
+
+        return jsonify({
+            'success': True,
+            'message': 'Recurring expense created successfully',
+            'recurring_expense': schedule.to_dict(),
+            'created': len(created),
+            'budget_alerts': alerts
+        }), 201
+
+    except RecurringError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/recurring-expenses/<int:schedule_id>', methods=['PUT'])
+@login_required
+def update_recurring_expense(schedule_id):
+    """Update a recurring expense; changes apply to occurrences from today on"""
+    try:
+        schedule = RecurringExpense.query.filter_by(id=schedule_id, user_id=session['user_id']).first()
+        if not schedule:
+            return jsonify({'success': False, 'error': 'Recurring expense not found'}), 404
+
+        data = request.get_json()
+
+        if 'amount' in data:
+            schedule.amount = float(data['amount'])
+        if 'category' in data:
+            schedule.category = data['category']
+        if 'description' in data:
+            schedule.description = data['description']
+        if 'active' in data:
+            schedule.active = bool(data['active'])
+
+        count = until = None
+        if data.get('rule') or data.get('frequency'):
+            schedule.rule, count, until = parse_rule(data.get('rule'), data.get('frequency'), data.get('interval', 1))
+        if 'start_date' in data:
+            schedule.start_date = datetime.fromisoformat(data['start_date']).date()
+        if 'end_date' in data:
+            schedule.end_date = datetime.fromisoformat(data['end_date']).date() if data['end_date'] else None
+
+        # Timing changes (and resuming) never backfill: the next occurrence is today's or later
+        if {'rule', 'frequency', 'start_date', 'end_date', 'active'} & set(data):
+            _, schedule.end_date = schedule_bounds(schedule.rule, schedule.start_date, count, until, schedule.end_date)
+            today = datetime.now().date()
+            next_date = first_occurrence(schedule.rule, schedule.start_date, max(today, schedule.start_date))
+            schedule.next_date = next_date if next_date and (not schedule.end_date or next_date <= schedule.end_date) else None
+
+        db.session.commit()
+
+        return jsonify({
+            'success': True,
+            'message': 'Recurring expense updated successfully',
+            'recurring_expense': schedule.to_dict()
+        }), 200
+
+    except RecurringError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/recurring-expenses/<int:schedule_id>', methods=['DELETE'])
+@login_required
+def delete_recurring_expense(schedule_id):
+    """Delete a recurring expense; expenses it already created are kept"""
+    try:
+        schedule = RecurringExpense.query.filter_by(id=schedule_id, user_id=session['user_id']).first()
+        if not schedule:
+            return jsonify({'success': False, 'error': 'Recurring expense not found'}), 404
+
+        RecurringOccurrence.query.filter_by(schedule_id=schedule_id).delete()
+        db.session.delete(schedule)
+        db.session.commit()
+
+        return jsonify({
+            'success': True,
+            'message': 'Recurring expense deleted successfully'
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # Revenue routes
 @app.route('/api/revenues', methods=['GET'])
 @login_required
 def get_revenues():
     """Get all revenues for current user"""
     revenues = Revenue.query.filter_by(user_id=session['user_id']).order_by(Revenue.date.desc()).all()
+    revenues = [revenue.to_dict() for revenue in revenues]
+    if request.args.get('include_archived') != '0':
+        archived = archived_records(session['user_id'], 'revenues')
+        if archived:
+            revenues = sorted(revenues + archived, key=lambda record: record['date'], reverse=True)
     return jsonify({
         'success': True,
-        'revenues': [revenue.to_dict() for revenue in revenues]
+        'revenues': revenues
     }), 200
 
 @app.route('/api/revenues', methods=['POST'])
@@ -291,6 +935,7 @@ def create_revenue():
 
         db.session.add(revenue)
         db.session.commit()
+        analytics_cache.record(revenue.user_id, 'revenues', revenue.id, revenue.date, revenue.amount, revenue.source)
 
         return jsonify({
             'success': True,
@@ -311,18 +956,15 @@ def update_revenue(revenue_id):
         if not revenue:
             return jsonify({'success': False, 'error': 'Revenue not found'}), 404
 
-        data = request.get_json()
+        changes = parse_changes(request.get_json(), 'source')
+        if write_behind.enabled:
+            return queue_update('revenues', revenue, changes)
 
-        if 'amount' in data:
-            revenue.amount = float(data['amount'])
-        if 'source' in data:
-            revenue.source = data['source']
-        if 'description' in data:
-            revenue.description = data['description']
-        if 'date' in data:
-            revenue.date = datetime.fromisoformat(data['date'])
+        for field, value in changes.items():
+            setattr(revenue, field, value)
 
         db.session.commit()
+        analytics_cache.record(revenue.user_id, 'revenues', revenue.id, revenue.date, revenue.amount, revenue.source)
 
         return jsonify({
             'success': True,
@@ -330,6 +972,9 @@ def update_revenue(revenue_id):
             'revenue': revenue.to_dict()
         }), 200
 
+    except EditError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -345,6 +990,7 @@ def delete_revenue(revenue_id):
 
         db.session.delete(revenue)
         db.session.commit()
+        analytics_cache.forget(session['user_id'], 'revenues', revenue_id)
 
         return jsonify({
             'success': True,
@@ -390,6 +1036,8 @@ def create_livestock():
         )
 
         db.session.add(livestock)
+        db.session.flush()
+        record_purchase(livestock)
         db.session.commit()
 
         return jsonify({
@@ -402,6 +1050,253 @@ def create_livestock():
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/livestock/<int:livestock_id>', methods=['PUT'])
+@login_required
+def update_livestock(livestock_id):
+    """Update livestock entry"""
+    try:
+        livestock = Livestock.query.filter_by(id=livestock_id, user_id=session['user_id']).first()
+        if not livestock:
+            return jsonify({'success': False, 'error': 'Livestock not found'}), 404
+
+        data = request.get_json()
+
+        if 'type' in data:
+            livestock.type = data['type']
+        if 'breed' in data:
+            livestock.breed = data['breed']
+        if 'quantity' in data:
+            livestock.quantity = int(data['quantity'])
+        if 'age_months' in data:
+            livestock.age_months = int(data['age_months']) if data['age_months'] else None
+        if 'weight_kg' in data:
+            livestock.weight_kg = float(data['weight_kg']) if data['weight_kg'] else None
+        if 'purchase_date' in data:
+            livestock.purchase_date = datetime.fromisoformat(data['purchase_date']) if data['purchase_date'] else None
+        if 'purchase_price' in data:
+            livestock.purchase_price = float(data['purchase_price']) if data['purchase_price'] else None
+        if 'notes' in data:
+            livestock.notes = data['notes']
+
+        if 'purchase_date' in data or 'purchase_price' in data:
+            # A corrected purchase reprices the head originally bought, not what is left
+            record_purchase(livestock)
+        db.session.commit()
+
+        return jsonify({
+            'success': True,
+            'message': 'Livestock updated successfully',
+            'livestock': livestock.to_dict()
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/livestock/<int:livestock_id>', methods=['DELETE'])
+@login_required
+def delete_livestock(livestock_id):
+    """Delete livestock entry"""
+    try:
+        livestock = Livestock.query.filter_by(id=livestock_id, user_id=session['user_id']).first()
+        if not livestock:
+            return jsonify({'success': False, 'error': 'Livestock not found'}), 404
+
+        # Deleting the record (unlike selling the lot) withdraws its purchase too
+        LivestockPurchase.query.filter_by(livestock_id=livestock.id).delete()
+        delete_lots('id = :id AND user_id = :user_id', {'id': livestock.id, 'user_id': session['user_id']})
+        db.session.commit()
+
+        return jsonify({
+            'success': True,
+            'message': 'Livestock deleted successfully'
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/livestock/bulk/sell', methods=['POST'])
+@login_required
+def bulk_sell_livestock():
+    """Sell head of one livestock type, oldest lots first"""
+    try:
+        data = request.get_json()
+
+        if not data or not all(k in data for k in ['type', 'quantity']):
+            return jsonify({'success': False, 'error': 'Missing required fields'}), 400
+
+        lots, revenue = sell_head(
+            session['user_id'],
+            data['type'],
+            int(data['quantity']),
+            price_per_head=data.get('price_per_head'),
+            sale_date=datetime.fromisoformat(data['date']).date() if data.get('date') else None
+        )
+        db.session.commit()
+        if revenue:
+            analytics_cache.record(revenue.user_id, 'revenues', revenue.id, revenue.date, revenue.amount, revenue.source)
+
+        return jsonify({
+            'success': True,
+            'message': f"Sold {int(data['quantity'])} head of {data['type']}",
+            'lots_affected': lots,
+            'revenue': revenue.to_dict() if revenue else None
+        }), 200
+
+    except HerdError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/livestock/bulk/cull', methods=['POST'])
+@login_required
+def bulk_cull_livestock():
+    """Cull head of one livestock type, oldest lots first"""
+    try:
+        data = request.get_json()
+
+        if not data or not all(k in data for k in ['type', 'quantity']):
+            return jsonify({'success': False, 'error': 'Missing required fields'}), 400
+
+        lots = remove_head(session['user_id'], data['type'], int(data['quantity']))
+        db.session.commit()
+
+        return jsonify({
+            'success': True,
+            'message': f"Culled {int(data['quantity'])} head of {data['type']}",
+            'lots_affected': lots
+        }), 200
+
+    except HerdError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/livestock/bulk/weights', methods=['POST'])
+@login_required
+def bulk_update_livestock_weights():
+    """Update lot weights from a scale CSV with id and weight_kg columns"""
+    try:
+        upload = request.files.get('file')
+        content = upload.read().decode('utf-8') if upload else request.get_data(as_text=True)
+
+        if not content:
+            return jsonify({'success': False, 'error': 'CSV content required'}), 400
+
+        readings = parse_weight_csv(content)
+        updated = bulk_update_weights(session['user_id'], readings)
+        db.session.commit()
+
+        return jsonify({
+            'success': True,
+            'message': f'Updated {updated} lots',
+            'updated': updated,
+            'skipped': len(readings) - updated
+        }), 200
+
+    except HerdError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/livestock/telemetry', methods=['POST'])
+@login_required
+def ingest_telemetry():
+    """Accept a batch of sensor readings as NDJSON or packed binary records
+
+    Readings are buffered and group-committed; pass ?sync=1 to wait for the write.
+    """
+    try:
+        body = request.get_data()
+        if request.mimetype == 'application/octet-stream':
+            batch = parse_binary(body)
+        else:
+            batch = parse_ndjson(body.decode('utf-8'))
+
+        received = len(batch['value'])
+        accepted = filter_batch(batch, owned_lots(session['user_id']))
+        if not telemetry_buffer.add(session['user_id'], accepted):
+            response = jsonify({'success': False, 'error': 'Telemetry buffer full, retry shortly'})
+            response.status_code = 503
+            response.headers['Retry-After'] = retry_after_header(telemetry_buffer.flush_interval)
+            return response
+        if request.args.get('sync') == '1':
+            telemetry_buffer.flush()
+
+        return jsonify({
+            'success': True,
+            'accepted': len(accepted['value']),
+            'rejected': received - len(accepted['value']),
+            'buffered': telemetry_buffer.depth()
+        }), 202
+
+    except (TelemetryError, UnicodeDecodeError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/livestock/<int:livestock_id>/telemetry', methods=['GET'])
+@login_required
+def get_livestock_telemetry(livestock_id):
+    """Get raw readings or hourly/daily rollups for one lot and metric"""
+    try:
+        if not Livestock.query.filter_by(id=livestock_id, user_id=session['user_id']).first():
+            return jsonify({'success': False, 'error': 'Livestock not found'}), 404
+
+        metric = request.args.get('metric', 'weight_kg')
+        if metric not in METRICS:
+            return jsonify({'success': False, 'error': f"Metric must be one of: {', '.join(METRICS)}"}), 400
+
+        # Readings still in the buffer become visible once written
+        if telemetry_buffer.has_pending(session['user_id']):
+            telemetry_buffer.flush()
+
+        points = series(
+            livestock_id,
+            metric,
+            resolution=request.args.get('resolution', 'hour'),
+            start=request.args.get('start', type=float),
+            end=request.args.get('end', type=float),
+            limit=min(request.args.get('limit', 1000, type=int), 10000)
+        )
+        return jsonify({'success': True, 'metric': metric, 'points': points}), 200
+
+    except TelemetryError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/livestock/valuation', methods=['GET'])
+@login_required
+def get_livestock_valuation():
+    """Get herd valuation, per-type aggregates and projected value curve"""
+    try:
+        horizon = request.args.get('horizon', 12, type=int)
+        if horizon < 0 or horizon > 120:
+            return jsonify({'success': False, 'error': 'Horizon must be between 0 and 120 months'}), 400
+
+        valuation = value_herd(
+            session['user_id'],
+            price_per_kg=PRICE_PER_KG,
+            monthly_rate=MONTHLY_RATE,
+            horizon_months=horizon
+        )
+
+        return jsonify({
+            'success': True,
+            'valuation': valuation
+        }), 200
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # Budget routes
 @app.route('/api/budget', methods=['GET'])
 @login_required
@@ -443,9 +1338,12 @@ def create_budget():
             else:
                 end_date = start_date.replace(month=start_date.month + 1)
 
+        # Expenses already dated inside the new period count against it
+        spent = spent_in_period(session['user_id'], start_date, end_date)
+
         budget = Budget(
             total_budget=float(data['total_budget']),
-            remaining_budget=float(data['total_budget']),
+            remaining_budget=float(data['total_budget']) - spent,
             period=data.get('period', 'monthly'),
             start_date=start_date,
             end_date=end_date,
@@ -486,11 +1384,7 @@ def get_analytics_summary():
         total_expenses = sum(expense.amount for expense in monthly_expenses)
 
         # Get total livestock value
-        livestock_items = Livestock.query.filter_by(user_id=user_id).all()
-        total_livestock_value = sum(
-            (item.purchase_price or 0) * item.quantity
-            for item in livestock_items
-        )
+        valuation = value_herd(user_id, price_per_kg=PRICE_PER_KG, monthly_rate=MONTHLY_RATE, horizon_months=0)
 
         # Get budget info
         budget = Budget.query.filter_by(user_id=user_id).first()
@@ -500,8 +1394,9 @@ def get_analytics_summary():
             'success': True,
             'summary': {
                 'total_expenses_month': total_expenses,
-                'total_livestock_value': total_livestock_value,
-                'livestock_count': sum(item.quantity for item in livestock_items),
+                'total_livestock_value': valuation['market_value'],
+                'livestock_cost_basis': valuation['cost_basis'],
+                'livestock_count': valuation['head_count'],
                 'budget': budget_info
             }
         }), 200
@@ -509,7 +1404,166 @@ def get_analytics_summary():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/analytics/groupby', methods=['GET'])
+@login_required
+def get_analytics_groupby():
+    """Group a user's full expense or revenue history by category, month or year"""
+    try:
+        kind = request.args.get('kind', 'expenses')
+        by = request.args.get('by', 'category')
+        if kind not in ('expenses', 'revenues'):
+            return jsonify({'success': False, 'error': 'Kind must be expenses or revenues'}), 400
+        if by not in GROUP_BY:
+            return jsonify({'success': False, 'error': f'By must be one of: {", ".join(GROUP_BY)}'}), 400
+
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+
+        columns = analytics_cache.columns(session['user_id'], kind)
+
+        return jsonify({
+            'success': True,
+            'kind': kind,
+            'by': by,
+            'groups': group_totals(columns, by=by, start=start, end=end)
+        }), 200
+
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/analytics/monthly', methods=['GET'])
+@login_required
+def get_analytics_monthly():
+    """Monthly revenue, expenses, margin and month-over-month change"""
+    try:
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+
+        months = monthly_margins(
+            analytics_cache.columns(session['user_id'], 'expenses'),
+            analytics_cache.columns(session['user_id'], 'revenues'),
+            start=start,
+            end=end
+        )
+
+        return jsonify({
+            'success': True,
+            'months': months
+        }), 200
+
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Report routes
+@app.route('/api/reports/profit-loss', methods=['GET'])
+@login_required
+def get_profit_loss_report():
+    """Profit and loss statement rolled up by week, month, quarter or year"""
+    try:
+        period = request.args.get('period', 'month')
+        if period not in PERIODS:
+            return jsonify({'success': False, 'error': f'Period must be one of: {", ".join(PERIODS)}'}), 400
+
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+
+        report = profit_and_loss(
+            analytics_cache.columns(session['user_id'], 'expenses'),
+            analytics_cache.columns(session['user_id'], 'revenues'),
+            period=period,
+            start=start,
+            end=end
+        )
+
+        return jsonify({
+            'success': True,
+            'period': period,
+            'report': report
+        }), 200
+
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/reports/cash-flow', methods=['GET'])
+@login_required
+def get_cash_flow_report():
+    """Cash flow statement with running balance by week, month, quarter or year"""
+    try:
+        period = request.args.get('period', 'month')
+        if period not in PERIODS:
+            return jsonify({'success': False, 'error': f'Period must be one of: {", ".join(PERIODS)}'}), 400
+
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+
+        report = cash_flow(
+            analytics_cache.columns(session['user_id'], 'expenses'),
+            analytics_cache.columns(session['user_id'], 'revenues'),
+            livestock_purchases(session['user_id']),
+            period=period,
+            start=start,
+            end=end
+        )
+
+        return jsonify({
+            'success': True,
+            'period': period,
+            'report': report
+        }), 200
+
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Search routes
+@app.route('/api/search', methods=['GET'])
+@login_required
+def search_records_route():
+    """Full-text search over expense, revenue and livestock notes"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'success': False, 'error': 'Search query required'}), 400
+
+        kinds = [k for k in request.args.get('types', '').split(',') if k]
+        unknown = [k for k in kinds if k not in SEARCH_SOURCES]
+        if unknown:
+            return jsonify({'success': False, 'error': f'Unknown types: {", ".join(unknown)}'}), 400
+
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+
+        results, has_more = search_records(session['user_id'], query, kinds, page, per_page)
+
+        return jsonify({
+            'success': True,
+            'results': results,
+            'page': page,
+            'per_page': per_page,
+            'has_more': has_more
+        }), 200
+
+    except SearchUnavailable as e:
+        return jsonify({'success': False, 'error': str(e)}), 501
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # ML Prediction routes
+def forecast_model(user_id):
+    """The user's own model when they have enough history for one, else the global model"""
+    user_model = model_store.get(user_id) if PER_USER_MODELS else None
+    if user_model:
+        estimator, model_info = user_model
+        return estimator, model_info, 'user'
+    return model, metadata, 'global'
+
 @app.route('/api/predict', methods=['POST'])
 @login_required
 def predict_expenses():
@@ -549,10 +1603,12 @@ def predict_expenses():
             'Rolling_Avg_6': data['rolling_avg_6'],
         }
 
+        estimator, model_info, model_source = forecast_model(session['user_id'])
+
         # Create DataFrame and predict
         X = pd.DataFrame([features_dict])[features]
-        prediction = model.predict(X)[0]
-        mae = metadata['test_mae']
+        prediction = estimator.predict(X)[0]
+        mae = model_info['test_mae']
 
         return jsonify({
             'success': True,
@@ -565,9 +1621,89 @@ def predict_expenses():
             'confidence': {
                 'expected_mae': round(float(mae), 2),
                 'interval': f"${prediction - mae:,.2f} - ${prediction + mae:,.2f}"
+            },
+            'model': model_source
+        }), 200
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/predict/scenarios', methods=['POST'])
+@login_required
+def predict_scenarios():
+    """Monte Carlo what-if forecasts for a grid of cost and herd-size changes"""
+    if not model:
+        return jsonify({
+            'success': False,
+            'error': 'ML model not loaded'
+        }), 500
+
+    try:
+        data = request.get_json() or {}
+        user_id = session['user_id']
+        grid = data.get('grid') or {name: [0] for name in GRID_PARAMETERS}
+        columns = analytics_cache.columns(user_id, 'expenses')
+        months, totals = monthly_series(columns)
+
+        # Base features come from the request (same fields as /api/predict) or the user's history
+        if 'total_lag1' in data:
+            month = data['month']
+            base = {
+                'Year': data['year'],
+                'Month': month,
+                'Month_sin': np.sin(2 * np.pi * month / 12.0),
+                'Month_cos': np.cos(2 * np.pi * month / 12.0),
+                'Total_Lag1': data['total_lag1'],
+                'Total_Lag3': data['total_lag3'],
+                'Total_Lag12': data['total_lag12'],
+                'Rolling_Avg_3': data['rolling_avg_3'],
+                'Diff_1': data['diff_1'],
+                'Rolling_Avg_6': data['rolling_avg_6'],
             }
+        else:
+            base = next_month_features(months, totals)
+
+        # cost_change applies to one category's share of spend when a category is given
+        category = data.get('category')
+        share = category_share(columns, category) if category else 1.0
+
+        # head_change moves herd-driven spend, split by head when it is about one livestock type
+        livestock_type = data.get('livestock_type')
+        held = head_count(user_id, livestock_type)
+        herd_share = category_share(columns, data.get('herd_categories') or HERD_CATEGORIES)
+        if livestock_type and held:
+            herd_share *= held / head_count(user_id)
+
+        estimator, model_info, model_source = forecast_model(user_id)
+        results = simulate(
+            estimator, base, grid,
+            head_count=held,
+            cost_share=share,
+            herd_share=herd_share,
+            volatility=float(data.get('volatility', history_volatility(totals))),
+            residual_std=model_info.get('test_rmse', model_info['test_mae']),
+            simulations=int(data.get('simulations', 1000)),
+            seed=data.get('seed'),
+            workers=SCENARIO_WORKERS
+        )
+
+        return jsonify({
+            'success': True,
+            'target_month': f"{int(base['Year']):04d}-{int(base['Month']):02d}",
+            'category': category,
+            'cost_share': round(share, 4),
+            'livestock_type': livestock_type,
+            'head_count': held,
+            'herd_share': round(herd_share, 4),
+            'scenarios': results,
+            'currency': 'USD',
+            'model': model_source
         }), 200
 
+    except KeyError as e:
+        return jsonify({'success': False, 'error': f'Missing required field: {e.args[0]}'}), 400
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -581,7 +1717,112 @@ def health():
         'timestamp': datetime.now().isoformat()
     }), 200
 
+# Set by warm_up(); /api/ready answers 503 until then
+warmup_state = {'started': False, 'done': False, 'seconds': None}
+warmup_lock = threading.Lock()
+
+def warm_up(recent_users=int(os.getenv('WARMUP_USERS', 50))):
+    """Prime connections, the model and caches before the worker takes traffic"""
+    warmup_state['started'] = True
+    started = time.perf_counter()
+    with app.app_context():
+        prime_pool(db.engine)
+        if replica_enabled():
+            prime_pool(replica_engine())
+
+        # The first predict call pays for lazy sklearn/numpy setup; pay it here instead
+        model_check(model, features, runs=3)
+
+        # Analytics columns (and per-user models) for the most recently active users
+        for _ in for_each_database():
+            with use_primary():
+                user_ids = [row[0] for row in db.session.query(Expense.user_id).group_by(Expense.user_id)
+                            .order_by(db.func.max(Expense.updated_at).desc()).limit(recent_users)]
+                for user_id in user_ids:
+                    analytics_cache.columns(user_id, 'expenses')
+                    analytics_cache.columns(user_id, 'revenues')
+                    if PER_USER_MODELS:
+                        model_store.get(user_id)
+
+    # Compile the URL map and request machinery on a throwaway request
+    app.test_client().get('/api/health')
+
+    warmup_state.update(done=True, seconds=round(time.perf_counter() - started, 3))
+    return warmup_state['seconds']
+
+def warm_up_in_background():
+    try:
+        print(f"Warmed up in {warm_up():.2f}s")
+    except Exception as e:
+        # Let the next request try again rather than staying unready
+        print(f"Warm-up failed: {e}")
+        warmup_state['started'] = False
+
+@app.before_request
+def start_warm_up():
+    """Warm up on the first request when the server (flask run, gunicorn) did not call warm_up itself"""
+    if warmup_state['started']:
+        return
+    with warmup_lock:
+        if warmup_state['started']:
+            return
+        warmup_state['started'] = True
+    threading.Thread(target=warm_up_in_background, daemon=True).start()
+
+def readiness_checks():
+    """(ready, status, checks) from database, pool, telemetry and model checks"""
+    database = database_check(db.engine)
+    pool = pool_status(db.engine)
+    telemetry = telemetry_buffer.stats()
+    checks = {
+        'warmup': {'ok': warmup_state['done'], 'seconds': warmup_state['seconds']},
+        'database': database,
+        'pool': {**pool, 'ok': (pool.get('saturation') or 0) < 1},
+        'telemetry_buffer': {'ok': telemetry['buffered'] < telemetry_buffer.max_rows},
+    }
+    if replica_enabled():
+        checks['replica'] = database_check(replica_engine())
+
+    # A broken model only takes prediction offline, so it degrades rather than fails readiness
+    checks['model'] = model_check(model, features)
+    ready = all(check['ok'] for name, check in checks.items() if name != 'model')
+    status = 'not ready' if not ready else 'ready' if checks['model']['ok'] else 'degraded'
+    return ready, status, checks
+
+@app.route('/api/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: status only, 503 until warmed up and the database answers"""
+    ready, status, _ = readiness_checks()
+    return jsonify({
+        'status': status,
+        'timestamp': datetime.now().isoformat()
+    }), 200 if ready else 503
+
+@app.route('/api/ready/details', methods=['GET'])
+@login_required
+def readiness_details():
+    """Readiness checks with queue depths and cache hit rates"""
+    ready, status, checks = readiness_checks()
+    return jsonify({
+        'status': status,
+        'checks': checks,
+        'queues': {
+            'webhooks': webhooks.stats(),
+            'telemetry': telemetry_buffer.stats(),
+            'write_behind': write_behind.stats(),
+            'emergency_pending': emergency_backlog(EMERGENCY_DB),
+        },
+        'caches': {
+            'analytics': analytics_cache.stats(),
+            'user_models': model_store.stats(),
+            'rate_limiter': rate_limiter.stats(),
+        },
+        'timestamp': datetime.now().isoformat()
+    }), 200 if ready else 503
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        init_search_index()
+    warm_up()
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
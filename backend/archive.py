@@ -0,0 +1,212 @@
+import os
+import shutil
+from datetime import date, datetime
+
+import numpy as np
+from sqlalchemy import text
+
+from models import db, Expense, ExpenseAnomaly, Revenue
+
+# Archived tables and the text column stored as a dictionary-encoded label
+ARCHIVE_SOURCES = {
+    'expenses': {'model': Expense, 'label': 'category'},
+    'revenues': {'model': Revenue, 'label': 'source'},
+}
+
+COLUMNS = ('id', 'amount', 'date', 'label_codes', 'labels',
+           'description_data', 'description_offsets', 'created_at')
+
+_config = {'directory': None}
+
+
+def configure_archive(directory):
+    _config['directory'] = directory
+
+
+def _year_dir(user_id, kind, year):
+    return os.path.join(_config['directory'], str(user_id), kind, str(year))
+
+
+def archived_user_ids():
+    """Users with any archived data"""
+    directory = _config['directory']
+    if not directory or not os.path.isdir(directory):
+        return []
+    return sorted(int(name) for name in os.listdir(directory) if name.isdigit())
+
+
+def archived_years(user_id, kind):
+    """Years already archived for a user and table"""
+    path = os.path.join(_config['directory'], str(user_id), kind)
+    if not os.path.isdir(path):
+        return []
+    return sorted(int(name) for name in os.listdir(path) if name.isdigit())
+
+
+def _encode_text(values):
+    """Pack strings into one UTF-8 byte blob plus offsets"""
+    encoded = [(v or '').encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8) if encoded else np.zeros(0, dtype=np.uint8)
+    return data, offsets
+
+
+def _write_year(user_id, kind, year, rows):
+    """Write one user's year of rows as memory-mappable column files"""
+    final = _year_dir(user_id, kind, year)
+    if os.path.isdir(final):
+        # Merge with rows archived by an earlier run for the same year
+        previous = list(zip(*_year_rows(load_year(user_id, kind, year))))
+        rows = list({row[0]: row for row in previous + list(rows)}.values())
+    rows = sorted(rows, key=lambda row: (row[2], row[0]))
+
+    ids, amounts, dates, labels, descriptions, created = zip(*rows)
+    vocab, codes = np.unique(np.array(labels, dtype=str), return_inverse=True)
+    description_data, description_offsets = _encode_text(descriptions)
+
+    columns = {
+        'id': np.array(ids, dtype=np.int64),
+        'amount': np.array(amounts, dtype=np.float64),
+        'date': np.array([d.toordinal() for d in dates], dtype=np.int32),
+        'label_codes': codes.astype(np.int32),
+        'labels': vocab,
+        'description_data': description_data,
+        'description_offsets': description_offsets,
+        'created_at': np.array([c or datetime(1970, 1, 1) for c in created], dtype='datetime64[us]'),
+    }
+
+    # Write to a staging directory and swap it in so readers never see half a year
+    staging = final + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for name, values in columns.items():
+        with open(os.path.join(staging, f'{name}.npy'), 'wb') as f:
+            np.save(f, values)
+            f.flush()
+            os.fsync(f.fileno())
+    shutil.rmtree(final, ignore_errors=True)
+    os.rename(staging, final)
+    return len(rows)
+
+
+def _year_rows(columns):
+    """Decode a year's columns back into row tuples"""
+    descriptions = decode_text(columns['description_data'], columns['description_offsets'])
+    labels = columns['labels'][columns['label_codes']]
+    created = columns['created_at'].astype('datetime64[us]').tolist()
+    return (
+        [int(i) for i in columns['id']],
+        [float(a) for a in columns['amount']],
+        [date.fromordinal(int(d)) for d in columns['date']],
+        [str(label) for label in labels],
+        descriptions,
+        created,
+    )
+
+
+def decode_text(data, offsets):
+    blob = bytes(data)
+    return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+def load_year(user_id, kind, year):
+    """Memory-map every column of an archived year"""
+    path = _year_dir(user_id, kind, year)
+    return {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in COLUMNS}
+
+
+def load_columns(user_id, kind, years=None):
+    """Concatenate the numeric columns (id, amount, date ordinal, label) across archived years"""
+    years = archived_years(user_id, kind) if years is None else years
+    parts = [load_year(user_id, kind, year) for year in years]
+    if not parts:
+        return {
+            'id': np.zeros(0, dtype=np.int64),
+            'amount': np.zeros(0, dtype=np.float64),
+            'date': np.zeros(0, dtype=np.int32),
+            'label': np.zeros(0, dtype=str),
+        }
+    return {
+        'id': np.concatenate([p['id'] for p in parts]),
+        'amount': np.concatenate([p['amount'] for p in parts]),
+        'date': np.concatenate([p['date'] for p in parts]),
+        'label': np.concatenate([p['labels'][p['label_codes']] for p in parts]),
+    }
+
+
+def archived_spent(user_id, start_date, end_date):
+    """Sum of a user's archived expenses dated in [start_date, end_date)"""
+    years = [y for y in archived_years(user_id, 'expenses') if start_date.year <= y <= end_date.year]
+    if not years:
+        return 0.0
+    columns = load_columns(user_id, 'expenses', years)
+    dates = columns['date']
+    mask = (dates >= start_date.toordinal()) & (dates < end_date.toordinal())
+    return float(columns['amount'][mask].sum())
+
+
+def archived_records(user_id, kind):
+    """Archived rows shaped like the model's to_dict(), newest first"""
+    label = ARCHIVE_SOURCES[kind]['label']
+    records = []
+    for year in reversed(archived_years(user_id, kind)):
+        ids, amounts, dates, labels, descriptions, created = _year_rows(load_year(user_id, kind, year))
+        year_records = [
+            {
+                'id': ids[i],
+                'amount': amounts[i],
+                label: labels[i],
+                'description': descriptions[i],
+                'date': dates[i].isoformat(),
+                'created_at': created[i].isoformat() if created[i] else None,
+                'archived': True,
+            }
+            for i in range(len(ids))
+        ]
+        year_records.sort(key=lambda r: r['date'], reverse=True)
+        records.extend(year_records)
+    return records
+
+
+def archive_before(year):
+    """Move every row dated before 1 January of year out of the hot tables
+
+    Rows are written per user and year, fsynced, and only then deleted from
+    the database in one statement per table, along with the anomaly flags of
+    archived expenses. Budgets keep counting archived spend (see
+    archived_spent). Returns {table: rows_archived}.
+    """
+    cutoff = date(year, 1, 1)
+    moved = {}
+
+    for kind, source in ARCHIVE_SOURCES.items():
+        model = source['model']
+        rows = db.session.query(
+            model.user_id, model.id, model.amount, model.date,
+            getattr(model, source['label']), model.description, model.created_at
+        ).filter(model.date < cutoff).order_by(model.user_id, model.date).all()
+
+        groups = {}
+        for user_id, *row in rows:
+            groups.setdefault((user_id, row[2].year), []).append(tuple(row))
+
+        for (user_id, row_year), year_rows in groups.items():
+            _write_year(user_id, kind, row_year, year_rows)
+
+        if rows:
+            if model is Expense:
+                # Anomaly flags would otherwise point at expenses that no longer exist
+                db.session.execute(text(f'''
+                    DELETE FROM {ExpenseAnomaly.__tablename__} WHERE expense_id IN (
+                        SELECT id FROM {model.__tablename__} WHERE date < :cutoff AND id <= :max_id)
+                '''), {'cutoff': cutoff, 'max_id': max(row[1] for row in rows)})
+            # Bound by id so rows written after the scan stay in the hot table
+            db.session.execute(
+                text(f'DELETE FROM {model.__tablename__} WHERE date < :cutoff AND id <= :max_id'),
+                {'cutoff': cutoff, 'max_id': max(row[1] for row in rows)}
+            )
+        moved[kind] = len(rows)
+
+    db.session.commit()
+    return moved
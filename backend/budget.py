@@ -0,0 +1,151 @@
+from datetime import datetime
+
+from sqlalchemy import func, text
+
+from archive import archived_spent
+from models import db, Budget, Expense
+
+# Fractions of the total budget that raise an alert when spending crosses them
+ALERT_THRESHOLDS = (0.8, 1.0)
+
+BUDGET_TABLE = Budget.__tablename__
+
+_alert_listeners = []
+
+
+def on_budget_alert(listener):
+    """Register a callable that receives each budget alert dict"""
+    _alert_listeners.append(listener)
+    return listener
+
+
+def notify_budget_alerts(alerts):
+    """Dispatch alerts to listeners. Call after the transaction commits."""
+    for alert in alerts:
+        for listener in _alert_listeners:
+            try:
+                listener(alert)
+            except Exception as e:
+                print(f"Budget alert listener failed: {e}")
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _crossed(total, spent_before, spent_after):
+    """Thresholds crossed upward by moving spend from spent_before to spent_after"""
+    if total <= 0:
+        return []
+    before = spent_before / total
+    after = spent_after / total
+    return [t for t in ALERT_THRESHOLDS if before < t <= after]
+
+
+def _shift_remaining(user_id, expense_date, amount):
+    """Subtract amount from every budget covering expense_date and collect alerts"""
+    rows = db.session.execute(text(f'''
+        UPDATE {BUDGET_TABLE}
+        SET remaining_budget = remaining_budget - :amount,
+            updated_at = :now
+        WHERE user_id = :user_id
+          AND start_date <= :expense_date
+          AND end_date > :expense_date
+        RETURNING id, total_budget, remaining_budget, period
+    '''), {
+        'amount': amount,
+        'user_id': user_id,
+        'expense_date': _as_date(expense_date),
+        'now': datetime.utcnow(),
+    }).all()
+
+    alerts = []
+    for budget_id, total, remaining, period in rows:
+        spent_after = total - remaining
+        for threshold in _crossed(total, spent_after - amount, spent_after):
+            alerts.append({
+                'type': 'budget_alert',
+                'user_id': user_id,
+                'budget_id': budget_id,
+                'period': period,
+                'threshold': threshold,
+                'total_budget': total,
+                'remaining_budget': remaining,
+                'spent': spent_after,
+            })
+    return alerts
+
+
+def apply_expense_change(user_id, old=None, new=None):
+    """Keep remaining_budget in step with an expense write. Does not commit.
+
+    old and new are (amount, date) pairs for the expense before and after the
+    write; pass None for the side that does not exist (create or delete).
+    Returns the threshold alerts raised by the change.
+    """
+    old_amount, old_date = old if old else (0.0, None)
+    new_amount, new_date = new if new else (0.0, None)
+
+    if old and new and _as_date(old_date) == _as_date(new_date):
+        if new_amount == old_amount:
+            return []
+        return _shift_remaining(user_id, new_date, new_amount - old_amount)
+
+    alerts = []
+    if old:
+        alerts += _shift_remaining(user_id, old_date, -old_amount)
+    if new:
+        alerts += _shift_remaining(user_id, new_date, new_amount)
+    return alerts
+
+
+def spent_in_period(user_id, start_date, end_date):
+    """Sum of a user's expenses dated in [start_date, end_date), archived ones included"""
+    hot = db.session.query(func.coalesce(func.sum(Expense.amount), 0.0)).filter(
+        Expense.user_id == user_id,
+        Expense.date >= start_date,
+        Expense.date < end_date
+    ).scalar()
+    return hot + archived_spent(user_id, _as_date(start_date), _as_date(end_date))
+
+
+def reconcile_budgets(fix=True, tolerance=0.005):
+    """Check every budget's remaining_budget against the expense aggregates
+
+    Uses one grouped join over all budgets, plus the archive for budgets that
+    reach back into archived years. Returns the list of budgets that drifted;
+    when fix is True they are corrected and committed.
+    """
+    spent = func.coalesce(func.sum(Expense.amount), 0.0)
+    rows = db.session.query(
+        Budget.id, Budget.user_id, Budget.total_budget, Budget.remaining_budget,
+        Budget.start_date, Budget.end_date, spent
+    ).outerjoin(
+        Expense,
+        (Expense.user_id == Budget.user_id)
+        & (Expense.date >= Budget.start_date)
+        & (Expense.date < Budget.end_date)
+    ).group_by(Budget.id).all()
+
+    drifted = []
+    for budget_id, user_id, total, remaining, start_date, end_date, spent_total in rows:
+        spent_total += archived_spent(user_id, _as_date(start_date), _as_date(end_date))
+        expected = total - spent_total
+        if abs(expected - remaining) > tolerance:
+            drifted.append({
+                'budget_id': budget_id,
+                'user_id': user_id,
+                'remaining_budget': remaining,
+                'expected': expected,
+            })
+
+    if fix and drifted:
+        db.session.execute(
+            Budget.__table__.update()
+            .where(Budget.__table__.c.id == db.bindparam('b_id'))
+            .values(remaining_budget=db.bindparam('expected')),
+            [{'b_id': d['budget_id'], 'expected': d['expected']} for d in drifted]
+        )
+        db.session.commit()
+
+    return drifted
@@ -0,0 +1,173 @@
+import sqlite3
+
+# Change log kept inside the emergency SQLite database. Only depends on sqlite3
+# so the emergency app can use it in degraded mode: triggers append one row per
+# insert, update or delete and failover.py replays them into the main database.
+
+REPLICATED_TABLES = ('users', 'expenses', 'revenues', 'livestock')
+
+# Werkzeug hash prefixes; anything else in users.password is a legacy plaintext password
+HASH_PREFIXES = ('pbkdf2:', 'scrypt:')
+
+BASE_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )''',
+    '''CREATE TABLE IF NOT EXISTS expenses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        category TEXT NOT NULL,
+        description TEXT,
+        date TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS revenues (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        source TEXT NOT NULL,
+        description TEXT,
+        date TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS livestock (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        breed TEXT,
+        quantity INTEGER NOT NULL,
+        purchase_date TEXT,
+        purchase_price REAL,
+        notes TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )''',
+)
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        changed_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        replayed_at TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS ix_change_log_pending ON change_log (replayed_at, seq)',
+    # Where each mirrored row came from (main databases reuse ids across shards)
+    # and its updated_at as last copied, for conflict detection
+    '''CREATE TABLE IF NOT EXISTS mirror_versions (
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        shard TEXT NOT NULL DEFAULT '',
+        main_id INTEGER NOT NULL,
+        user_id INTEGER,
+        updated_at TEXT,
+        PRIMARY KEY (table_name, row_id)
+    ) WITHOUT ROWID''',
+    'CREATE UNIQUE INDEX IF NOT EXISTS ix_mirror_versions_main ON mirror_versions (table_name, shard, main_id)',
+    '''CREATE TABLE IF NOT EXISTS mirror_state (
+        table_name TEXT PRIMARY KEY,
+        watermark TEXT,
+        synced_at TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS replay_conflicts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        reason TEXT NOT NULL,
+        row_data TEXT,
+        detected_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )''',
+)
+
+
+def _triggers(table):
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS {table}_log_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO change_log (table_name, row_id, op) VALUES ('{table}', new.id, 'insert');
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {table}_log_au AFTER UPDATE ON {table} BEGIN
+            INSERT INTO change_log (table_name, row_id, op) VALUES ('{table}', new.id, 'update');
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {table}_log_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO change_log (table_name, row_id, op) VALUES ('{table}', old.id, 'delete');
+        END''',
+    ]
+
+
+def init_emergency_db(conn):
+    """Create the emergency app's tables plus the change log"""
+    for statement in BASE_SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    init_change_log(conn)
+
+
+def init_change_log(conn):
+    """Create the change log, mirror bookkeeping tables and logging triggers"""
+    conn.execute('PRAGMA journal_mode=WAL')
+    for statement in SCHEMA:
+        conn.execute(statement)
+    for table in REPLICATED_TABLES:
+        for statement in _triggers(table):
+            conn.execute(statement)
+    conn.commit()
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def last_seq(conn):
+    return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()[0]
+
+
+def drop_entries_after(conn, seq):
+    """Forget log rows written after seq, used when the mirror or replay changed rows itself"""
+    conn.execute('DELETE FROM change_log WHERE seq > ?', (seq,))
+
+
+def pending_changes(conn):
+    """Net effect of every unreplayed change, as {table: {row_id: (op, seqs)}}
+
+    An insert followed by updates stays an insert; an insert followed by a
+    delete cancels out; anything ending in a delete is a delete.
+    """
+    changes = {table: {} for table in REPLICATED_TABLES}
+    rows = conn.execute(
+        'SELECT seq, table_name, row_id, op FROM change_log WHERE replayed_at IS NULL ORDER BY seq'
+    ).fetchall()
+    for seq, table, row_id, op in rows:
+        previous = changes[table].get(row_id)
+        if previous is None:
+            changes[table][row_id] = (op, [seq])
+            continue
+        first_op, seqs = previous
+        seqs.append(seq)
+        if op == 'delete':
+            changes[table][row_id] = ('noop' if first_op == 'insert' else 'delete', seqs)
+        elif first_op == 'noop' and op == 'insert':
+            changes[table][row_id] = ('insert', seqs)
+    return changes
+
+
+def mark_replayed(conn, seqs):
+    conn.executemany(
+        "UPDATE change_log SET replayed_at = CURRENT_TIMESTAMP WHERE seq = ?",
+        [(seq,) for seq in seqs]
+    )
+
+
+def pending_count(conn):
+    return conn.execute('SELECT COUNT(*) FROM change_log WHERE replayed_at IS NULL').fetchone()[0]
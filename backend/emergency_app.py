@@ -3,66 +3,19 @@ from flask_cors import CORS
 import sqlite3
 from datetime import datetime
 import os
+from werkzeug.security import check_password_hash, generate_password_hash
+from changelog import HASH_PREFIXES, init_emergency_db
 
 app = Flask(__name__)
 app.secret_key = 'emergency-secret-key-change-me'
 CORS(app, supports_credentials=True)
 
-DB_FILE = 'emergency.db'
+DB_FILE = os.getenv('EMERGENCY_DB', 'emergency.db')
 
 def init_db():
     """Initialize database"""
     conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Users table
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    # Expenses table
-    c.execute('''CREATE TABLE IF NOT EXISTS expenses (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        amount REAL NOT NULL,
-        category TEXT NOT NULL,
-        description TEXT,
-        date TEXT NOT NULL,
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users(id)
-    )''')
-    
-    # Revenues table
-    c.execute('''CREATE TABLE IF NOT EXISTS revenues (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        amount REAL NOT NULL,
-        source TEXT NOT NULL,
-        description TEXT,
-        date TEXT NOT NULL,
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users(id)
-    )''')
-    
-    # Livestock table
-    c.execute('''CREATE TABLE IF NOT EXISTS livestock (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        type TEXT NOT NULL,
-        breed TEXT,
-        quantity INTEGER NOT NULL,
-        purchase_date TEXT,
-        purchase_price REAL,
-        notes TEXT,
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users(id)
-    )''')
-    
-    conn.commit()
+    init_emergency_db(conn)
     conn.close()
     print("✓ Emergency database initialized")
 
@@ -74,6 +27,12 @@ def get_db():
     conn.row_factory = sqlite3.Row
     return conn
 
+def password_matches(stored, password):
+    """Check a password against a hash, or a legacy plaintext password"""
+    if stored.startswith(HASH_PREFIXES):
+        return check_password_hash(stored, password)
+    return stored == password
+
 def login_required(f):
     def wrapper(*args, **kwargs):
         if 'user_id' not in session:
@@ -104,10 +63,10 @@ def register():
             conn.close()
             return jsonify({'success': False, 'error': 'Username already exists'}), 400
         
-        # Create user
+        # Create user (hashed the same way as the main app so it can be replayed there)
         c.execute(
             'INSERT INTO users (username, password, email) VALUES (?, ?, ?)',
-            (data['username'], data['password'], data['email'])
+            (data['username'], generate_password_hash(data['password']), data['email'])
         )
         user_id = c.lastrowid
         conn.commit()
@@ -135,13 +94,13 @@ def login():
         c = conn.cursor()
         
         c.execute(
-            'SELECT id, username, email FROM users WHERE username = ? AND password = ?',
-            (data['username'], data['password'])
+            'SELECT id, username, email, password FROM users WHERE username = ?',
+            (data['username'],)
         )
         user = c.fetchone()
         conn.close()
         
-        if not user:
+        if not user or not password_matches(user['password'], data['password']):
             return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
         
         session['user_id'] = user['id']
@@ -0,0 +1,411 @@
+import json
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, insert, select, text, update
+from werkzeug.security import generate_password_hash
+
+from models import db, User, Expense, Revenue, Livestock, ExpenseAnomaly
+from sharding import activate_shard, deactivate_shard
+from changelog import (HASH_PREFIXES, REPLICATED_TABLES, connect, drop_entries_after, init_emergency_db,
+                       last_seq, mark_replayed, pending_changes)
+
+REPLICA_MODELS = {'users': User, 'expenses': Expense, 'revenues': Revenue, 'livestock': Livestock}
+
+# Emergency column -> main column for each replicated table
+COLUMN_MAP = {
+    'users': {'username': 'username', 'email': 'email', 'password': 'password_hash',
+              'created_at': 'created_at'},
+    'expenses': {'user_id': 'user_id', 'amount': 'amount', 'category': 'category',
+                 'description': 'description', 'date': 'date', 'created_at': 'created_at'},
+    'revenues': {'user_id': 'user_id', 'amount': 'amount', 'source': 'source',
+                 'description': 'description', 'date': 'date', 'created_at': 'created_at'},
+    'livestock': {'user_id': 'user_id', 'type': 'type', 'breed': 'breed', 'quantity': 'quantity',
+                  'purchase_date': 'purchase_date', 'purchase_price': 'purchase_price',
+                  'notes': 'notes', 'created_at': 'created_at'},
+}
+
+DATE_COLUMNS = {'date', 'purchase_date'}
+DATETIME_COLUMNS = {'created_at'}
+
+# Rows updated this long before the watermark are re-read to cover transactions that committed late
+WATERMARK_OVERLAP = timedelta(seconds=60)
+
+# Log of deleted rows kept in each main database, filled by triggers and consumed by the mirror
+DELETION_TABLE = 'mirror_deletions'
+
+
+def _version(updated_at):
+    return updated_at.isoformat(sep=' ') if updated_at else None
+
+
+def _to_emergency(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _to_main(column, value):
+    if value is None:
+        return None
+    if column in DATE_COLUMNS:
+        return date.fromisoformat(str(value)[:10])
+    if column in DATETIME_COLUMNS:
+        return datetime.fromisoformat(str(value))
+    return value
+
+
+def _password_hash(password):
+    return password if password.startswith(HASH_PREFIXES) else generate_password_hash(password)
+
+
+def _password_matches(user, password):
+    if password.startswith(HASH_PREFIXES):
+        return password == user.password_hash
+    return user.check_password(password)
+
+
+def init_deletion_log(tables):
+    """Create the deletion log and its triggers for tables in the current database. Commits."""
+    db.session.execute(text(f'''
+        CREATE TABLE IF NOT EXISTS {DELETION_TABLE} (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL
+        )
+    '''))
+    for table in tables:
+        db.session.execute(text(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_mirror_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {DELETION_TABLE} (table_name, row_id) VALUES ('{table}', old.id);
+            END
+        '''))
+    db.session.commit()
+
+
+def _mirrored_id(conn, table, shard, main_id):
+    row = conn.execute('SELECT row_id FROM mirror_versions WHERE table_name = ? AND shard = ? AND main_id = ?',
+                       (table, shard, main_id)).fetchone()
+    return row[0] if row else None
+
+
+def _mirror_row(conn, table, shard, row, pending):
+    """Copy one changed main row; returns False when it was left alone"""
+    columns = COLUMN_MAP[table]
+    main_id, updated_at, values = row[0], row[1], [_to_emergency(v) for v in row[2:]]
+    # Users live only in the main database and keep their ids; other rows get emergency ids
+    row_id = main_id if table == 'users' else _mirrored_id(conn, table, shard, main_id)
+    if row_id is not None and (table, row_id) in pending:
+        return False
+
+    names = list(columns)
+    try:
+        if row_id is None:
+            row_id = conn.execute(
+                f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})", values
+            ).lastrowid
+        else:
+            conn.execute(
+                f"INSERT INTO {table} (id, {', '.join(names)}) VALUES ({', '.join('?' * (len(names) + 1))}) "
+                f"ON CONFLICT (id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in names)}",
+                [row_id] + values
+            )
+    except conn.IntegrityError:
+        # e.g. a username taken by a user registered during the outage
+        return False
+
+    user_id = main_id if table == 'users' else values[names.index('user_id')]
+    conn.execute(
+        'INSERT OR REPLACE INTO mirror_versions (table_name, row_id, shard, main_id, user_id, updated_at) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (table, row_id, shard, main_id, user_id, _version(updated_at))
+    )
+    return True
+
+
+def _mirror_deletes(conn, table, shard, main_ids, pending):
+    """Drop the emergency copies of rows deleted in main; returns how many went"""
+    deleted = 0
+    for main_id in set(main_ids):
+        row_id = _mirrored_id(conn, table, shard, main_id)
+        if row_id is None or (table, row_id) in pending:
+            continue
+        conn.execute(f'DELETE FROM {table} WHERE id = ?', (row_id,))
+        conn.execute('DELETE FROM mirror_versions WHERE table_name = ? AND row_id = ?', (table, row_id))
+        deleted += 1
+    return deleted
+
+
+def _trim_deletions(consumed):
+    """Forget deletion log entries the mirror has applied, in the current database"""
+    for table, seq in consumed.items():
+        db.session.execute(text(f'DELETE FROM {DELETION_TABLE} WHERE table_name = :table AND seq <= :seq'),
+                           {'table': table, 'seq': seq})
+    db.session.commit()
+
+
+def mirror_to_emergency(path, databases):
+    """Copy main-database rows changed since the last pass into the emergency database
+
+    databases is a callable yielding once per database that holds user data
+    (app.for_each_database). Main ids repeat across shards, so rows other than
+    users get their own emergency ids, mapped to (shard, main id) in
+    mirror_versions. Deletes come from each main database's deletion log; only
+    a table's first pass compares ids to catch rows deleted before the log
+    existed. Rows with unreplayed emergency-side changes are left alone so a
+    mirror pass never overwrites work done during an outage.
+    Returns {table: {'copied': n, 'deleted': n}}.
+    """
+    conn = connect(path)
+    init_emergency_db(conn)
+    counts, consumed = {}, {}
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        before = last_seq(conn)
+        pending = {(table, row_id) for table, rows in pending_changes(conn).items() for row_id in rows}
+
+        for table in REPLICATED_TABLES:
+            model = REPLICA_MODELS[table]
+            state = conn.execute('SELECT watermark FROM mirror_state WHERE table_name = ?', (table,)).fetchone()
+            since = datetime.fromisoformat(state[0]) - WATERMARK_OVERLAP if state and state[0] else None
+
+            query = select(model.id, model.updated_at, *[getattr(model, c) for c in COLUMN_MAP[table].values()])
+            if since is not None:
+                query = query.where(model.updated_at >= since)
+
+            copied, deleted, newest = 0, 0, None
+            for key in ([None] if table == 'users' else databases()):
+                shard = key or ''
+                init_deletion_log([table])
+                log_seq = db.session.execute(text(
+                    f'SELECT COALESCE(MAX(seq), 0) FROM {DELETION_TABLE} WHERE table_name = :table'
+                ), {'table': table}).scalar()
+
+                for row in db.session.execute(query):
+                    copied += _mirror_row(conn, table, shard, row, pending)
+                    if row[1] and (newest is None or row[1] > newest):
+                        newest = row[1]
+
+                gone = list(db.session.execute(text(
+                    f'SELECT row_id FROM {DELETION_TABLE} WHERE table_name = :table AND seq <= :seq'
+                ), {'table': table, 'seq': log_seq}).scalars())
+                if since is None:
+                    main_ids = set(db.session.execute(select(model.id)).scalars())
+                    gone += [main_id for (main_id,) in conn.execute(
+                        'SELECT main_id FROM mirror_versions WHERE table_name = ? AND shard = ?', (table, shard)
+                    ) if main_id not in main_ids]
+                deleted += _mirror_deletes(conn, table, shard, gone, pending)
+                consumed.setdefault(key, {})[table] = log_seq
+
+            if newest is not None:
+                conn.execute(
+                    'INSERT OR REPLACE INTO mirror_state (table_name, watermark, synced_at) VALUES (?, ?, ?)',
+                    (table, newest.isoformat(), datetime.utcnow().isoformat())
+                )
+            counts[table] = {'copied': copied, 'deleted': deleted}
+
+        # The triggers logged the mirror's own writes; they are not local changes
+        drop_entries_after(conn, before)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+    # The emergency copy is durable; a failure here only means the deletes are re-applied next pass
+    _trim_deletions(consumed.pop(None, {}))
+    for key in databases():
+        _trim_deletions(consumed.pop(key, {}))
+    return counts
+
+
+def _emergency_row(conn, table, row_id):
+    row = conn.execute(f'SELECT * FROM {table} WHERE id = ?', (row_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def _owner(emergency_user_id, user_map, local_users):
+    """Main user id for an emergency user id, or None when that user was not replayed"""
+    if emergency_user_id in user_map:
+        return user_map[emergency_user_id]
+    if emergency_user_id in local_users:
+        return None
+    # Mirrored users keep their main id
+    return emergency_user_id if db.session.get(User, emergency_user_id) else None
+
+
+def _fingerprint(model, values):
+    return tuple(values.get(c) for c in COLUMN_MAP[model.__tablename__].values() if c != 'created_at')
+
+
+def _replay_users(conn, changes, result, user_map):
+    for row_id, (op, seqs) in changes.items():
+        result['seqs'].extend(seqs)
+        if op == 'noop':
+            continue
+        row = _emergency_row(conn, 'users', row_id)
+        if op != 'insert':
+            result['conflicts'].append(('users', row_id, op, 'user changes made in emergency mode are not replayed', row))
+            continue
+
+        existing = User.query.filter((User.username == row['username']) | (User.email == row['email'])).first()
+        if existing is not None:
+            if existing.username == row['username'] and _password_matches(existing, row['password']):
+                # Same person registered on both sides
+                user_map[row_id] = existing.id
+                result['local_rows'].append(('users', row_id))
+            else:
+                result['conflicts'].append(('users', row_id, op, 'username or email already taken', row))
+            continue
+
+        user = User(username=row['username'], email=row['email'],
+                    password_hash=_password_hash(row['password']),
+                    created_at=_to_main('created_at', row['created_at']))
+        db.session.add(user)
+        db.session.flush()
+        user_map[row_id] = user.id
+        result['applied']['users'] += 1
+        result['local_rows'].append(('users', row_id))
+
+
+def _replay_mirrored_change(conn, table, row_id, op, result):
+    """Update or delete a row that came from the main database, unless main changed it since"""
+    model = REPLICA_MODELS[table]
+    version = conn.execute(
+        'SELECT user_id, updated_at, main_id FROM mirror_versions WHERE table_name = ? AND row_id = ?',
+        (table, row_id)
+    ).fetchone()
+    row = _emergency_row(conn, table, row_id)
+    if version is None:
+        result['conflicts'].append((table, row_id, op, 'row was never mirrored from the main database', row))
+        return
+
+    owner, mirrored_at, main_id = version
+    token = activate_shard(owner)
+    try:
+        current = db.session.execute(select(model.updated_at).where(model.id == main_id)).first()
+        if current is None:
+            if op == 'update':
+                result['conflicts'].append((table, row_id, op, 'deleted in the main database', row))
+            return
+        if _version(current[0]) != mirrored_at:
+            result['conflicts'].append((table, row_id, op, 'changed in the main database since it was mirrored', row))
+            return
+
+        if op == 'delete':
+            if table == 'expenses':
+                db.session.execute(delete(ExpenseAnomaly).where(ExpenseAnomaly.expense_id == main_id))
+            db.session.execute(delete(model).where(model.id == main_id))
+            result['deleted'].append((table, row_id))
+        else:
+            values = {main: _to_main(main, row[column]) for column, main in COLUMN_MAP[table].items()
+                      if main != 'user_id'}
+            db.session.execute(update(model).where(model.id == main_id).values(**values, updated_at=datetime.utcnow()))
+        result['applied'][table] += 1
+        result['user_ids'].add(owner)
+    finally:
+        deactivate_shard(token)
+
+
+def _replay_inserts(table, inserts, result):
+    """Bulk insert each owner's new rows, skipping ones already present in main"""
+    model = REPLICA_MODELS[table]
+    main_columns = [c for c in COLUMN_MAP[table].values() if c != 'created_at']
+    for owner, items in inserts.items():
+        token = activate_shard(owner)
+        try:
+            existing = {
+                tuple(row) for row in db.session.execute(
+                    select(*[getattr(model, c) for c in main_columns]).where(model.user_id == owner)
+                )
+            }
+            fresh = []
+            for row_id, values in items:
+                key = _fingerprint(model, values)
+                result['local_rows'].append((table, row_id))
+                if key in existing:
+                    result['conflicts'].append((table, row_id, 'insert', 'duplicate of an existing row', values))
+                    continue
+                existing.add(key)
+                fresh.append(values)
+            if fresh:
+                now = datetime.utcnow()
+                db.session.execute(insert(model), [
+                    {**values, 'created_at': values['created_at'] or now, 'updated_at': now} for values in fresh
+                ])
+                result['applied'][table] += len(fresh)
+                result['user_ids'].add(owner)
+        finally:
+            deactivate_shard(token)
+
+
+def replay_emergency(path):
+    """Batch-apply changes made in the emergency database to the main database
+
+    New users and rows are inserted (rows identical to one already in main
+    are skipped as duplicates); updates and deletes of mirrored rows only
+    apply when main has not changed the row since it was mirrored. Anything
+    else is recorded in the emergency replay_conflicts table. Replayed local
+    rows are removed from the emergency database afterwards; the next mirror
+    pass brings them back as mirrored rows.
+
+    Returns {'applied': {table: n}, 'conflicts': n, 'user_ids': set of main user ids}.
+    """
+    conn = connect(path)
+    init_emergency_db(conn)
+    result = {'applied': {table: 0 for table in REPLICATED_TABLES}, 'conflicts': [],
+              'seqs': [], 'local_rows': [], 'deleted': [], 'user_ids': set()}
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        before = last_seq(conn)
+        changes = pending_changes(conn)
+        user_map = {}
+        local_users = {row_id for row_id, (op, _) in changes['users'].items() if op == 'insert'}
+
+        try:
+            _replay_users(conn, changes['users'], result, user_map)
+            for table in REPLICATED_TABLES[1:]:
+                inserts = {}
+                for row_id, (op, seqs) in changes[table].items():
+                    result['seqs'].extend(seqs)
+                    if op == 'noop':
+                        continue
+                    if op != 'insert':
+                        _replay_mirrored_change(conn, table, row_id, op, result)
+                        continue
+                    row = _emergency_row(conn, table, row_id)
+                    owner = _owner(row['user_id'], user_map, local_users)
+                    if owner is None:
+                        result['conflicts'].append((table, row_id, op, 'owner was not replayed', row))
+                        continue
+                    values = {main: _to_main(main, row[column]) for column, main in COLUMN_MAP[table].items()}
+                    values['user_id'] = owner
+                    inserts.setdefault(owner, []).append((row_id, values))
+                _replay_inserts(table, inserts, result)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        # Main has the changes; if anything below fails a re-run skips them as duplicates or conflicts
+        mark_replayed(conn, result['seqs'])
+        conn.executemany(
+            'INSERT INTO replay_conflicts (table_name, row_id, op, reason, row_data) VALUES (?, ?, ?, ?, ?)',
+            [(table, row_id, op, reason, json.dumps(row, default=str))
+             for table, row_id, op, reason, row in result['conflicts']]
+        )
+        for table, row_id in result['local_rows']:
+            conn.execute(f'DELETE FROM {table} WHERE id = ?', (row_id,))
+        conn.executemany('DELETE FROM mirror_versions WHERE table_name = ? AND row_id = ?', result['deleted'])
+        drop_entries_after(conn, before)
+        conn.execute('COMMIT')
+    except Exception:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+    return {'applied': result['applied'], 'conflicts': len(result['conflicts']), 'user_ids': result['user_ids']}
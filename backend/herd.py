@@ -0,0 +1,168 @@
+import csv
+import io
+from datetime import datetime
+
+from sqlalchemy import text
+
+from models import db, Livestock, LivestockPurchase, Revenue, TelemetryReading, TelemetryRollup
+
+LIVESTOCK_TABLE = Livestock.__tablename__
+
+# Per-lot rows deleted with their lot; the purchase ledger is kept on purpose
+LOT_TABLES = (TelemetryReading.__tablename__, TelemetryRollup.__tablename__)
+
+
+class HerdError(ValueError):
+    """Raised when a bulk herd operation cannot be applied"""
+
+
+def head_count(user_id, livestock_type=None):
+    """Total head of one livestock type (or the whole herd) held by a user"""
+    type_filter = '' if livestock_type is None else 'AND type = :type'
+    total = db.session.execute(
+        text(f'SELECT COALESCE(SUM(quantity), 0) FROM {LIVESTOCK_TABLE} '
+             f'WHERE user_id = :user_id {type_filter}'),
+        {'user_id': user_id, 'type': livestock_type}
+    ).scalar()
+    return int(total)
+
+
+def record_purchase(lot, head=None):
+    """Write or correct the purchase ledger row for a lot. Does not commit.
+
+    head is the number bought and is only taken on the first call; corrections
+    to the purchase date or price later reprice that original head count.
+    Lots without both a purchase date and price have no ledger row.
+    """
+    entry = LivestockPurchase.query.filter_by(livestock_id=lot.id).first()
+    if lot.purchase_date is None or lot.purchase_price is None:
+        if entry is not None:
+            db.session.delete(entry)
+        return None
+    if entry is None:
+        entry = LivestockPurchase(livestock_id=lot.id, user_id=lot.user_id, head=head or lot.quantity)
+        db.session.add(entry)
+    entry.purchase_date = lot.purchase_date
+    entry.price_per_head = lot.purchase_price
+    entry.amount = lot.purchase_price * entry.head
+    return entry
+
+
+def delete_lots(condition, params):
+    """Delete the lots matching a SQL condition and their telemetry. Does not commit."""
+    for table in LOT_TABLES:
+        db.session.execute(text(
+            f'DELETE FROM {table} WHERE livestock_id IN (SELECT id FROM {LIVESTOCK_TABLE} WHERE {condition})'
+        ), params)
+    return db.session.execute(text(f'DELETE FROM {LIVESTOCK_TABLE} WHERE {condition}'), params).rowcount
+
+
+def remove_head(user_id, livestock_type, head):
+    """Remove head from a user's lots of one type, oldest lots first
+
+    Runs as one set-based UPDATE using a running total over the lots, then
+    deletes the lots that were emptied along with their telemetry. Does not commit. Returns the number of
+    lots that were touched.
+    """
+    if head <= 0:
+        raise HerdError('Quantity must be positive')
+
+    available = head_count(user_id, livestock_type)
+    if head > available:
+        raise HerdError(f'Only {available} head of {livestock_type} available')
+
+    params = {
+        'user_id': user_id,
+        'type': livestock_type,
+        'head': head,
+        'now': datetime.utcnow(),
+    }
+
+    touched = db.session.execute(text(f'''
+        UPDATE {LIVESTOCK_TABLE}
+        SET quantity = CASE WHEN ranked.running <= :head THEN 0 ELSE ranked.running - :head END,
+            updated_at = :now
+        FROM (
+            SELECT id AS lot_id,
+                   quantity AS lot_quantity,
+                   SUM(quantity) OVER (
+                       ORDER BY CASE WHEN purchase_date IS NULL THEN 1 ELSE 0 END, purchase_date, id
+                   ) AS running
+            FROM {LIVESTOCK_TABLE}
+            WHERE user_id = :user_id AND type = :type
+        ) AS ranked
+        WHERE {LIVESTOCK_TABLE}.id = ranked.lot_id
+          AND ranked.running - ranked.lot_quantity < :head
+    '''), params).rowcount
+
+    delete_lots('user_id = :user_id AND type = :type AND quantity <= 0', params)
+
+    return touched
+
+
+def sell_head(user_id, livestock_type, head, price_per_head=None, sale_date=None):
+    """Sell head of one type and record the sale as revenue. Does not commit."""
+    lots = remove_head(user_id, livestock_type, head)
+
+    revenue = None
+    if price_per_head is not None:
+        revenue = Revenue(
+            amount=float(price_per_head) * head,
+            source='Livestock sale',
+            description=f'Sold {head} head of {livestock_type}',
+            date=sale_date or datetime.now().date(),
+            user_id=user_id
+        )
+        db.session.add(revenue)
+
+    return lots, revenue
+
+
+def parse_weight_csv(content):
+    """Parse scale CSV content with id and weight_kg columns into (id, weight) pairs"""
+    reader = csv.DictReader(io.StringIO(content))
+    if not reader.fieldnames or not {'id', 'weight_kg'} <= set(reader.fieldnames):
+        raise HerdError('CSV must have id and weight_kg columns')
+
+    readings = {}
+    for line, row in enumerate(reader, start=2):
+        try:
+            readings[int(row['id'])] = float(row['weight_kg'])
+        except (TypeError, ValueError):
+            raise HerdError(f'Invalid row on line {line}')
+
+    return list(readings.items())
+
+
+def bulk_update_weights(user_id, readings):
+    """Apply (lot_id, weight_kg) pairs with a single joined UPDATE. Does not commit.
+
+    Readings are staged in a temporary table so the update is one statement
+    regardless of herd size. Lots that do not belong to the user are ignored.
+    Returns the number of lots updated.
+    """
+    if not readings:
+        return 0
+
+    db.session.execute(text(
+        'CREATE TEMP TABLE IF NOT EXISTS livestock_weight_stage '
+        '(lot_id INTEGER PRIMARY KEY, weight_kg REAL NOT NULL)'
+    ))
+    db.session.execute(text('DELETE FROM livestock_weight_stage'))
+    db.session.execute(
+        text('INSERT INTO livestock_weight_stage (lot_id, weight_kg) VALUES (:lot_id, :weight_kg)'),
+        [{'lot_id': lot_id, 'weight_kg': weight} for lot_id, weight in readings]
+    )
+
+    updated = db.session.execute(text(f'''
+        UPDATE {LIVESTOCK_TABLE}
+        SET weight_kg = stage.weight_kg,
+            updated_at = :now
+        FROM livestock_weight_stage AS stage
+        WHERE {LIVESTOCK_TABLE}.id = stage.lot_id
+          AND {LIVESTOCK_TABLE}.user_id = :user_id
+    '''), {'user_id': user_id, 'now': datetime.utcnow()}).rowcount
+
+    db.session.execute(text('DELETE FROM livestock_weight_stage'))
+
+    return updated
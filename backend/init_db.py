@@ -1,4 +1,5 @@
 from app import app, db
+from search import init_search_index
 from sqlalchemy import inspect
 
 def init_database():
@@ -6,6 +7,7 @@ def init_database():
     with app.app_context():
         
         db.create_all()
+        init_search_index()
         
         inspector = inspect(db.engine)
         tables = inspector.get_table_names()
@@ -0,0 +1,91 @@
+"""Concurrent load test against a running API
+
+    python loadtest.py --url http://127.0.0.1:5001 --clients 32 --seconds 20
+
+Each client registers its own user, seeds some expenses, then loops over a
+read-heavy mix (expense list, analytics summary, groupby) with one expense
+create in every ten requests. Prints throughput and latency percentiles.
+Start the server with RATE_LIMITS=0 to measure raw capacity.
+"""
+import argparse
+import random
+import threading
+import time
+import uuid
+
+import numpy as np
+import requests
+
+MIX = (
+    ('GET', '/api/expenses', 4),
+    ('GET', '/api/analytics/summary', 3),
+    ('GET', '/api/analytics/groupby?by=month', 2),
+    ('POST', '/api/expenses', 1),
+)
+
+
+def expense_payload():
+    return {
+        'amount': round(random.uniform(10, 900), 2),
+        'category': random.choice(('Feed', 'Vet', 'Labor', 'Fuel')),
+        'description': 'load test',
+        'date': f'2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}',
+    }
+
+
+def login(url, seed):
+    client = requests.Session()
+    name = f'load-{uuid.uuid4().hex[:10]}'
+    response = client.post(f'{url}/api/auth/register',
+                           json={'username': name, 'email': f'{name}@example.com', 'password': 'load'})
+    response.raise_for_status()
+    for _ in range(seed):
+        client.post(f'{url}/api/expenses', json=expense_payload())
+    return client
+
+
+def run_client(client, url, deadline, latencies, errors):
+    routes = [(method, path) for method, path, weight in MIX for _ in range(weight)]
+    while time.perf_counter() < deadline:
+        method, path = random.choice(routes)
+        start = time.perf_counter()
+        try:
+            if method == 'POST':
+                response = client.post(url + path, json=expense_payload())
+            else:
+                response = client.get(url + path)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+        except requests.RequestException:
+            errors.append(None)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the farm tracker API')
+    parser.add_argument('--url', default='http://127.0.0.1:5001')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--seed', type=int, default=50, help='expenses created per client before the run')
+    args = parser.parse_args()
+
+    clients = [login(args.url, args.seed) for _ in range(args.clients)]
+    latencies, errors = [], []
+    deadline = time.perf_counter() + args.seconds
+    threads = [threading.Thread(target=run_client, args=(c, args.url, deadline, latencies, errors))
+               for c in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ms = np.array(latencies) * 1000
+    print(f'requests: {len(ms)}  errors: {len(errors)}  throughput: {len(ms) / args.seconds:.1f} req/s')
+    if len(ms):
+        p50, p95, p99 = np.percentile(ms, (50, 95, 99))
+        print(f'latency ms  p50: {p50:.1f}  p95: {p95:.1f}  p99: {p99:.1f}  max: {ms.max():.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+from sklearn.metrics import mean_absolute_error
+
+from training import FEATURE_NAMES, make_pipeline
+
+# Users need this many usable monthly rows before they get their own model
+MIN_USER_MONTHS = int(os.getenv('USER_MODEL_MIN_MONTHS', 24))
+USER_TEST_HORIZON = 3
+
+
+class ModelStore:
+    """Per-user estimators on disk with an in-memory LRU bounded by artifact size"""
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, check_interval=5.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self._loaded = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = None
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, user_id):
+        return os.path.join(self.directory, f'user_{int(user_id)}.pkl')
+
+    def get(self, user_id):
+        """(estimator, metadata) for a user, or None when they have no model"""
+        with self._lock:
+            self._check_version()
+            if user_id in self._loaded:
+                self._loaded.move_to_end(user_id)
+                self.hits += 1
+                return self._loaded[user_id][0]
+            self.misses += 1
+            version = self._version
+
+        path = self.path(user_id)
+        entry, size = None, 64
+        if os.path.exists(path):
+            entry = joblib.load(path)
+            size = os.path.getsize(path)
+
+        with self._lock:
+            # Users without a model are cached too, so misses do not stat the disk every request;
+            # a load that a version change overtook may be stale and is not kept
+            if user_id not in self._loaded and self._version == version:
+                self._loaded[user_id] = (entry, size)
+                self._bytes += size
+                self._evict()
+            return entry
+
+    def _check_version(self):
+        """Drop everything loaded once another process (retrain-model) has written or removed models
+
+        put and remove swap files in with os.replace, which bumps the
+        directory's mtime, so one stat per check_interval covers every user.
+        """
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            version = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            version = None
+        if version != self._version:
+            self._version = version
+            self._loaded.clear()
+            self._bytes = 0
+
+    def _evict(self):
+        while len(self._loaded) > 1 and self._bytes > self.max_bytes:
+            _, (_, size) = self._loaded.popitem(last=False)
+            self._bytes -= size
+
+    def put(self, user_id, estimator, metadata):
+        os.makedirs(self.directory, exist_ok=True)
+        staging = self.path(user_id) + '.tmp'
+        joblib.dump((estimator, metadata), staging)
+        os.replace(staging, self.path(user_id))
+        self.forget(user_id)
+
+    def remove(self, user_id):
+        if os.path.exists(self.path(user_id)):
+            os.remove(self.path(user_id))
+        self.forget(user_id)
+
+    def forget(self, user_id):
+        with self._lock:
+            entry = self._loaded.pop(user_id, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._loaded.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'loaded': len(self._loaded),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else None,
+            }
+
+
+def _fit_user(args):
+    """Fit one user's model, holding out their last months for an error estimate"""
+    user_id, X, y, params = args
+    train = slice(None, -USER_TEST_HORIZON)
+    test = slice(-USER_TEST_HORIZON, None)
+    mae = mean_absolute_error(y[test], make_pipeline(**params).fit(X[train], y[train]).predict(X[test]))
+    return user_id, make_pipeline(**params).fit(X, y), {
+        'rows': int(len(y)),
+        'test_mae': float(mae),
+        'params': params,
+    }
+
+
+def train_user_models(frame, store, params, workers=None):
+    """Fit a model for every user with enough history and drop stale ones
+
+    Users below MIN_USER_MONTHS fall back to the global model. Returns the
+    number of user models written.
+    """
+    frame = frame.sort_values(['user_id', 'Date'])
+    counts = frame.groupby('user_id').size()
+    eligible = counts[counts >= MIN_USER_MONTHS].index
+
+    X = frame[FEATURE_NAMES].astype(np.float64).reset_index(drop=True)
+    y = frame['Total_Expenses'].to_numpy(dtype=np.float64)
+    users = frame['user_id'].to_numpy()
+    bounds = np.flatnonzero(np.diff(users)) + 1
+    starts = np.concatenate([[0], bounds])
+    ends = np.concatenate([bounds, [len(users)]])
+
+    jobs = [
+        (int(users[start]), X[start:end], y[start:end], params)
+        for start, end in zip(starts, ends)
+        if users[start] in eligible
+    ]
+    if workers == 1 or len(jobs) < 50:
+        results = list(map(_fit_user, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_fit_user, jobs, chunksize=64))
+
+    for user_id, estimator, metadata in results:
+        store.put(user_id, estimator, metadata)
+
+    for user_id in set(counts.index) - set(eligible):
+        store.remove(user_id)
+
+    return len(results)
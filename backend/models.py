@@ -1,8 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from sharding import ShardedSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': ShardedSession})
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -111,6 +112,21 @@ class Livestock(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+class LivestockPurchase(db.Model):
+    __tablename__ = 'livestock_purchases'
+
+    # What a lot cost when it was bought. Sales and culls shrink or delete the lot
+    # but never touch this row, so purchase history reports stay fixed.
+    id = db.Column(db.Integer, primary_key=True)
+    livestock_id = db.Column(db.Integer, nullable=False, unique=True)  # no FK: sold-out lots are deleted
+    purchase_date = db.Column(db.Date, nullable=False)
+    head = db.Column(db.Integer, nullable=False)
+    price_per_head = db.Column(db.Float, nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+
 class Budget(db.Model):
     __tablename__ = 'budgets'
 
@@ -135,3 +151,137 @@ class Budget(db.Model):
             'end_date': self.end_date.isoformat() if self.end_date else None,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+
+class ExpenseStat(db.Model):
+    __tablename__ = 'expense_stats'
+
+    id = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    mean = db.Column(db.Float, nullable=False, default=0)
+    m2 = db.Column(db.Float, nullable=False, default=0)  # Welford sum of squared deviations
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'category', name='uq_expense_stats_user_category'),)
+
+    def to_dict(self):
+        return {
+            'category': self.category,
+            'count': self.count,
+            'mean': self.mean,
+            'std': (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else None
+        }
+
+class ExpenseAnomaly(db.Model):
+    __tablename__ = 'expense_anomalies'
+
+    id = db.Column(db.Integer, primary_key=True)
+    expense_id = db.Column(db.Integer, db.ForeignKey('expenses.id'), nullable=False, unique=True)
+    score = db.Column(db.Float, nullable=False)
+    expected = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+
+    expense = db.relationship('Expense', lazy='joined')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'expense': self.expense.to_dict() if self.expense else None,
+            'score': self.score,
+            'expected': self.expected,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class TelemetryReading(db.Model):
+    __tablename__ = 'telemetry_readings'
+
+    # Append-only; written in bulk by telemetry.store_readings
+    id = db.Column(db.Integer, primary_key=True)
+    livestock_id = db.Column(db.Integer, db.ForeignKey('livestock.id'), nullable=False)
+    metric = db.Column(db.SmallInteger, nullable=False)  # index into telemetry.METRICS
+    recorded_at = db.Column(db.Float, nullable=False)  # Unix seconds
+    value = db.Column(db.Float, nullable=False)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+    __table_args__ = (db.Index('ix_telemetry_readings_lot_time', 'livestock_id', 'recorded_at'),)
+
+class TelemetryRollup(db.Model):
+    __tablename__ = 'telemetry_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    livestock_id = db.Column(db.Integer, db.ForeignKey('livestock.id'), nullable=False)
+    metric = db.Column(db.SmallInteger, nullable=False)
+    resolution = db.Column(db.String(10), nullable=False)  # hour, day
+    bucket_start = db.Column(db.Integer, nullable=False)  # Unix seconds
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0)
+    min_value = db.Column(db.Float, nullable=False)
+    max_value = db.Column(db.Float, nullable=False)
+    last_value = db.Column(db.Float, nullable=False)
+    last_at = db.Column(db.Float, nullable=False)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('livestock_id', 'metric', 'resolution', 'bucket_start',
+                            name='uq_telemetry_rollups_bucket'),
+    )
+
+class RecurringExpense(db.Model):
+    __tablename__ = 'recurring_expenses'
+
+    id = db.Column(db.Integer, primary_key=True)
+    amount = db.Column(db.Float, nullable=False)
+    category = db.Column(db.String(50), nullable=False)
+    description = db.Column(db.Text)
+    rule = db.Column(db.String(255), nullable=False)  # RRULE body, e.g. FREQ=MONTHLY;BYMONTHDAY=1
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date)
+    next_date = db.Column(db.Date)  # next occurrence to materialize; NULL once the schedule has ended
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+    __table_args__ = (db.Index('ix_recurring_expenses_due', 'active', 'next_date'),)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'amount': self.amount,
+            'category': self.category,
+            'description': self.description,
+            'rule': self.rule,
+            'start_date': self.start_date.isoformat() if self.start_date else None,
+            'end_date': self.end_date.isoformat() if self.end_date else None,
+            'next_date': self.next_date.isoformat() if self.next_date else None,
+            'active': self.active,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class RecurringOccurrence(db.Model):
+    __tablename__ = 'recurring_occurrences'
+
+    # One row per materialized occurrence, so re-running a backfill never duplicates expenses
+    schedule_id = db.Column(db.Integer, db.ForeignKey('recurring_expenses.id', ondelete='CASCADE'), primary_key=True)
+    occurrence_date = db.Column(db.Date, primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+class CacheInvalidation(db.Model):
+    __tablename__ = 'cache_invalidations'
+
+    # Written by CLI jobs that change user data behind the server's back; every
+    # server process polls it and drops those users from its analytics cache
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    # Never reuse ids: pollers remember the last id they saw
+    __table_args__ = {'sqlite_autoincrement': True}
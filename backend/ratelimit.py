@@ -0,0 +1,88 @@
+import math
+import threading
+import time
+
+# Idle buckets are pruned once this many exist
+MAX_BUCKETS = 100000
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst, now):
+        self.tokens = float(burst)
+        self.updated = now
+
+
+class RateLimiter:
+    """Token buckets per (client, endpoint) plus concurrency caps per endpoint
+
+    limits maps endpoint -> (requests_per_second, burst); endpoints not listed
+    use default. concurrency maps endpoint -> max requests in flight.
+    """
+
+    def __init__(self, default=(10.0, 20), limits=None, concurrency=None):
+        self.default = default
+        self.limits = dict(limits or {})
+        self.concurrency = dict(concurrency or {})
+        self._buckets = {}
+        self._in_flight = {endpoint: 0 for endpoint in self.concurrency}
+        self._lock = threading.Lock()
+        self.limited = 0
+        self.rejected = 0
+
+    def acquire(self, client, endpoint):
+        """Take one token; returns 0 when admitted, else seconds until a token is free"""
+        rate, burst = self.limits.get(endpoint, self.default)
+        now = time.monotonic()
+        key = (client, endpoint)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= MAX_BUCKETS:
+                    self._prune(now)
+                bucket = self._buckets[key] = TokenBucket(burst, now)
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return 0
+            self.limited += 1
+            return (1 - bucket.tokens) / rate
+
+    def _prune(self, now):
+        """Drop buckets that have refilled completely, they hold no state worth keeping"""
+        for key, bucket in list(self._buckets.items()):
+            rate, burst = self.limits.get(key[1], self.default)
+            if bucket.tokens + (now - bucket.updated) * rate >= burst:
+                del self._buckets[key]
+
+    def enter(self, endpoint):
+        """Claim a concurrency slot; False when the endpoint is already at its cap"""
+        cap = self.concurrency.get(endpoint)
+        if cap is None:
+            return True
+        with self._lock:
+            if self._in_flight[endpoint] >= cap:
+                self.rejected += 1
+                return False
+            self._in_flight[endpoint] += 1
+            return True
+
+    def exit(self, endpoint):
+        if endpoint in self.concurrency:
+            with self._lock:
+                self._in_flight[endpoint] -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'buckets': len(self._buckets),
+                'in_flight': dict(self._in_flight),
+                'rate_limited': self.limited,
+                'concurrency_rejected': self.rejected,
+            }
+
+
+def retry_after_header(seconds):
+    return str(max(1, math.ceil(seconds)))
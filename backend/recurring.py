@@ -0,0 +1,222 @@
+import threading
+import time
+from functools import lru_cache
+from datetime import date, datetime, time as clock
+
+from dateutil.rrule import rrulestr
+from sqlalchemy import insert, text
+
+from models import db, Expense, RecurringExpense, RecurringOccurrence
+
+# RRULE subset accepted for schedules; expenses are dated, so nothing finer than a day
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+RULE_PARTS = {'FREQ', 'INTERVAL', 'COUNT', 'UNTIL', 'BYDAY', 'BYMONTHDAY', 'BYMONTH', 'BYSETPOS', 'WKST'}
+
+# A long-idle daily schedule is caught up over several runs rather than in one giant batch
+MAX_OCCURRENCES_PER_RUN = 400
+
+OCCURRENCE_TABLE = RecurringOccurrence.__tablename__
+
+
+class RecurringError(ValueError):
+    """Raised for invalid recurrence rules or schedules"""
+
+
+def parse_rule(rule=None, frequency=None, interval=1):
+    """Validate an RRULE (or a frequency shorthand) and split off its bounds
+
+    Returns (body, count, until) where body has no COUNT, UNTIL or DTSTART;
+    the bounds are folded into the schedule's end_date instead.
+    """
+    if not rule:
+        if not frequency or str(frequency).upper() not in FREQUENCIES:
+            raise RecurringError(f"Frequency must be one of: {', '.join(f.lower() for f in FREQUENCIES)}")
+        rule = f'FREQ={str(frequency).upper()};INTERVAL={int(interval)}'
+
+    parts = {}
+    for part in str(rule).upper().removeprefix('RRULE:').split(';'):
+        key, _, value = part.partition('=')
+        if key not in RULE_PARTS or not value:
+            raise RecurringError(f'Unsupported rule part: {part}')
+        parts[key] = value
+
+    if parts.get('FREQ') not in FREQUENCIES:
+        raise RecurringError(f"FREQ must be one of: {', '.join(FREQUENCIES)}")
+    if 'INTERVAL' in parts and (not parts['INTERVAL'].isdigit() or int(parts['INTERVAL']) < 1):
+        raise RecurringError('INTERVAL must be a positive integer')
+
+    count = parts.pop('COUNT', None)
+    if count is not None and (not count.isdigit() or int(count) < 1):
+        raise RecurringError('COUNT must be a positive integer')
+    until = parts.pop('UNTIL', None)
+    if until is not None:
+        try:
+            until = datetime.strptime(until[:8], '%Y%m%d').date()
+        except ValueError:
+            raise RecurringError('UNTIL must look like YYYYMMDD')
+
+    body = ';'.join(f'{key}={value}' for key, value in parts.items())
+    try:
+        build_rule(body, date.today())
+    except ValueError as e:
+        raise RecurringError(f'Invalid rule: {e}')
+    return body, int(count) if count else None, until
+
+
+def build_rule(body, anchor):
+    """The rule starting at anchor, which must be an occurrence (or the schedule start)
+
+    Restarting the rule from any later occurrence yields the same dates, so
+    materializing never has to walk the schedule from its original start.
+    """
+    return _parsed_rule(body).replace(dtstart=datetime.combine(anchor, clock()))
+
+
+@lru_cache(maxsize=1024)
+def _parsed_rule(body):
+    # Most schedules share a handful of rule strings; parse each once
+    return rrulestr(body, dtstart=datetime(2000, 1, 1), cache=False)
+
+
+def first_occurrence(body, start_date, on_or_after=None):
+    found = build_rule(body, start_date).after(datetime.combine(on_or_after or start_date, clock()), inc=True)
+    return found.date() if found else None
+
+
+def schedule_bounds(body, start_date, count=None, until=None, end_date=None):
+    """(first occurrence, end_date) for a new schedule, with COUNT turned into an end date"""
+    ends = [d for d in (until, end_date) if d]
+    if count:
+        occurrences = build_rule(body + f';COUNT={count}', start_date)
+        ends.append(list(occurrences)[-1].date())
+    end = min(ends) if ends else None
+
+    first = first_occurrence(body, start_date)
+    if first is None or (end and first > end):
+        raise RecurringError('Schedule has no occurrences')
+    return first, end
+
+
+def due_dates(schedule, through, anchor=None):
+    """Occurrences from anchor (default next_date) up to through, and the next date after them"""
+    anchor = anchor or schedule.next_date
+    last = min(through, schedule.end_date) if schedule.end_date else through
+    dates = []
+    for occurrence in build_rule(schedule.rule, anchor):
+        day = occurrence.date()
+        if day > last or len(dates) == MAX_OCCURRENCES_PER_RUN:
+            return dates, day if not schedule.end_date or day <= schedule.end_date else None
+        dates.append(day)
+    return dates, None
+
+
+def materialize_due(through=None, since=None, user_id=None, schedule_ids=None):
+    """Turn due occurrences of active schedules into expenses with a few bulk statements
+
+    through defaults to today. Each occurrence is claimed in recurring_occurrences
+    before its expense is written, so overlapping or repeated runs (and backfills
+    with since, which re-scan every active schedule from that date) never create
+    duplicates. Does not commit and does no stats or budget bookkeeping; returns
+    the created Expense objects, flushed, for the caller to book like any other
+    new expense.
+    """
+    through = through or date.today()
+    query = RecurringExpense.query.filter(RecurringExpense.active.is_(True))
+    if since is None:
+        query = query.filter(RecurringExpense.next_date <= through)
+    else:
+        query = query.filter(RecurringExpense.start_date <= through)
+    if user_id is not None:
+        query = query.filter(RecurringExpense.user_id == user_id)
+    if schedule_ids is not None:
+        query = query.filter(RecurringExpense.id.in_(schedule_ids))
+
+    candidates, advances = {}, []
+    for schedule in query:
+        if since is None:
+            dates, next_date = due_dates(schedule, through)
+        else:
+            anchor = first_occurrence(schedule.rule, schedule.start_date, max(since, schedule.start_date))
+            dates, next_date = due_dates(schedule, through, anchor) if anchor else ([], None)
+            # A backfill never moves a schedule backwards or revives a finished one
+            if schedule.next_date is None or (next_date and next_date < schedule.next_date):
+                next_date = schedule.next_date
+        for day in dates:
+            candidates[(schedule.id, day.isoformat())] = {
+                'schedule_id': schedule.id,
+                'occurrence_date': day,
+                'user_id': schedule.user_id,
+                'amount': schedule.amount,
+                'category': schedule.category,
+                'description': schedule.description,
+            }
+        if next_date != schedule.next_date:
+            advances.append({'s_id': schedule.id, 'next_date': next_date})
+
+    now = datetime.utcnow()
+    created = []
+    if candidates:
+        db.session.execute(text(
+            'CREATE TEMP TABLE IF NOT EXISTS recurring_stage '
+            '(schedule_id INTEGER, occurrence_date DATE, user_id INTEGER, PRIMARY KEY (schedule_id, occurrence_date))'
+        ))
+        db.session.execute(text('DELETE FROM recurring_stage'))
+        db.session.execute(
+            text('INSERT INTO recurring_stage (schedule_id, occurrence_date, user_id) '
+                 'VALUES (:schedule_id, :occurrence_date, :user_id)'),
+            [{key: row[key] for key in ('schedule_id', 'occurrence_date', 'user_id')} for row in candidates.values()]
+        )
+        claimed = db.session.execute(text(f'''
+            INSERT INTO {OCCURRENCE_TABLE} (schedule_id, occurrence_date, user_id, created_at)
+            SELECT schedule_id, occurrence_date, user_id, :now FROM recurring_stage WHERE true
+            ON CONFLICT (schedule_id, occurrence_date) DO NOTHING
+            RETURNING schedule_id, occurrence_date
+        '''), {'now': now}).all()
+        db.session.execute(text('DELETE FROM recurring_stage'))
+
+        rows = sorted((candidates[(schedule_id, str(day))] for schedule_id, day in claimed),
+                      key=lambda row: (row['user_id'], row['occurrence_date']))
+        if rows:
+            # Batched INSERT ... RETURNING: the callers get Expense objects with ids for their bookkeeping
+            created = db.session.scalars(insert(Expense).returning(Expense, sort_by_parameter_order=True), [
+                {'amount': row['amount'], 'category': row['category'], 'description': row['description'],
+                 'date': row['occurrence_date'], 'user_id': row['user_id'], 'created_at': now, 'updated_at': now}
+                for row in rows
+            ]).all()
+
+    if advances:
+        db.session.execute(
+            RecurringExpense.__table__.update()
+            .where(RecurringExpense.__table__.c.id == db.bindparam('s_id'))
+            .values(next_date=db.bindparam('next_date'), updated_at=now),
+            advances
+        )
+    return created
+
+
+class RecurringGenerator:
+    """Calls job every interval seconds on a daemon thread"""
+
+    def __init__(self, interval_seconds, job):
+        self.interval = interval_seconds
+        self.job = job
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='recurring-generator', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            started = time.time()
+            try:
+                created = self.job()
+                if created:
+                    print(f"Materialized {created} recurring expenses in {time.time() - started:.1f}s")
+            except Exception as e:
+                print(f"Recurring expense generation failed: {e}")
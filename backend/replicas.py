@@ -0,0 +1,115 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import sqlalchemy as sa
+from sqlalchemy import event
+
+# Seconds after a user's last write during which their reads stay on the primary
+DEFAULT_STICKY_SECONDS = 5
+
+_config = {'engine': None, 'sticky_seconds': DEFAULT_STICKY_SECONDS}
+_read_routing = ContextVar('read_routing', default=False)
+
+
+def _enable_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.close()
+
+
+def _query_only(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA query_only=ON')
+    cursor.close()
+
+
+def configure_replica(primary_engine, url=None, sticky_seconds=DEFAULT_STICKY_SECONDS):
+    """Set up the read engine
+
+    url is another database URL (e.g. a copied SQLite file kept fresh by
+    sync_replica), or 'readonly' to open the primary SQLite file through a
+    separate read-only connection pool with the primary switched to WAL so
+    readers never block writers. Without a url every query uses the primary.
+    """
+    _config['sticky_seconds'] = float(sticky_seconds)
+    if not url:
+        _config['engine'] = None
+        return None
+
+    if url == 'readonly':
+        if primary_engine.dialect.name != 'sqlite':
+            raise ValueError("READ_REPLICA_URL=readonly needs a SQLite primary")
+        path = primary_engine.url.database
+        event.listen(primary_engine, 'connect', _enable_wal)
+        with primary_engine.connect() as conn:
+            conn.exec_driver_sql('PRAGMA journal_mode=WAL')
+        engine = sa.create_engine(f'sqlite:///file:{path}?mode=ro&uri=true')
+    else:
+        engine = sa.create_engine(url)
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', _query_only)
+
+    _config['engine'] = engine
+    return engine
+
+
+def replica_enabled():
+    return _config['engine'] is not None
+
+
+def replica_engine():
+    return _config['engine']
+
+
+def reads_routed():
+    """True when the current context may send reads to the replica"""
+    return _config['engine'] is not None and _read_routing.get()
+
+
+def recently_wrote(last_write_at):
+    """Whether a write at last_write_at (epoch seconds) is still inside the sticky window"""
+    return last_write_at is not None and time.time() - last_write_at < _config['sticky_seconds']
+
+
+def route_reads(enabled=True):
+    """Allow reads in the current context to go to the replica; returns a reset token"""
+    if _config['engine'] is None:
+        return None
+    return _read_routing.set(enabled)
+
+
+def stop_routing(token):
+    if token is not None:
+        _read_routing.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """Run a block with every query on the primary"""
+    token = _read_routing.set(False)
+    try:
+        yield
+    finally:
+        _read_routing.reset(token)
+
+
+def sync_replica(primary_engine):
+    """Copy the primary SQLite database onto the replica file with the online backup API"""
+    replica = _config['engine']
+    if replica is None or replica.dialect.name != 'sqlite' or primary_engine.dialect.name != 'sqlite':
+        raise ValueError('sync_replica needs a SQLite primary and a separate SQLite replica URL')
+    replica_path = replica.url.database
+    if replica_path.startswith('file:'):
+        raise ValueError('The read-only replica shares the primary file and needs no sync')
+
+    replica.dispose()
+    source = sqlite3.connect(primary_engine.url.database)
+    target = sqlite3.connect(replica_path)
+    try:
+        source.backup(target, pages=4096)
+    finally:
+        target.close()
+        source.close()
+    return replica_path
@@ -0,0 +1,185 @@
+from datetime import date
+
+import numpy as np
+from sqlalchemy import func, select
+
+from models import db, Livestock, LivestockPurchase
+from analytics_cache import date_mask, to_ordinal, month_label, ordinals_to_months
+
+PERIODS = ('week', 'month', 'quarter', 'year')
+
+
+def period_index(period, ordinals, months):
+    """Bucket rows into period numbers; weeks start on Monday"""
+    if period == 'week':
+        return (ordinals.astype(np.int64) - 1) // 7
+    if period == 'month':
+        return months.astype(np.int64)
+    if period == 'quarter':
+        return months.astype(np.int64) // 3
+    return months.astype(np.int64) // 12
+
+
+def period_label(period, index):
+    if period == 'week':
+        return date.fromordinal(index * 7 + 1).isoformat()
+    if period == 'month':
+        return month_label(index)
+    if period == 'quarter':
+        return f'{1970 + index // 4}-Q{index % 4 + 1}'
+    return str(1970 + index)
+
+
+def _select(columns, period, start, end):
+    _, ordinals, months, amounts, codes = columns.view()
+    mask = date_mask(ordinals, start, end)
+    return period_index(period, ordinals[mask], months[mask]), amounts[mask], codes[mask]
+
+
+def _matrix(index, amounts, codes, first, span, n_labels):
+    """Totals per (period, label) as a dense span x n_labels matrix"""
+    if not n_labels:
+        return np.zeros((span, 0))
+    flat = (index - first) * n_labels + codes
+    return np.bincount(flat, weights=amounts, minlength=span * n_labels).reshape(span, n_labels)
+
+
+def _breakdown(row, labels):
+    return {labels[i]: round(float(row[i]), 2) for i in np.flatnonzero(row)}
+
+
+def _bounds(*indexes):
+    present = [ix for ix in indexes if len(ix)]
+    if not present:
+        return None
+    first = min(int(ix.min()) for ix in present)
+    last = max(int(ix.max()) for ix in present)
+    return first, last - first + 1
+
+
+def profit_and_loss(expense_columns, revenue_columns, period='month', start=None, end=None):
+    """Revenue by source, expenses by category and net income for each period"""
+    if period not in PERIODS:
+        raise ValueError(f"Period must be one of: {', '.join(PERIODS)}")
+
+    e_index, e_amounts, e_codes = _select(expense_columns, period, start, end)
+    r_index, r_amounts, r_codes = _select(revenue_columns, period, start, end)
+    bounds = _bounds(e_index, r_index)
+    if bounds is None:
+        return {'periods': [], 'totals': {'revenue': 0.0, 'expenses': 0.0, 'net_income': 0.0}}
+    first, span = bounds
+
+    expenses = _matrix(e_index, e_amounts, e_codes, first, span, len(expense_columns.labels))
+    revenues = _matrix(r_index, r_amounts, r_codes, first, span, len(revenue_columns.labels))
+    expense_totals = expenses.sum(axis=1)
+    revenue_totals = revenues.sum(axis=1)
+    net = revenue_totals - expense_totals
+
+    periods = [
+        {
+            'period': period_label(period, first + i),
+            'revenue': round(float(revenue_totals[i]), 2),
+            'revenue_by_source': _breakdown(revenues[i], revenue_columns.labels),
+            'expenses': round(float(expense_totals[i]), 2),
+            'expenses_by_category': _breakdown(expenses[i], expense_columns.labels),
+            'net_income': round(float(net[i]), 2),
+            'margin_pct': round(float(net[i] / revenue_totals[i] * 100), 2) if revenue_totals[i] else None,
+        }
+        for i in range(span)
+    ]
+
+    return {
+        'periods': periods,
+        'totals': {
+            'revenue': round(float(revenue_totals.sum()), 2),
+            'revenue_by_source': _breakdown(revenues.sum(axis=0), revenue_columns.labels),
+            'expenses': round(float(expense_totals.sum()), 2),
+            'expenses_by_category': _breakdown(expenses.sum(axis=0), expense_columns.labels),
+            'net_income': round(float(net.sum()), 2),
+        }
+    }
+
+
+def livestock_purchases(user_id):
+    """Livestock purchase outlays grouped by purchase date
+
+    Read from the purchase ledger, so selling or culling head later does not
+    change past outlays. Lots bought before the ledger existed fall back to
+    their current price and quantity.
+    """
+    totals = {}
+    ledger = db.session.query(
+        LivestockPurchase.purchase_date, func.sum(LivestockPurchase.amount)
+    ).filter(LivestockPurchase.user_id == user_id).group_by(LivestockPurchase.purchase_date)
+    unrecorded = db.session.query(
+        Livestock.purchase_date,
+        func.sum(Livestock.purchase_price * Livestock.quantity)
+    ).filter(
+        Livestock.user_id == user_id,
+        Livestock.purchase_date.isnot(None),
+        Livestock.purchase_price.isnot(None),
+        ~select(LivestockPurchase.id).where(LivestockPurchase.livestock_id == Livestock.id).exists()
+    ).group_by(Livestock.purchase_date)
+    for purchase_date, total in list(ledger) + list(unrecorded):
+        totals[purchase_date] = totals.get(purchase_date, 0.0) + total
+
+    ordinals = np.array([to_ordinal(d) for d in totals], dtype=np.int32)
+    amounts = np.array(list(totals.values()), dtype=np.float64)
+    return ordinals, amounts
+
+
+def cash_flow(expense_columns, revenue_columns, purchases, period='month', start=None, end=None):
+    """Operating and investing cash flows with running balance for each period
+
+    The opening balance is the net of all flows dated before start.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"Period must be one of: {', '.join(PERIODS)}")
+
+    p_ordinals, p_amounts = purchases
+    p_months = ordinals_to_months(p_ordinals)
+
+    opening = 0.0
+    if start is not None:
+        start_ordinal = to_ordinal(start)
+        _, e_ord, _, e_amt, _ = expense_columns.view()
+        _, r_ord, _, r_amt, _ = revenue_columns.view()
+        opening = float(r_amt[r_ord < start_ordinal].sum()
+                        - e_amt[e_ord < start_ordinal].sum()
+                        - p_amounts[p_ordinals < start_ordinal].sum())
+
+    e_index, e_amounts, _ = _select(expense_columns, period, start, end)
+    r_index, r_amounts, _ = _select(revenue_columns, period, start, end)
+    p_mask = date_mask(p_ordinals, start, end)
+    p_index = period_index(period, p_ordinals[p_mask], p_months[p_mask])
+    p_amounts = p_amounts[p_mask]
+
+    bounds = _bounds(e_index, r_index, p_index)
+    if bounds is None:
+        return {'opening_balance': round(opening, 2), 'periods': [], 'closing_balance': round(opening, 2)}
+    first, span = bounds
+
+    inflows = np.bincount(r_index - first, weights=r_amounts, minlength=span)
+    outflows = np.bincount(e_index - first, weights=e_amounts, minlength=span)
+    investing = np.bincount(p_index - first, weights=p_amounts, minlength=span)
+    net = inflows - outflows - investing
+    closing = opening + np.cumsum(net)
+
+    periods = [
+        {
+            'period': period_label(period, first + i),
+            'operating_inflows': round(float(inflows[i]), 2),
+            'operating_outflows': round(float(outflows[i]), 2),
+            'net_operating': round(float(inflows[i] - outflows[i]), 2),
+            'investing_outflows': round(float(investing[i]), 2),
+            'net_change': round(float(net[i]), 2),
+            'closing_balance': round(float(closing[i]), 2),
+        }
+        for i in range(span)
+    ]
+
+    return {
+        'opening_balance': round(opening, 2),
+        'periods': periods,
+        'closing_balance': round(float(closing[-1]), 2),
+    }
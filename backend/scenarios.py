@@ -0,0 +1,159 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from training import FEATURE_NAMES
+
+# Grid parameters: fractional change in costs and change in head count
+GRID_PARAMETERS = ('cost_change', 'head_change')
+
+PERCENTILES = (5, 25, 50, 75, 95)
+MAX_SIMULATIONS = 20000
+MAX_GRID_ROWS = 5_000_000
+
+# With workers > 1, batches of at least this many model rows are split across a process pool
+POOL_THRESHOLD = int(os.getenv('SCENARIO_POOL_THRESHOLD', 1_000_000))
+
+# Expense categories whose spend grows and shrinks with the herd; head_change scales only these
+HERD_CATEGORIES = ('livestock_feed', 'veterinary')
+
+LAG_FEATURES = ('Total_Lag1', 'Total_Lag3', 'Total_Lag12', 'Rolling_Avg_3', 'Diff_1', 'Rolling_Avg_6')
+
+
+def monthly_series(columns):
+    """Dense (months, totals) arrays from a user's expense columns"""
+    _, _, months, amounts, _ = columns.view()
+    if not len(months):
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    first = int(months.min())
+    totals = np.bincount(months.astype(np.int64) - first, weights=amounts)
+    return np.arange(first, first + len(totals)), totals
+
+
+def category_share(columns, category, recent_months=12):
+    """Fraction of the last recent_months of spend that went to one category, or any of a list of them"""
+    _, _, months, amounts, codes = columns.view()
+    categories = [category] if isinstance(category, str) else category
+    wanted = [columns.label_codes[name] for name in categories if name in columns.label_codes]
+    if not wanted or not len(months):
+        return 0.0
+    recent = months > months.max() - recent_months
+    total = amounts[recent].sum()
+    return float(amounts[recent & np.isin(codes, wanted)].sum() / total) if total else 0.0
+
+
+def history_volatility(totals, recent_months=24, floor=0.02, cap=0.5):
+    """Spread of recent month-over-month log changes, used as the default shock size"""
+    recent = np.asarray(totals[-recent_months:], dtype=np.float64)
+    recent = recent[recent > 0]
+    if len(recent) < 3:
+        return 0.1
+    return float(np.clip(np.diff(np.log(recent)).std(), floor, cap))
+
+
+def next_month_features(months, totals):
+    """Feature row for the month after the last one in a monthly total series
+
+    months are month indexes (months since 1970-01) and totals their spend,
+    both dense and ordered. Needs at least 13 months of history.
+    """
+    if len(totals) < 13:
+        raise ValueError('Need at least 13 months of history to build features')
+
+    next_index = int(months[-1]) + 1
+    year, month = 1970 + next_index // 12, next_index % 12 + 1
+    return {
+        'Year': year,
+        'Month': month,
+        'Month_sin': float(np.sin(2 * np.pi * month / 12.0)),
+        'Month_cos': float(np.cos(2 * np.pi * month / 12.0)),
+        'Total_Lag1': float(totals[-1]),
+        'Total_Lag3': float(totals[-3]),
+        'Total_Lag12': float(totals[-12]),
+        'Rolling_Avg_3': float(np.mean(totals[-3:])),
+        'Diff_1': float(totals[-1] - totals[-2]),
+        'Rolling_Avg_6': float(np.mean(totals[-6:])),
+    }
+
+
+def expand_grid(grid):
+    """Cartesian product of the parameter grid as aligned arrays"""
+    unknown = set(grid) - set(GRID_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown scenario parameters: {', '.join(sorted(unknown))}")
+    values = [np.asarray(grid.get(name, [0]), dtype=np.float64).ravel() for name in GRID_PARAMETERS]
+    mesh = np.meshgrid(*values, indexing='ij')
+    return {name: axis.ravel() for name, axis in zip(GRID_PARAMETERS, mesh)}
+
+
+def _predict_chunk(args):
+    estimator, X = args
+    return estimator.predict(X)
+
+
+def batch_predict(estimator, X, workers=None):
+    """One model.predict call, or one per worker in a process pool for very large batches"""
+    if not workers or workers < 2 or len(X) < POOL_THRESHOLD:
+        return estimator.predict(X)
+    chunks = np.array_split(np.arange(len(X)), workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = pool.map(_predict_chunk, [(estimator, X.iloc[idx]) for idx in chunks])
+        return np.concatenate(list(parts))
+
+
+def simulate(estimator, base, grid, head_count, cost_share=1.0, herd_share=1.0, volatility=0.1,
+             residual_std=0.0, simulations=1000, seed=None, workers=None):
+    """Monte Carlo forecast for every scenario in the grid
+
+    Each scenario scales the spend history behind the lag features by
+    (1 + cost_change * cost_share) * (1 + herd_share * head_change / head_count),
+    where herd_share is the fraction of spend that moves with these head_count
+    animals. Every simulation then draws a lognormal shock on that multiplier
+    and adds model residual noise. All scenarios x simulations go through one
+    batched predict. Returns one result per scenario with prediction percentiles.
+    """
+    if simulations < 1 or simulations > MAX_SIMULATIONS:
+        raise ValueError(f'Simulations must be between 1 and {MAX_SIMULATIONS}')
+
+    scenarios = expand_grid(grid)
+    n_scenarios = len(scenarios['cost_change'])
+    if n_scenarios * simulations > MAX_GRID_ROWS:
+        raise ValueError(f'Grid x simulations exceeds {MAX_GRID_ROWS} rows')
+
+    herd_factor = np.ones(n_scenarios)
+    if head_count > 0:
+        remaining = np.clip(head_count + scenarios['head_change'], 0, None) / head_count
+        herd_factor = 1.0 + herd_share * (remaining - 1.0)
+    elif np.any(scenarios['head_change']):
+        raise ValueError('head_change needs livestock to scale from; the herd is empty')
+    multiplier = (1.0 + scenarios['cost_change'] * cost_share) * herd_factor
+
+    rng = np.random.default_rng(seed)
+    shocks = rng.lognormal(mean=-volatility ** 2 / 2, sigma=volatility, size=(n_scenarios, simulations))
+    scale = (multiplier[:, None] * shocks).ravel()
+
+    base_row = np.array([base[name] for name in FEATURE_NAMES], dtype=np.float64)
+    X = np.repeat(base_row[None, :], len(scale), axis=0)
+    lag_columns = [FEATURE_NAMES.index(name) for name in LAG_FEATURES]
+    X[:, lag_columns] *= scale[:, None]
+
+    predictions = batch_predict(estimator, pd.DataFrame(X, columns=FEATURE_NAMES), workers)
+    if residual_std > 0:
+        predictions = predictions + rng.normal(0.0, residual_std, size=len(predictions))
+    predictions = predictions.reshape(n_scenarios, simulations)
+
+    quantiles = np.percentile(predictions, PERCENTILES, axis=1)
+    means = predictions.mean(axis=1)
+
+    return [
+        {
+            'cost_change': float(scenarios['cost_change'][i]),
+            'head_change': float(scenarios['head_change'][i]),
+            'multiplier': round(float(multiplier[i]), 4),
+            'mean': round(float(means[i]), 2),
+            'percentiles': {f'p{p}': round(float(quantiles[j, i]), 2) for j, p in enumerate(PERCENTILES)},
+        }
+        for i in range(n_scenarios)
+    ]
@@ -0,0 +1,146 @@
+import re
+
+from sqlalchemy import text
+
+from models import db
+from replicas import use_primary
+
+SEARCH_TABLE = 'search_index'
+
+# Each indexed table gets a kind code; the FTS rowid is record_id * 4 + code so
+# rows from different tables never collide and triggers can address them directly.
+SEARCH_SOURCES = {
+    'expense': {
+        'code': 1,
+        'table': 'expenses',
+        'body': "COALESCE({row}.description, '') || ' ' || {row}.category",
+        'columns': 'description, category',
+    },
+    'revenue': {
+        'code': 2,
+        'table': 'revenues',
+        'body': "COALESCE({row}.description, '') || ' ' || {row}.source",
+        'columns': 'description, source',
+    },
+    'livestock': {
+        'code': 3,
+        'table': 'livestock',
+        'body': "COALESCE({row}.notes, '') || ' ' || {row}.type || ' ' || COALESCE({row}.breed, '')",
+        'columns': 'notes, type, breed',
+    },
+}
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Database URLs whose index and triggers have been set up by this process
+_ready_binds = set()
+
+
+class SearchUnavailable(RuntimeError):
+    """Raised when the database does not support the FTS5 search index"""
+
+
+def search_available():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def _triggers(kind, source):
+    table = source['table']
+    code = source['code']
+    new_body = source['body'].format(row='new')
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS {table}_search_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {SEARCH_TABLE} (rowid, body, owner, kind, record_id)
+            VALUES (new.id * 4 + {code}, {new_body}, 'u' || new.user_id, '{kind}', new.id);
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {table}_search_au AFTER UPDATE OF {source['columns']} ON {table} BEGIN
+            UPDATE {SEARCH_TABLE} SET body = {new_body} WHERE rowid = new.id * 4 + {code};
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {table}_search_ad AFTER DELETE ON {table} BEGIN
+            DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 4 + {code};
+        END''',
+    ]
+
+
+def init_search_index(rebuild=False):
+    """Create the FTS5 index and sync triggers, backfilling it when empty"""
+    if not search_available():
+        return False
+
+    if rebuild:
+        db.session.execute(text(f'DROP TABLE IF EXISTS {SEARCH_TABLE}'))
+
+    db.session.execute(text(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+            body, owner, kind UNINDEXED, record_id UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    '''))
+
+    for kind, source in SEARCH_SOURCES.items():
+        for statement in _triggers(kind, source):
+            db.session.execute(text(statement))
+
+    indexed = db.session.execute(text(f'SELECT rowid FROM {SEARCH_TABLE} LIMIT 1')).first()
+    if indexed is None:
+        for kind, source in SEARCH_SOURCES.items():
+            row_body = source['body'].format(row=source['table'])
+            db.session.execute(text(f'''
+                INSERT INTO {SEARCH_TABLE} (rowid, body, owner, kind, record_id)
+                SELECT id * 4 + {source['code']}, {row_body}, 'u' || user_id, '{kind}', id
+                FROM {source['table']}
+            '''))
+
+    db.session.commit()
+    _ready_binds.add(str(db.session.get_bind().url))
+    return True
+
+
+def build_match_query(user_id, query):
+    """Turn free text into an FTS5 query scoped to one user with prefix matching"""
+    tokens = _TOKEN_RE.findall(query.lower())
+    if not tokens:
+        return None
+    terms = ' '.join(f'"{token}"*' for token in tokens)
+    return f'owner : u{int(user_id)} AND body : ({terms})'
+
+
+def search_records(user_id, query, kinds=None, page=1, per_page=20):
+    """Ranked, paginated full-text search over a user's records"""
+    if not search_available():
+        raise SearchUnavailable('Full-text search requires SQLite with FTS5')
+    with use_primary():
+        if str(db.session.get_bind().url) not in _ready_binds:
+            init_search_index()
+
+    match = build_match_query(user_id, query)
+    if match is None:
+        return [], False
+
+    params = {'match': match, 'limit': per_page + 1, 'offset': (page - 1) * per_page}
+    kind_filter = ''
+    if kinds:
+        kind_filter = 'AND kind IN ({})'.format(', '.join(f':kind{i}' for i in range(len(kinds))))
+        params.update({f'kind{i}': kind for i, kind in enumerate(kinds)})
+
+    rows = db.session.execute(text(f'''
+        SELECT kind, record_id,
+               snippet({SEARCH_TABLE}, 0, '[', ']', '...', 12) AS snippet,
+               bm25({SEARCH_TABLE}, 1.0, 0.0) AS rank
+        FROM {SEARCH_TABLE}
+        WHERE {SEARCH_TABLE} MATCH :match {kind_filter}
+        ORDER BY rank
+        LIMIT :limit OFFSET :offset
+    '''), params).all()
+
+    results = [
+        {
+            'kind': kind,
+            'id': int(record_id),
+            'snippet': snippet,
+            'score': round(-float(rank), 4),
+        }
+        for kind, record_id, snippet, rank in rows[:per_page]
+    ]
+    return results, len(rows) > per_page
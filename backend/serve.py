@@ -0,0 +1,115 @@
+"""Production serving for the farm tracker API
+
+    python serve.py --mode asgi --threads 16      # uvicorn event loop + bounded WSGI threads
+    python serve.py --mode wsgi --threads 16      # waitress threaded WSGI server
+    uvicorn serve:application --port 5001         # same ASGI app under an external uvicorn
+
+The event loop owns sockets, keep-alives and slow clients; route handlers
+still run synchronously on threads, at most --threads at a time, and a
+request body is fully received before a thread slot is taken.
+Measured throughput for both modes is recorded in the README.
+"""
+import argparse
+import asyncio
+import contextvars
+import os
+import signal
+import sys
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app, db, init_search_index, telemetry_buffer, warm_up, webhooks, write_behind
+
+SERVE_THREADS = int(os.getenv('SERVE_THREADS', 16))
+
+
+def prepare():
+    """Create tables and the search index, then warm up before accepting traffic"""
+    with app.app_context():
+        db.create_all()
+        init_search_index()
+    print(f"Warmed up in {warm_up():.2f}s")
+
+
+class PooledWsgiToAsgi:
+    """ASGI adapter that runs the Flask app on at most `threads` threads at once
+
+    Uses only asgiref's public API. WsgiToAsgi on its own runs every WSGI
+    call on one shared thread; wrapping each request in a
+    ThreadSensitiveContext gives it its own thread, and a semaphore bounds
+    how many run concurrently.
+    """
+
+    def __init__(self, wsgi_application, threads=SERVE_THREADS):
+        self.adapter = WsgiToAsgi(wsgi_application)
+        self.slots = asyncio.Semaphore(threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            await self.adapter(scope, receive, send)
+            return
+
+        # Read the body on the event loop so a slow upload never holds a slot
+        messages = []
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message['type'] != 'http.request' or not message.get('more_body'):
+                break
+
+        async def replay():
+            return messages.pop(0) if messages else await receive()
+
+        # Start from an empty context: uvicorn can begin the next keep-alive
+        # request from inside this one's send(), which would otherwise inherit
+        # asgiref's state for a thread that has already finished
+        await contextvars.Context().run(asyncio.ensure_future, self._handle(scope, replay, send))
+
+    async def _handle(self, scope, receive, send):
+        async with self.slots:
+            async with ThreadSensitiveContext():
+                await self.adapter(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                prepare()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                write_behind.close()
+                telemetry_buffer.close()
+                webhooks.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+application = PooledWsgiToAsgi(app)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the farm tracker API')
+    parser.add_argument('--mode', choices=('asgi', 'wsgi'), default='asgi')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--threads', type=int, default=SERVE_THREADS)
+    args = parser.parse_args()
+
+    if args.mode == 'asgi':
+        import uvicorn
+        uvicorn.run(PooledWsgiToAsgi(app, threads=args.threads), host=args.host, port=args.port,
+                    log_level='warning')
+    else:
+        from waitress import serve
+        prepare()
+        # Exit normally on SIGTERM so atexit flushes buffered edits, telemetry and webhooks
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        serve(app, host=args.host, port=args.port, threads=args.threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from flask_sqlalchemy.session import Session
+
+from replicas import reads_routed, replica_engine
+
+# Tables that stay in the main database; everything else lives in the user's shard
+GLOBAL_TABLES = {'users', 'cache_invalidations', 'alembic_version'}
+
+TENANCY_MODES = ('hash', 'per_user')
+
+_config = {'mode': None, 'count': 8, 'directory': None}
+_engines = {}
+_current_shard = ContextVar('current_shard', default=None)
+
+
+def configure_sharding(mode=None, count=8, directory=None):
+    """Enable tenancy mode: 'hash' buckets users into count files, 'per_user' gives each user a file"""
+    if mode and mode not in TENANCY_MODES:
+        raise ValueError(f"Unknown tenancy mode '{mode}'")
+    _config.update(mode=mode or None, count=int(count), directory=directory)
+    if mode:
+        os.makedirs(directory, exist_ok=True)
+
+
+def sharding_enabled():
+    return _config['mode'] is not None
+
+
+def shard_key(user_id):
+    if _config['mode'] == 'per_user':
+        return f'user_{int(user_id)}'
+    return f'shard_{int(user_id) % _config["count"]:03d}'
+
+
+def shard_predicate(key):
+    """SQL predicate selecting the rows of a table that belong to a shard"""
+    number = int(key.split('_')[1])
+    if _config['mode'] == 'per_user':
+        return f'user_id = {number}'
+    return f'user_id % {_config["count"]} = {number}'
+
+
+def shard_path(key):
+    return os.path.join(_config['directory'], f'{key}.db')
+
+
+def _enable_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+def sharded_tables():
+    from models import db
+    return [table for name, table in db.metadata.tables.items() if name not in GLOBAL_TABLES]
+
+
+def shard_engine(key):
+    """Engine for a shard, creating the file and its tables on first use"""
+    engine = _engines.get(key)
+    if engine is None:
+        engine = sa.create_engine(f'sqlite:///{shard_path(key)}')
+        event.listen(engine, 'connect', _enable_wal)
+        sharded = sharded_tables()
+        sharded[0].metadata.create_all(engine, tables=sharded)
+        engine = _engines.setdefault(key, engine)
+    return engine
+
+
+def existing_shards():
+    """Keys of every shard file on disk"""
+    if not sharding_enabled() or not os.path.isdir(_config['directory']):
+        return []
+    return sorted(name[:-3] for name in os.listdir(_config['directory']) if name.endswith('.db'))
+
+
+def current_shard():
+    return _current_shard.get()
+
+
+def activate_shard(user_id):
+    """Route sharded tables to the user's shard for the current context; returns a reset token"""
+    if not sharding_enabled() or user_id is None:
+        return None
+    return _current_shard.set(shard_key(user_id))
+
+
+def deactivate_shard(token):
+    if token is not None:
+        _current_shard.reset(token)
+
+
+@contextmanager
+def use_shard(key):
+    """Run a block against a specific shard key"""
+    token = _current_shard.set(key)
+    try:
+        yield shard_engine(key)
+    finally:
+        _current_shard.reset(token)
+
+
+def _table_name(mapper, clause):
+    if mapper is not None:
+        return sa.inspect(mapper).local_table.name
+    if isinstance(clause, sa.Table):
+        return clause.name
+    table = getattr(clause, 'table', None)
+    return getattr(table, 'name', None)
+
+
+class ShardedSession(Session):
+    """Session that sends sharded tables to the active shard and users to the main database
+
+    Outside a flush, main-database reads go to the read replica when read
+    routing is active for the current context.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        key = _current_shard.get()
+        if bind is None and key is not None and _table_name(mapper, clause) not in GLOBAL_TABLES:
+            return shard_engine(key)
+        if bind is None and not self._flushing and reads_routed():
+            return replica_engine()
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def split_database(source_path, delete_source=False):
+    """Copy each user's rows from the main SQLite file into their shard
+
+    Uses ATTACH and one INSERT ... SELECT per table and shard. Existing rows in
+    a shard are kept (INSERT OR IGNORE), so the split can be re-run safely.
+    Returns {shard_key: rows_copied}.
+    """
+    source = sqlite3.connect(source_path)
+    user_ids = [row[0] for row in source.execute('SELECT id FROM users')]
+    source.close()
+
+    tables = sharded_tables()
+    keys = sorted({shard_key(user_id) for user_id in user_ids})
+    copied = {}
+
+    for key in keys:
+        conn = shard_engine(key).raw_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('ATTACH DATABASE ? AS source', (source_path,))
+            source_tables = {row[0] for row in cursor.execute(
+                "SELECT name FROM source.sqlite_master WHERE type = 'table'"
+            )}
+            total = 0
+            for table in tables:
+                if table.name not in source_tables:
+                    continue
+                columns = ', '.join(column.name for column in table.columns)
+                cursor.execute(
+                    f'INSERT OR IGNORE INTO main.{table.name} ({columns}) '
+                    f'SELECT {columns} FROM source.{table.name} WHERE {shard_predicate(key)}'
+                )
+                total += cursor.rowcount
+                if delete_source:
+                    cursor.execute(f'DELETE FROM source.{table.name} WHERE {shard_predicate(key)}')
+            conn.commit()
+            cursor.execute('DETACH DATABASE source')
+            copied[key] = total
+        finally:
+            conn.close()
+
+    return copied
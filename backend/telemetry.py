@@ -0,0 +1,321 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from itertools import repeat
+
+import numpy as np
+from sqlalchemy import text
+
+from models import db, Livestock, TelemetryReading, TelemetryRollup
+from herd import bulk_update_weights
+
+METRICS = ('weight_kg', 'feed_kg', 'water_l', 'temperature_c')
+METRIC_CODES = {name: code for code, name in enumerate(METRICS)}
+WEIGHT_METRIC = METRIC_CODES['weight_kg']
+
+RESOLUTIONS = {'hour': 3600, 'day': 86400}
+
+# Packed little-endian record for binary batches (18 bytes per reading)
+BINARY_DTYPE = np.dtype([('livestock_id', '<u4'), ('metric', '<u2'), ('recorded_at', '<f8'), ('value', '<f4')])
+
+READINGS_TABLE = TelemetryReading.__tablename__
+ROLLUPS_TABLE = TelemetryRollup.__tablename__
+
+
+class TelemetryError(ValueError):
+    """Raised for malformed telemetry batches"""
+
+
+def _batch(livestock_ids, metrics, recorded_at, values):
+    return {
+        'livestock_id': np.asarray(livestock_ids, dtype=np.int64),
+        'metric': np.asarray(metrics, dtype=np.int64),
+        'recorded_at': np.asarray(recorded_at, dtype=np.float64),
+        'value': np.asarray(values, dtype=np.float64),
+    }
+
+
+def _timestamp(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def parse_ndjson(body):
+    """Parse one JSON reading per line: {"livestock_id", "metric", "ts", "value"}
+
+    metric defaults to weight_kg; ts is Unix seconds or an ISO 8601 string (UTC when naive).
+    """
+    ids, metrics, stamps, values = [], [], [], []
+    for line_number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            reading = json.loads(line)
+            ids.append(int(reading['livestock_id']))
+            metrics.append(METRIC_CODES[reading.get('metric', 'weight_kg')])
+            stamps.append(_timestamp(reading['ts']))
+            values.append(float(reading['value']))
+        except (ValueError, KeyError, TypeError):
+            raise TelemetryError(f'Invalid reading on line {line_number}')
+    return _batch(ids, metrics, stamps, values)
+
+
+def parse_binary(body):
+    """Parse a packed array of BINARY_DTYPE records"""
+    if len(body) % BINARY_DTYPE.itemsize:
+        raise TelemetryError(f'Binary batches must be a multiple of {BINARY_DTYPE.itemsize} bytes')
+    records = np.frombuffer(body, dtype=BINARY_DTYPE)
+    if (records['metric'] >= len(METRICS)).any():
+        raise TelemetryError('Unknown metric code')
+    return _batch(records['livestock_id'], records['metric'], records['recorded_at'], records['value'])
+
+
+def owned_lots(user_id):
+    return np.array([row[0] for row in db.session.query(Livestock.id).filter_by(user_id=user_id)], dtype=np.int64)
+
+
+def filter_batch(batch, lot_ids):
+    """Keep readings for the given lots with finite values and timestamps"""
+    keep = (np.isin(batch['livestock_id'], lot_ids)
+            & np.isfinite(batch['value']) & np.isfinite(batch['recorded_at']))
+    return {name: column[keep] for name, column in batch.items()}
+
+
+def _concat(batches):
+    return {name: np.concatenate([b[name] for b in batches]) for name in batches[0]}
+
+
+class TelemetryBuffer:
+    """In-memory buffer of accepted readings, group-committed by a background thread
+
+    writer receives {user_id: batch} and must persist it. A flush happens
+    every flush_interval seconds or as soon as flush_rows readings are
+    waiting. add() refuses new readings once max_rows are buffered, which
+    is the backpressure signal when writes fall behind.
+    """
+
+    def __init__(self, writer, flush_rows=50000, flush_interval=1.0, max_rows=2000000):
+        self.writer = writer
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self._pending = {}
+        self._rows = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.flushed = 0
+        self.flushes = 0
+        self.last_flush_seconds = None
+        self._thread = threading.Thread(target=self._run, name='telemetry-flush', daemon=True)
+        self._thread.start()
+
+    def add(self, user_id, batch):
+        n = len(batch['value'])
+        if not n:
+            return True
+        with self._lock:
+            if self._rows + n > self.max_rows:
+                return False
+            self._pending.setdefault(user_id, []).append(batch)
+            self._rows += n
+            if self._rows >= self.flush_rows:
+                self._wake.set()
+        return True
+
+    def has_pending(self, user_id):
+        with self._lock:
+            return user_id in self._pending
+
+    def depth(self):
+        return self._rows
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of readings written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                rows, self._rows = self._rows, 0
+            if not pending:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                self.writer({user_id: _concat(batches) for user_id, batches in pending.items()})
+            except Exception:
+                # Put the readings back in front of anything that arrived meanwhile
+                with self._lock:
+                    for user_id, batches in pending.items():
+                        self._pending[user_id] = batches + self._pending.get(user_id, [])
+                    self._rows += rows
+                raise
+
+            self.last_flush_seconds = time.perf_counter() - started
+            self.flushed += rows
+            self.flushes += 1
+            return rows
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Telemetry flush failed: {e}")
+
+    def close(self):
+        """Stop the flush thread and write what is left"""
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(10)
+        self.flush()
+
+    def stats(self):
+        return {
+            'buffered': self._rows,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'last_flush_seconds': round(self.last_flush_seconds, 4) if self.last_flush_seconds else None,
+        }
+
+
+def aggregate(batch, seconds):
+    """Count, sum, min, max and last value per (lot, metric, bucket of seconds)"""
+    buckets = (batch['recorded_at'] // seconds).astype(np.int64) * seconds
+    order = np.lexsort((batch['recorded_at'], buckets, batch['metric'], batch['livestock_id']))
+    lots, metrics = batch['livestock_id'][order], batch['metric'][order]
+    buckets, stamps, values = buckets[order], batch['recorded_at'][order], batch['value'][order]
+
+    change = (np.diff(lots) != 0) | (np.diff(metrics) != 0) | (np.diff(buckets) != 0)
+    starts = np.concatenate([[0], np.flatnonzero(change) + 1])
+    ends = np.concatenate([starts[1:], [len(lots)]]) - 1
+
+    return {
+        'livestock_id': lots[starts],
+        'metric': metrics[starts],
+        'bucket_start': buckets[starts],
+        'count': ends - starts + 1,
+        'total': np.add.reduceat(values, starts),
+        'min_value': np.minimum.reduceat(values, starts),
+        'max_value': np.maximum.reduceat(values, starts),
+        'last_value': values[ends],
+        'last_at': stamps[ends],
+    }
+
+
+_ROLLUP_UPSERT = f'''
+    INSERT INTO {ROLLUPS_TABLE} (user_id, livestock_id, metric, resolution, bucket_start,
+                                 count, total, min_value, max_value, last_value, last_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (livestock_id, metric, resolution, bucket_start) DO UPDATE SET
+        count = {ROLLUPS_TABLE}.count + excluded.count,
+        total = {ROLLUPS_TABLE}.total + excluded.total,
+        min_value = MIN({ROLLUPS_TABLE}.min_value, excluded.min_value),
+        max_value = MAX({ROLLUPS_TABLE}.max_value, excluded.max_value),
+        last_value = CASE WHEN excluded.last_at >= {ROLLUPS_TABLE}.last_at
+                          THEN excluded.last_value ELSE {ROLLUPS_TABLE}.last_value END,
+        last_at = MAX({ROLLUPS_TABLE}.last_at, excluded.last_at)
+'''
+
+
+def _latest_weights(user_id, batch):
+    """(lot_id, weight_kg) for lots whose newest weight reading beats what is stored"""
+    weights = batch['metric'] == WEIGHT_METRIC
+    if not weights.any():
+        return []
+    lots, stamps, values = batch['livestock_id'][weights], batch['recorded_at'][weights], batch['value'][weights]
+    order = np.lexsort((stamps, lots))
+    lots, stamps, values = lots[order], stamps[order], values[order]
+    last = np.concatenate([np.flatnonzero(np.diff(lots) != 0), [len(lots) - 1]])
+
+    stored = dict(db.session.execute(text(f'''
+        SELECT livestock_id, MAX(last_at) FROM {ROLLUPS_TABLE}
+        WHERE user_id = :user_id AND metric = :metric AND resolution = 'day'
+        GROUP BY livestock_id
+    '''), {'user_id': user_id, 'metric': WEIGHT_METRIC}).all())
+
+    return [(int(lots[i]), float(values[i])) for i in last if stamps[i] >= stored.get(int(lots[i]), -np.inf)]
+
+
+def store_readings(batches):
+    """Append readings, fold them into hourly and daily rollups, refresh lot weights; one commit
+
+    batches maps user_id -> batch for users that share the current database.
+    """
+    conn = db.session.connection()
+    for user_id, batch in batches.items():
+        conn.exec_driver_sql(
+            f'INSERT INTO {READINGS_TABLE} (livestock_id, metric, recorded_at, value, user_id) '
+            'VALUES (?, ?, ?, ?, ?)',
+            list(zip(batch['livestock_id'].tolist(), batch['metric'].tolist(),
+                     batch['recorded_at'].tolist(), batch['value'].tolist(), repeat(user_id)))
+        )
+
+        # Decide weight updates before the rollups absorb this batch's timestamps
+        weights = _latest_weights(user_id, batch)
+
+        for resolution, seconds in RESOLUTIONS.items():
+            rollup = aggregate(batch, seconds)
+            conn.exec_driver_sql(_ROLLUP_UPSERT, list(zip(
+                repeat(user_id), rollup['livestock_id'].tolist(), rollup['metric'].tolist(), repeat(resolution),
+                rollup['bucket_start'].tolist(), rollup['count'].tolist(), rollup['total'].tolist(),
+                rollup['min_value'].tolist(), rollup['max_value'].tolist(),
+                rollup['last_value'].tolist(), rollup['last_at'].tolist()
+            )))
+
+        bulk_update_weights(user_id, weights)
+    db.session.commit()
+
+
+def series(livestock_id, metric, resolution='hour', start=None, end=None, limit=1000):
+    """Raw readings or rollup buckets for one lot and metric, oldest first"""
+    code = METRIC_CODES[metric]
+    params = {'lot': livestock_id, 'metric': code, 'start': start or 0, 'end': end or 2 ** 40, 'limit': limit}
+
+    if resolution == 'raw':
+        rows = db.session.execute(text(f'''
+            SELECT recorded_at, value FROM {READINGS_TABLE}
+            WHERE livestock_id = :lot AND metric = :metric AND recorded_at >= :start AND recorded_at < :end
+            ORDER BY recorded_at LIMIT :limit
+        '''), params).all()
+        return [{'ts': _iso(ts), 'value': value} for ts, value in rows]
+
+    if resolution not in RESOLUTIONS:
+        raise TelemetryError(f"Resolution must be one of: raw, {', '.join(RESOLUTIONS)}")
+    rows = db.session.execute(text(f'''
+        SELECT bucket_start, count, total, min_value, max_value, last_value FROM {ROLLUPS_TABLE}
+        WHERE livestock_id = :lot AND metric = :metric AND resolution = :resolution
+          AND bucket_start >= :start AND bucket_start < :end
+        ORDER BY bucket_start LIMIT :limit
+    '''), {**params, 'resolution': resolution}).all()
+    return [
+        {
+            'bucket': _iso(bucket),
+            'count': count,
+            'mean': round(total / count, 3),
+            'min': min_value,
+            'max': max_value,
+            'last': last_value,
+        }
+        for bucket, count, total, min_value, max_value, last_value in rows
+    ]
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+
+def prune_readings(before):
+    """Delete raw readings older than before (Unix seconds); rollups are kept"""
+    deleted = db.session.execute(
+        text(f'DELETE FROM {READINGS_TABLE} WHERE recorded_at < :before'), {'before': before}
+    ).rowcount
+    db.session.commit()
+    return deleted
@@ -0,0 +1,80 @@
+import os
+import sys
+import threading
+from datetime import date
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics_cache
+from analytics_cache import AnalyticsCache, Columns, group_totals, to_ordinal
+
+DAY = date(2026, 3, 1)
+
+
+def fake_history(rows):
+    """Stand-in for build_columns reading rows, a list of (id, amount, label) committed so far"""
+    def build(user_id, kind):
+        snapshot = list(rows)
+        return Columns(np.array([r[0] for r in snapshot], dtype=np.int64),
+                       np.full(len(snapshot), to_ordinal(DAY), dtype=np.int32),
+                       np.array([r[1] for r in snapshot], dtype=np.float64),
+                       [r[2] for r in snapshot])
+    return build
+
+
+def test_record_during_a_build_is_not_lost(monkeypatch):
+    cache = AnalyticsCache()
+    rows = [(1, 10.0, 'feed')]
+    build = fake_history(rows)
+    calls = []
+
+    def racing_build(user_id, kind):
+        columns = build(user_id, kind)
+        if not calls:
+            # A write commits and is recorded after this build read the table
+            rows.append((2, 5.0, 'feed'))
+            cache.record(user_id, kind, 2, DAY, 5.0, 'feed')
+        calls.append(columns)
+        return columns
+
+    monkeypatch.setattr(analytics_cache, 'build_columns', racing_build)
+    columns = cache.columns(7, 'expenses')
+
+    assert len(calls) == 2
+    assert group_totals(columns) == [{'key': 'feed', 'total': 15.0, 'count': 2}]
+    assert cache.columns(7, 'expenses') is columns and cache.stats()['misses'] == 1
+
+
+def test_unraced_build_is_cached_once(monkeypatch):
+    cache = AnalyticsCache()
+    monkeypatch.setattr(analytics_cache, 'build_columns', fake_history([(1, 10.0, 'feed')]))
+    first = cache.columns(7, 'expenses')
+    cache.record(8, 'expenses', 3, DAY, 1.0, 'fuel')
+    assert cache.columns(7, 'expenses') is first
+    assert cache.stats()['hits'] == 1 and not cache._builds
+
+
+def test_view_is_a_consistent_snapshot():
+    columns = Columns(np.arange(1, 1001, dtype=np.int64), np.full(1000, to_ordinal(DAY), dtype=np.int32),
+                      np.ones(1000), ['feed'] * 1000)
+    stop = threading.Event()
+
+    def churn():
+        row_id = 1001
+        while not stop.is_set():
+            columns.upsert(row_id, to_ordinal(DAY), 1.0, 'feed')
+            columns.remove(row_id - 1000)
+            row_id += 1
+
+    worker = threading.Thread(target=churn)
+    worker.start()
+    try:
+        for _ in range(200):
+            ids, _, _, amounts, _ = columns.view()
+            assert len(ids) == len(amounts) and len(ids) in (1000, 1001)
+            assert len(np.unique(ids)) == len(ids)
+    finally:
+        stop.set()
+        worker.join()
@@ -0,0 +1,155 @@
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db, User, Livestock, Revenue, TelemetryReading, TelemetryRollup
+from herd import HerdError, bulk_update_weights, head_count, remove_head, sell_head
+
+HERD_LOTS = 10000
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path}/herd.db'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([User(id=1, username='farmer', email='farmer@example.com', password_hash='x'),
+                            User(id=2, username='neighbour', email='neighbour@example.com', password_hash='x')])
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def add_lots(user_id, count, livestock_type='cattle', seed=7):
+    """Insert count lots with mixed sizes, shared and missing purchase dates"""
+    rng = random.Random(seed)
+    start = date(2020, 1, 1)
+    db.session.execute(Livestock.__table__.insert(), [
+        {
+            'user_id': user_id,
+            'type': livestock_type,
+            'quantity': rng.randint(1, 20),
+            'purchase_date': None if rng.random() < 0.05 else start + timedelta(days=rng.randint(0, 1500)),
+        }
+        for _ in range(count)
+    ])
+    db.session.commit()
+
+
+def lots(user_id, livestock_type='cattle'):
+    return {lot.id: lot for lot in Livestock.query.filter_by(user_id=user_id, type=livestock_type)}
+
+
+def expected_after_removal(before, head):
+    """Oldest-first allocation done one lot at a time, as a reference for remove_head"""
+    order = sorted(before.values(), key=lambda lot: (lot.purchase_date is None, lot.purchase_date or date.min, lot.id))
+    remaining = {}
+    for lot in order:
+        taken = min(lot.quantity, head)
+        head -= taken
+        if lot.quantity - taken > 0:
+            remaining[lot.id] = lot.quantity - taken
+    return remaining
+
+
+@pytest.mark.parametrize('head', [1, 7, 5000, 52345])
+def test_remove_head_takes_oldest_lots_first(app, head):
+    add_lots(1, HERD_LOTS)
+    before = {lot_id: (lot.quantity, lot.purchase_date) for lot_id, lot in lots(1).items()}
+    head = min(head, sum(quantity for quantity, _ in before.values()))
+    reference = expected_after_removal(lots(1), head)
+    db.session.expire_all()
+
+    remove_head(1, 'cattle', head)
+    db.session.commit()
+    db.session.expire_all()
+
+    assert {lot_id: lot.quantity for lot_id, lot in lots(1).items()} == reference
+    assert head_count(1, 'cattle') == sum(quantity for quantity, _ in before.values()) - head
+
+
+def test_remove_head_leaves_other_types_and_users_alone(app):
+    add_lots(1, 200)
+    add_lots(1, 50, livestock_type='sheep', seed=8)
+    add_lots(2, 200, seed=9)
+    sheep, neighbour = head_count(1, 'sheep'), head_count(2, 'cattle')
+
+    remove_head(1, 'cattle', head_count(1, 'cattle'))
+    db.session.commit()
+
+    assert head_count(1, 'cattle') == 0
+    assert head_count(1, 'sheep') == sheep
+    assert head_count(2, 'cattle') == neighbour
+
+
+def test_remove_head_rejects_more_than_held(app):
+    add_lots(1, 10)
+    with pytest.raises(HerdError):
+        remove_head(1, 'cattle', head_count(1, 'cattle') + 1)
+    with pytest.raises(HerdError):
+        remove_head(1, 'cattle', 0)
+
+
+def test_sold_out_lots_take_their_telemetry_with_them(app):
+    add_lots(1, 20)
+    ids = sorted(lots(1))
+    db.session.add_all([TelemetryReading(livestock_id=lot_id, metric=0, recorded_at=1.0, value=400.0, user_id=1)
+                        for lot_id in ids])
+    db.session.add_all([TelemetryRollup(livestock_id=lot_id, metric=0, resolution='hour', bucket_start=0, count=1,
+                                        total=400.0, min_value=400.0, max_value=400.0, last_value=400.0,
+                                        last_at=1.0, user_id=1)
+                        for lot_id in ids])
+    db.session.commit()
+
+    remove_head(1, 'cattle', head_count(1, 'cattle') // 2)
+    db.session.commit()
+
+    alive = set(lots(1))
+    for table in (TelemetryReading.__tablename__, TelemetryRollup.__tablename__):
+        orphaned = db.session.execute(text(
+            f'SELECT COUNT(*) FROM {table} WHERE livestock_id NOT IN (SELECT id FROM livestock)'
+        )).scalar()
+        kept = {row[0] for row in db.session.execute(text(f'SELECT livestock_id FROM {table}'))}
+        assert orphaned == 0
+        assert kept == alive
+
+
+def test_sell_on_a_large_herd_is_one_pass(app):
+    add_lots(1, HERD_LOTS)
+    head = head_count(1, 'cattle') // 2
+
+    started = time.perf_counter()
+    sell_head(1, 'cattle', head, price_per_head=250.0)
+    db.session.commit()
+    elapsed = time.perf_counter() - started
+
+    assert head_count(1, 'cattle') == head_count(1) and Revenue.query.one().amount == 250.0 * head
+    assert elapsed < 2.0, f'selling half of {HERD_LOTS} lots took {elapsed:.2f}s'
+
+
+def test_bulk_weight_update_on_a_large_herd(app):
+    add_lots(1, HERD_LOTS)
+    add_lots(2, 10, seed=9)
+    readings = [(lot_id, 300.0 + lot_id % 100) for lot_id in lots(1)]
+    foreign = next(iter(lots(2)))
+
+    started = time.perf_counter()
+    updated = bulk_update_weights(1, readings + [(foreign, 999.0)])
+    db.session.commit()
+    elapsed = time.perf_counter() - started
+
+    assert updated == HERD_LOTS
+    weights = dict(db.session.execute(text('SELECT id, weight_kg FROM livestock WHERE user_id = 1')).all())
+    assert weights == dict(readings)
+    assert db.session.get(Livestock, foreign).weight_kg is None
+    assert elapsed < 2.0, f'weighing {HERD_LOTS} lots took {elapsed:.2f}s'
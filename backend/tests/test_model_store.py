@@ -0,0 +1,32 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_store import ModelStore
+
+
+def test_models_written_by_another_process_are_picked_up(tmp_path):
+    server = ModelStore(str(tmp_path / 'users'), check_interval=0)
+    trainer = ModelStore(str(tmp_path / 'users'))
+
+    assert server.get(1) is None
+    trainer.put(1, 'estimator', {'rows': 30})
+    assert server.get(1) == ('estimator', {'rows': 30})
+    assert server.get(1) == ('estimator', {'rows': 30}) and server.stats()['hits'] == 1
+
+    trainer.put(1, 'retrained', {'rows': 31})
+    assert server.get(1) == ('retrained', {'rows': 31})
+    trainer.remove(1)
+    assert server.get(1) is None
+
+
+def test_missing_models_are_cached_between_checks(tmp_path):
+    server = ModelStore(str(tmp_path / 'users'), check_interval=3600)
+    trainer = ModelStore(str(tmp_path / 'users'))
+
+    assert server.get(1) is None
+    trainer.put(1, 'estimator', {})
+    assert server.get(1) is None
+    server._checked_at -= 3600
+    assert server.get(1) == ('estimator', {})
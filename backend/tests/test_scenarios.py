@@ -0,0 +1,39 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scenarios import simulate
+from training import FEATURE_NAMES
+
+
+class LagOne:
+    def predict(self, X):
+        return X['Total_Lag1'].to_numpy()
+
+
+BASE = {name: 1000.0 for name in FEATURE_NAMES}
+
+
+def run(grid, head_count, herd_share=1.0):
+    return simulate(LagOne(), BASE, grid, head_count, herd_share=herd_share, volatility=0.0, simulations=5, seed=1)
+
+
+def test_head_change_scales_only_the_herd_share():
+    [result] = run({'head_change': [10]}, head_count=10, herd_share=0.25)
+    assert result['multiplier'] == 1.25
+    assert result['mean'] == 1250.0
+
+
+def test_selling_the_whole_herd_keeps_other_spend():
+    [result] = run({'head_change': [-50]}, head_count=20, herd_share=0.4)
+    assert result['multiplier'] == 0.6
+
+
+def test_head_change_on_an_empty_herd_is_rejected():
+    with pytest.raises(ValueError):
+        run({'head_change': [0, 5]}, head_count=0)
+    [result] = run({'cost_change': [0.1]}, head_count=0)
+    assert result['multiplier'] == 1.1
@@ -0,0 +1,257 @@
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from math import sqrt
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import ElasticNet
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from sklearn.model_selection import TimeSeriesSplit
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from models import db, Expense
+from archive import archived_user_ids, load_columns
+from analytics_cache import EPOCH_ORDINAL
+
+FEATURE_NAMES = [
+    'Year', 'Month', 'Month_sin', 'Month_cos',
+    'Total_Lag1', 'Total_Lag3', 'Total_Lag12', 'Rolling_Avg_3', 'Diff_1',
+    'Rolling_Avg_6'
+]
+
+# ElasticNet grid searched with time-series CV
+PARAM_GRID = [
+    {'alpha': alpha, 'l1_ratio': l1_ratio}
+    for alpha in (0.1, 0.3, 1.0, 3.0, 10.0)
+    for l1_ratio in (0.2, 0.5, 0.8)
+]
+
+MIN_TRAINING_ROWS = 24
+CV_SPLITS = 4
+
+
+def database_history():
+    """Daily expense totals per user from the current database in one GROUP BY"""
+    rows = db.session.query(
+        Expense.user_id, Expense.date, db.func.sum(Expense.amount)
+    ).group_by(Expense.user_id, Expense.date).all()
+    history = pd.DataFrame(rows, columns=['user_id', 'Date', 'amount'])
+    history['Date'] = pd.to_datetime(history['Date'])
+    return history
+
+
+def archived_history():
+    """Expense rows from archived years for every user"""
+    frames = [pd.DataFrame(columns=['user_id', 'Date', 'amount'])]
+    for user_id in archived_user_ids():
+        columns = load_columns(user_id, 'expenses')
+        if len(columns['amount']):
+            frames.append(pd.DataFrame({
+                'user_id': user_id,
+                'Date': (columns['date'].astype(np.int64) - EPOCH_ORDINAL).astype('datetime64[D]'),
+                'amount': np.asarray(columns['amount']),
+            }))
+
+    history = pd.concat(frames, ignore_index=True)
+    history['Date'] = pd.to_datetime(history['Date'])
+    return history
+
+
+def build_training_frame(history):
+    """Monthly totals per user with the lag and rolling features used by the model
+
+    Months are laid out as a dense month x user grid so every shift and rolling
+    window runs column-wise over all users at once. Only months between a
+    user's first and last expense are kept; gaps inside that span count as zero
+    spend.
+    """
+    if history.empty:
+        return pd.DataFrame(columns=['user_id', 'Date', 'Total_Expenses'] + FEATURE_NAMES)
+
+    history = history.assign(Date=history['Date'].dt.to_period('M'))
+    grid = history.pivot_table(index='Date', columns='user_id', values='amount', aggfunc='sum')
+    grid = grid.reindex(pd.period_range(grid.index.min(), grid.index.max(), freq='M'))
+    recorded = grid.notna()
+    active = recorded.cummax() & recorded[::-1].cummax()[::-1]
+    totals = grid.fillna(0.0).where(active)
+
+    previous = totals.shift(1)
+    features = {
+        'Total_Expenses': totals,
+        'Total_Lag1': previous,
+        'Total_Lag3': totals.shift(3),
+        'Total_Lag12': totals.shift(12),
+        'Rolling_Avg_3': previous.rolling(3).mean(),
+        'Diff_1': previous - totals.shift(2),
+        'Rolling_Avg_6': previous.rolling(6).mean(),
+    }
+    n_months, n_users = totals.shape
+    frame = pd.DataFrame({
+        'Date': totals.index.repeat(n_users),
+        'user_id': np.tile(totals.columns.to_numpy(), n_months),
+        **{name: values.to_numpy().ravel() for name, values in features.items()},
+    })
+
+    frame['Year'] = frame['Date'].dt.year
+    frame['Month'] = frame['Date'].dt.month
+    frame['Month_sin'] = np.sin(2 * np.pi * frame['Month'] / 12.0)
+    frame['Month_cos'] = np.cos(2 * np.pi * frame['Month'] / 12.0)
+    frame['Date'] = frame['Date'].dt.to_timestamp()
+
+    frame = frame.dropna(subset=FEATURE_NAMES + ['Total_Expenses'])
+    return frame.sort_values(['Date', 'user_id']).reset_index(drop=True)
+
+
+def smape(y_true, y_pred):
+    y_true = np.asarray(y_true)
+    y_pred = np.asarray(y_pred)
+    denom = np.abs(y_true) + np.abs(y_pred)
+    denom = np.where(denom == 0, 1e-9, denom)
+    return 100.0 * np.mean(2.0 * np.abs(y_pred - y_true) / denom)
+
+
+def make_pipeline(alpha=1.0, l1_ratio=0.5):
+    return Pipeline([
+        ('scaler', StandardScaler()),
+        ('model', ElasticNet(alpha=alpha, l1_ratio=l1_ratio, max_iter=10000)),
+    ])
+
+
+def _month_folds(dates, n_splits):
+    """TimeSeriesSplit over distinct months, so one month never straddles train and test"""
+    months = np.unique(dates)
+    n_splits = min(n_splits, len(months) - 1)
+    for train_months, test_months in TimeSeriesSplit(n_splits=n_splits).split(months):
+        yield np.isin(dates, months[train_months]), np.isin(dates, months[test_months])
+
+
+def _cv_score(args):
+    """Mean MAE of one parameter set across the time-series folds"""
+    params, X, y, folds = args
+    errors = []
+    for train, test in folds:
+        pipeline = make_pipeline(**params).fit(X[train], y[train])
+        errors.append(mean_absolute_error(y[test], pipeline.predict(X[test])))
+    return float(np.mean(errors))
+
+
+def select_params(X, y, dates, workers=None):
+    """Pick the ElasticNet parameters with the lowest CV error, scoring the grid in a process pool"""
+    folds = list(_month_folds(dates, CV_SPLITS))
+    jobs = [(params, X, y, folds) for params in PARAM_GRID]
+    if workers == 1:
+        scores = [_cv_score(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            scores = list(pool.map(_cv_score, jobs))
+    best = int(np.argmin(scores))
+    return PARAM_GRID[best], scores[best]
+
+
+def train(frame, workers=None):
+    """Fit on all but the last test horizon of months and report holdout metrics"""
+    if len(frame) < MIN_TRAINING_ROWS:
+        raise ValueError(f'Need at least {MIN_TRAINING_ROWS} monthly rows to train, have {len(frame)}')
+
+    months = np.sort(frame['Date'].unique())
+    test_horizon = 12 if len(months) >= 36 else max(int(len(months) * 0.2), 3)
+    test_mask = frame['Date'].isin(months[-test_horizon:]).to_numpy()
+
+    X = frame[FEATURE_NAMES].astype(np.float64).reset_index(drop=True)
+    y = frame['Total_Expenses'].to_numpy(dtype=np.float64)
+    dates = frame['Date'].to_numpy()
+
+    params, cv_mae = select_params(X[~test_mask], y[~test_mask], dates[~test_mask], workers)
+    pipeline = make_pipeline(**params).fit(X[~test_mask], y[~test_mask])
+
+    y_test = y[test_mask]
+    y_pred = pipeline.predict(X[test_mask])
+    train_r2 = r2_score(y[~test_mask], pipeline.predict(X[~test_mask]))
+    test_r2 = r2_score(y_test, y_pred)
+
+    metadata = {
+        'training_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'rows_total': int(len(frame)),
+        'rows_model': int(len(frame)),
+        'train_size': int((~test_mask).sum()),
+        'test_horizon': int(test_horizon),
+        'best_model': 'ElasticNet',
+        'params': params,
+        'cv_mae': cv_mae,
+        'test_r2': float(test_r2),
+        'test_mae': float(mean_absolute_error(y_test, y_pred)),
+        'test_rmse': float(sqrt(mean_squared_error(y_test, y_pred))),
+        'test_smape': float(smape(y_test, y_pred)),
+        'train_r2': float(train_r2),
+        'overfit_gap': float(train_r2 - test_r2),
+        'baseline_mean_mae': float(mean_absolute_error(y_test, np.full_like(y_test, y[~test_mask].mean()))),
+        'baseline_naive_mae': float(mean_absolute_error(y_test, frame.loc[test_mask, 'Total_Lag1'])),
+        'features': FEATURE_NAMES,
+        'date_range': f"{frame['Date'].min()} to {frame['Date'].max()}",
+    }
+
+    # Final model sees every month, holdout included
+    final = make_pipeline(**params).fit(X, y)
+    return final, metadata
+
+
+def save_artifacts(model_dir, pipeline, metadata, promote=True):
+    """Write a versioned copy of the artifacts and optionally promote it to the live files"""
+    version = datetime.now().strftime('%Y%m%d%H%M%S')
+    metadata = {**metadata, 'version': version}
+    version_dir = os.path.join(model_dir, 'versions', version)
+    os.makedirs(version_dir, exist_ok=True)
+
+    joblib.dump(pipeline, os.path.join(version_dir, 'expense_model.pkl'))
+    joblib.dump(FEATURE_NAMES, os.path.join(version_dir, 'feature_names.pkl'))
+    joblib.dump(metadata, os.path.join(version_dir, 'model_metadata.pkl'))
+
+    if promote:
+        # Metadata goes last: readers that see the new metadata see the new model
+        for name in ('expense_model.pkl', 'feature_names.pkl', 'model_metadata.pkl'):
+            staging = os.path.join(model_dir, f'.{name}.tmp')
+            shutil.copyfile(os.path.join(version_dir, name), staging)
+            os.replace(staging, os.path.join(model_dir, name))
+
+    return version, metadata
+
+
+def retrain(frame, model_dir, workers=None, force=False):
+    """Fit and save; promote only when the model beats the mean baseline"""
+    pipeline, metadata = train(frame, workers=workers)
+    promote = force or metadata['test_mae'] < metadata['baseline_mean_mae']
+    version, metadata = save_artifacts(model_dir, pipeline, metadata, promote=promote)
+    return version, metadata, promote
+
+
+class RetrainScheduler:
+    """Runs a retraining callable every interval seconds on a daemon thread"""
+
+    def __init__(self, interval_seconds, job):
+        self.interval = interval_seconds
+        self.job = job
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='retrain-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            started = time.time()
+            try:
+                self.job()
+                print(f"Model retrained in {time.time() - started:.1f}s")
+            except Exception as e:
+                print(f"Scheduled retraining failed: {e}")
@@ -0,0 +1,149 @@
+import json
+import os
+from datetime import date
+
+import numpy as np
+
+from models import db, Livestock
+
+# Market price per kg of live weight (USD)
+DEFAULT_PRICE_PER_KG = {
+    'cattle': 4.20,
+    'sheep': 5.50,
+    'goats': 5.00,
+    'pigs': 3.10,
+    'chickens': 2.60,
+    'horses': 3.00,
+    'other': 3.00,
+}
+
+# Monthly value change applied to purchase price when no weight is recorded.
+# Positive values appreciate (growing stock), negative values depreciate.
+DEFAULT_MONTHLY_RATE = {
+    'cattle': 0.010,
+    'sheep': 0.008,
+    'goats': 0.008,
+    'pigs': 0.015,
+    'chickens': -0.020,
+    'horses': -0.005,
+    'other': 0.0,
+}
+
+
+def load_price_table(path=None):
+    """Load price-per-kg and monthly rate tables, overriding the defaults
+
+    The file is JSON of the form {"price_per_kg": {...}, "monthly_rate": {...}}.
+    """
+    price_per_kg = dict(DEFAULT_PRICE_PER_KG)
+    monthly_rate = dict(DEFAULT_MONTHLY_RATE)
+
+    path = path or os.getenv('LIVESTOCK_PRICE_TABLE')
+    if path and os.path.exists(path):
+        with open(path) as f:
+            table = json.load(f)
+        price_per_kg.update(table.get('price_per_kg', {}))
+        monthly_rate.update(table.get('monthly_rate', {}))
+
+    return price_per_kg, monthly_rate
+
+
+def _lookup(types, table, default_key='other'):
+    """Map an array of type codes to table values"""
+    fallback = table.get(default_key, 0.0)
+    return np.array([table.get(t, fallback) for t in types], dtype=np.float64)
+
+
+def compute_valuation(rows, price_per_kg=None, monthly_rate=None, as_of=None, horizon_months=12):
+    """Value livestock lots in one vectorized pass
+
+    rows is a sequence of (type, quantity, weight_kg, purchase_price, purchase_date)
+    tuples. Returns totals, per-type aggregates and a projected value curve.
+    """
+    if price_per_kg is None or monthly_rate is None:
+        default_price, default_rate = load_price_table()
+        price_per_kg = price_per_kg or default_price
+        monthly_rate = monthly_rate or default_rate
+    as_of = as_of or date.today()
+
+    if not rows:
+        return {
+            'as_of': as_of.isoformat(),
+            'lot_count': 0,
+            'head_count': 0,
+            'cost_basis': 0.0,
+            'market_value': 0.0,
+            'unrealized_gain': 0.0,
+            'by_type': {},
+            'curve': [{'month': m, 'value': 0.0} for m in range(horizon_months + 1)],
+        }
+
+    lot_types, quantity, weight, price, purchased = zip(*rows)
+
+    # Type codes let per-type aggregation run through np.bincount
+    type_names, type_codes = np.unique(np.array(lot_types, dtype=object).astype(str), return_inverse=True)
+    lot_price_per_kg = _lookup(type_names, price_per_kg)[type_codes]
+    lot_rate = _lookup(type_names, monthly_rate)[type_codes]
+
+    quantity = np.array(quantity, dtype=np.float64)
+    weight = np.array([w if w is not None else np.nan for w in weight], dtype=np.float64)
+    price = np.array([p if p is not None else 0.0 for p in price], dtype=np.float64)
+
+    as_of_ordinal = as_of.toordinal()
+    held_days = np.array(
+        [as_of_ordinal - d.toordinal() if d is not None else 0 for d in purchased],
+        dtype=np.float64
+    )
+    months_held = np.clip(held_days, 0, None) / 30.4375
+
+    cost_basis = price * quantity
+    appreciated = cost_basis * np.power(1.0 + lot_rate, months_held)
+    market_value = np.where(np.isnan(weight), appreciated, weight * lot_price_per_kg * quantity)
+
+    # Project each lot's current value forward at its type's monthly rate
+    months = np.arange(horizon_months + 1, dtype=np.float64)
+    curve = market_value @ np.power(1.0 + lot_rate[:, None], months[None, :])
+
+    n_types = len(type_names)
+    head_by_type = np.bincount(type_codes, weights=quantity, minlength=n_types)
+    cost_by_type = np.bincount(type_codes, weights=cost_basis, minlength=n_types)
+    value_by_type = np.bincount(type_codes, weights=market_value, minlength=n_types)
+    lots_by_type = np.bincount(type_codes, minlength=n_types)
+
+    by_type = {
+        name: {
+            'lots': int(lots_by_type[i]),
+            'head_count': int(head_by_type[i]),
+            'cost_basis': round(float(cost_by_type[i]), 2),
+            'market_value': round(float(value_by_type[i]), 2),
+            'unrealized_gain': round(float(value_by_type[i] - cost_by_type[i]), 2),
+        }
+        for i, name in enumerate(type_names)
+    }
+
+    total_cost = float(cost_basis.sum())
+    total_value = float(market_value.sum())
+
+    return {
+        'as_of': as_of.isoformat(),
+        'lot_count': len(rows),
+        'head_count': int(quantity.sum()),
+        'cost_basis': round(total_cost, 2),
+        'market_value': round(total_value, 2),
+        'unrealized_gain': round(total_value - total_cost, 2),
+        'by_type': by_type,
+        'curve': [{'month': int(m), 'value': round(float(v), 2)} for m, v in zip(months, curve)],
+    }
+
+
+def value_herd(user_id, **kwargs):
+    """Fetch all livestock lots for a user as bare tuples and value them"""
+    rows = db.session.query(
+        Livestock.type,
+        Livestock.quantity,
+        Livestock.weight_kg,
+        Livestock.purchase_price,
+        Livestock.purchase_date
+    ).filter(Livestock.user_id == user_id).all()
+
+    return compute_valuation(rows, **kwargs)
@@ -0,0 +1,71 @@
+import queue
+import threading
+
+import requests
+
+# Sentinel telling a worker thread to exit
+_STOP = object()
+
+
+class WebhookDispatcher:
+    """Posts webhook payloads from background threads so requests never wait on them
+
+    Payloads go through a bounded queue; when it is full the payload is dropped
+    and counted rather than blocking the request that produced it.
+    """
+
+    def __init__(self, url, workers=2, max_queue=10000, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._session = requests.Session()
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name=f'webhook-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def send(self, payload):
+        """Queue a payload; returns False when it had to be dropped"""
+        try:
+            self._queue.put_nowait(payload)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            print(f"N8N webhook queue full, dropped {payload.get('type', 'payload')}")
+            return False
+
+    def _run(self):
+        while True:
+            payload = self._queue.get()
+            try:
+                if payload is _STOP:
+                    return
+                self._session.post(self.url, json=payload, timeout=self.timeout)
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"N8N webhook failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def close(self, timeout=10):
+        """Deliver what is queued, then stop the worker threads"""
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def stats(self):
+        return {
+            'queued': self.depth(),
+            'sent': self.sent,
+            'failed': self.failed,
+            'dropped': self.dropped,
+        }
@@ -0,0 +1,209 @@
+import math
+import threading
+from datetime import datetime
+
+from models import db, Expense, Revenue
+from anomalies import record_expense
+from budget import apply_expense_change
+
+# Kinds that can be coalesced, with the model and the label column the analytics cache keys on
+MODELS = {'expenses': (Expense, 'category'), 'revenues': (Revenue, 'source')}
+
+# A batch that fails as a whole (e.g. the database is locked) is retried this many times
+MAX_ATTEMPTS = 3
+
+
+class EditError(ValueError):
+    """Raised for an edit payload that the row could never store"""
+
+
+def parse_changes(data, label):
+    """Validate a PUT payload for an expense (label 'category') or revenue (label 'source')
+
+    Returns the typed column changes. Used by both the synchronous and the
+    write-behind update paths so they accept exactly the same edits.
+    """
+    if not isinstance(data, dict):
+        raise EditError('JSON object required')
+
+    changes = {}
+    if 'amount' in data:
+        try:
+            amount = float(data['amount'])
+        except (TypeError, ValueError):
+            raise EditError('Amount must be a number')
+        if not math.isfinite(amount):
+            raise EditError('Amount must be a number')
+        changes['amount'] = amount
+    if label in data:
+        if not isinstance(data[label], str) or not data[label].strip():
+            raise EditError(f'{label.capitalize()} must be a non-empty string')
+        changes[label] = data[label]
+    if 'description' in data:
+        if data['description'] is not None and not isinstance(data['description'], str):
+            raise EditError('Description must be a string')
+        changes['description'] = data['description']
+    if 'date' in data:
+        try:
+            changes['date'] = datetime.fromisoformat(data['date']).date()
+        except (TypeError, ValueError):
+            raise EditError('Date must be an ISO date')
+    return changes
+
+
+class WriteBehindBuffer:
+    """Coalesces edits to the same row and applies them in one group commit per window
+
+    Pending edits are kept as {(shard, kind, row_id): (user_id, changes, attempts)};
+    shard is part of the key because row ids repeat across shards. A later
+    edit to a row merges into its pending changes, so ten inline edits in a
+    window cost one UPDATE and one commit. writer receives the whole map and
+    returns the keys it had to drop. A window of 0 disables buffering.
+    """
+
+    def __init__(self, writer, window=0.0, max_pending=10000):
+        self.writer = writer
+        self.window = window
+        self.max_pending = max_pending
+        self._pending = {}
+        self._users = set()
+        self._writing = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self._thread = None
+        if self.enabled:
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def put(self, shard, user_id, kind, row_id, changes):
+        """Queue changes for one of user_id's rows; returns the user's pending changes for it"""
+        key = (shard, kind, row_id)
+        with self._lock:
+            owner, previous, attempts = self._pending.get(key, (user_id, {}, 0))
+            if owner != user_id:
+                raise EditError('Row has pending edits from another user')
+            merged = {**previous, **changes}
+            self._pending[key] = (user_id, merged, attempts)
+            self._users.add(user_id)
+            self.queued += 1
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self.flush()
+        return dict(merged)
+
+    def has_pending(self, user_id):
+        """True while the user has edits queued or being written"""
+        return user_id in self._users or user_id in self._writing
+
+    def depth(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Apply every pending edit; returns the number of rows written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._writing, self._users = self._users, set()
+            if not pending:
+                return 0
+            try:
+                failed = self.writer(pending) or []
+            except Exception as e:
+                self._requeue(pending, e)
+                raise
+            finally:
+                self._writing = set()
+            self.dropped += len(failed)
+            self.written += len(pending) - len(failed)
+            self.flushes += 1
+            return len(pending) - len(failed)
+
+    def _requeue(self, pending, error):
+        # Keep the edits, with anything newer for the same row winning, unless they keep failing
+        with self._lock:
+            for key, (user_id, changes, attempts) in pending.items():
+                if attempts + 1 >= MAX_ATTEMPTS:
+                    self.dropped += 1
+                    print(f"Write-behind dropped {key[1]} {key[2]} after {MAX_ATTEMPTS} attempts: {error}")
+                    continue
+                newer = self._pending.get(key, (user_id, {}, 0))[1]
+                self._users.add(user_id)
+                self._pending[key] = (user_id, {**changes, **newer}, attempts + 1)
+
+    def _run(self):
+        while not self._stop.wait(self.window):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Write-behind flush failed: {e}")
+
+    def close(self):
+        """Stop the flush thread and write what is left"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(10)
+        for _ in range(MAX_ATTEMPTS):
+            try:
+                self.flush()
+                return
+            except Exception as e:
+                print(f"Write-behind flush at shutdown failed: {e}")
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'pending': len(self._pending),
+            'queued': self.queued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'flushes': self.flushes,
+        }
+
+
+def apply_updates(updates):
+    """Write one database's coalesced edits with the same bookkeeping as a direct update
+
+    Each row is applied in its own savepoint, so a row that cannot be stored
+    is dropped without taking the rest of the batch with it; one commit at
+    the end. Rows that were deleted or changed owner meanwhile are skipped.
+    Returns the budget alerts raised, (kind, user_id, row_id, date, amount,
+    label) tuples for refreshing the analytics cache, and the keys dropped.
+    """
+    alerts, written, failed = [], [], []
+    for kind, (model, label) in MODELS.items():
+        keys = {key[2]: key for key in updates if key[1] == kind}
+        if not keys:
+            continue
+        for row in model.query.filter(model.id.in_(list(keys))):
+            key = keys[row.id]
+            user_id, changes, _ = updates[key]
+            if row.user_id != user_id:
+                continue
+            try:
+                with db.session.begin_nested():
+                    old = (row.amount, row.date)
+                    old_label = getattr(row, label)
+                    for field, value in changes.items():
+                        setattr(row, field, value)
+                    row_alerts = []
+                    if kind == 'expenses':
+                        record_expense(row, old=(old[0], old_label))
+                        row_alerts = apply_expense_change(user_id, old=old, new=(row.amount, row.date))
+                    db.session.flush()
+            except Exception as e:
+                print(f"Write-behind dropped {kind} {row.id}: {e}")
+                failed.append(key)
+                continue
+            alerts += row_alerts
+            written.append((kind, user_id, row.id, row.date, row.amount, getattr(row, label)))
+    db.session.commit()
+    return alerts, written, failed
@@ -89,6 +89,47 @@ class FarmAPIClient {
         return this.handleResponse(response);
     }
 
+    async getExpenseAnomalies() {
+        const response = await fetch(`${this.baseURL}/api/expenses/anomalies`, {
+            headers: this.getHeaders()
+        });
+        return this.handleResponse(response);
+    }
+
+    // Recurring expense methods
+    async getRecurringExpenses() {
+        const response = await fetch(`${this.baseURL}/api/recurring-expenses`, {
+            headers: this.getHeaders()
+        });
+        return this.handleResponse(response);
+    }
+
+    async createRecurringExpense(scheduleData) {
+        const response = await fetch(`${this.baseURL}/api/recurring-expenses`, {
+            method: 'POST',
+            headers: this.getHeaders(),
+            body: JSON.stringify(scheduleData)
+        });
+        return this.handleResponse(response);
+    }
+
+    async updateRecurringExpense(scheduleId, scheduleData) {
+        const response = await fetch(`${this.baseURL}/api/recurring-expenses/${scheduleId}`, {
+            method: 'PUT',
+            headers: this.getHeaders(),
+            body: JSON.stringify(scheduleData)
+        });
+        return this.handleResponse(response);
+    }
+
+    async deleteRecurringExpense(scheduleId) {
+        const response = await fetch(`${this.baseURL}/api/recurring-expenses/${scheduleId}`, {
+            method: 'DELETE',
+            headers: this.getHeaders()
+        });
+        return this.handleResponse(response);
+    }
+
     // Revenue methods
     async getRevenues() {
         const response = await fetch(`${this.baseURL}/api/revenues`, {
@@ -140,6 +181,77 @@ class FarmAPIClient {
         return this.handleResponse(response);
     }
 
+    async updateLivestock(livestockId, livestockData) {
+        const response = await fetch(`${this.baseURL}/api/livestock/${livestockId}`, {
+            method: 'PUT',
+            headers: this.getHeaders(),
+            body: JSON.stringify(livestockData)
+        });
+        return this.handleResponse(response);
+    }
+
+    async deleteLivestock(livestockId) {
+        const response = await fetch(`${this.baseURL}/api/livestock/${livestockId}`, {
+            method: 'DELETE',
+            headers: this.getHeaders()
+        });
+        return this.handleResponse(response);
+    }
+
+    async sellLivestock(type, quantity, pricePerHead = null) {
+        const response = await fetch(`${this.baseURL}/api/livestock/bulk/sell`, {
+            method: 'POST',
+            headers: this.getHeaders(),
+            body: JSON.stringify({ type, quantity, price_per_head: pricePerHead })
+        });
+        return this.handleResponse(response);
+    }
+
+    async cullLivestock(type, quantity) {
+        const response = await fetch(`${this.baseURL}/api/livestock/bulk/cull`, {
+            method: 'POST',
+            headers: this.getHeaders(),
+            body: JSON.stringify({ type, quantity })
+        });
+        return this.handleResponse(response);
+    }
+
+    async uploadLivestockWeights(csvText) {
+        const response = await fetch(`${this.baseURL}/api/livestock/bulk/weights`, {
+            method: 'POST',
+            headers: { ...this.getHeaders(), 'Content-Type': 'text/csv' },
+            body: csvText
+        });
+        return this.handleResponse(response);
+    }
+
+    async sendTelemetry(readings, sync = false) {
+        const body = readings.map(reading => JSON.stringify(reading)).join('\n');
+        const response = await fetch(`${this.baseURL}/api/livestock/telemetry${sync ? '?sync=1' : ''}`, {
+            method: 'POST',
+            headers: { ...this.getHeaders(), 'Content-Type': 'application/x-ndjson' },
+            body
+        });
+        return this.handleResponse(response);
+    }
+
+    async getLivestockTelemetry(livestockId, metric = 'weight_kg', resolution = 'hour', start = null, end = null) {
+        const params = new URLSearchParams({ metric, resolution });
+        if (start) params.set('start', start);
+        if (end) params.set('end', end);
+        const response = await fetch(`${this.baseURL}/api/livestock/${livestockId}/telemetry?${params}`, {
+            headers: this.getHeaders()
+        });
+        return this.handleResponse(response);
+    }
+
+    async getLivestockValuation(horizon = 12) {
+        const response = await fetch(`${this.baseURL}/api/livestock/valuation?horizon=${horizon}`, {
+            headers: this.getHeaders()
+        });
+        return this.handleResponse(response);
+    }
+
     // Budget methods
     async getBudget() {
         const response = await fetch(`${this.baseURL}/api/budget`, {
@@ -165,6 +277,51 @@ class FarmAPIClient {
         return this.handleResponse(response);
     }
 
+    // Search methods
+    async search(query, types = [], page = 1, perPage = 20) {
+        const params = new URLSearchParams({ q: query, page, per_page: perPage });
+        if (types.length) {
+            params.set('types', types.join(','));
+        }
+        const response = await fetch(`${this.baseURL}/api/search?${params}`, {
+            headers: this.getHeaders()
+        });
+        return this.handleResponse(response);
+    }
+
+    async getAnalyticsGroupBy(kind = 'expenses', by = 'category') {
+        const response = await fetch(`${this.baseURL}/api/analytics/groupby?kind=${kind}&by=${by}`, {
+            headers: this.getHeaders()
+        });
+        return this.handleResponse(response);
+    }
+
+    async getMonthlyAnalytics() {
+        const response = await fetch(`${this.baseURL}/api/analytics/monthly`, {
+            headers: this.getHeaders()
+        });
+        return this.handleResponse(response);
+    }
+
+    // Report methods
+    async getProfitLossReport(period = 'month', start = null, end = null) {
+        return this.getReport('profit-loss', period, start, end);
+    }
+
+    async getCashFlowReport(period = 'month', start = null, end = null) {
+        return this.getReport('cash-flow', period, start, end);
+    }
+
+    async getReport(statement, period, start, end) {
+        const params = new URLSearchParams({ period });
+        if (start) params.set('start', start);
+        if (end) params.set('end', end);
+        const response = await fetch(`${this.baseURL}/api/reports/${statement}?${params}`, {
+            headers: this.getHeaders()
+        });
+        return this.handleResponse(response);
+    }
+
     // ML Prediction methods
     async predictExpenses(predictionData) {
         const response = await fetch(`${this.baseURL}/api/predict`, {
@@ -175,6 +332,15 @@ class FarmAPIClient {
         return this.handleResponse(response);
     }
 
+    async simulateScenarios(scenarioData) {
+        const response = await fetch(`${this.baseURL}/api/predict/scenarios`, {
+            method: 'POST',
+            headers: this.getHeaders(),
+            body: JSON.stringify(scenarioData)
+        });
+        return this.handleResponse(response);
+    }
+
     // Utility methods
     getHeaders() {
         const headers = {
@@ -191,7 +357,11 @@ class FarmAPIClient {
         if (contentType && contentType.includes('application/json')) {
             const data = await response.json();
             if (!response.ok) {
-                throw new Error(data.error || `HTTP ${response.status}`);
+                const error = new Error(data.error || `HTTP ${response.status}`);
+                if (response.status === 429) {
+                    error.retryAfter = Number(response.headers.get('Retry-After')) || 1;
+                }
+                throw error;
             }
             return data;
         } else {
@@ -216,6 +386,28 @@ class FarmAPIClient {
             };
         }
     }
+
+    async readinessCheck() {
+        // 503 still carries the status, so read the body either way
+        try {
+            const response = await fetch(`${this.baseURL}/api/ready`);
+            return { ready: response.ok, ...(await response.json()) };
+        } catch (error) {
+            return {
+                ready: false,
+                error: error.message,
+                status: 'API server not reachable'
+            };
+        }
+    }
+
+    // Full readiness checks, queue depths and cache stats (requires login)
+    async readinessDetails() {
+        const response = await fetch(`${this.baseURL}/api/ready/details`, {
+            headers: this.getHeaders()
+        });
+        return { ready: response.ok, ...(await response.json()) };
+    }
 }
 
 // Global API client instance